@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download_manager import DownloadManager, LocalStreamProvider
+
+
+def run(source_dir, count, workers, rate):
+    with tempfile.TemporaryDirectory() as out_dir:
+        provider = LocalStreamProvider(source_dir, bytes_per_second=rate)
+        manager = DownloadManager(provider, out_dir, workers=workers,
+                                  on_complete=lambda item, result: os.remove(result["path"]))
+        manager.start()
+        start = time.perf_counter()
+        for i in range(count):
+            manager.enqueue(f"track{i}", f"Track {i}", f"local://track{i}")
+        manager.wait_idle()
+        elapsed = time.perf_counter() - start
+        manager.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch download throughput against a throttled local provider")
+    parser.add_argument("--tracks", type=int, default=16)
+    parser.add_argument("--size", type=int, default=2 * 1024 * 1024, help="bytes per track")
+    parser.add_argument("--rate", type=int, default=8 * 1024 * 1024, help="bytes/s per stream")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as source_dir:
+        payload = os.urandom(args.size)
+        for i in range(args.tracks):
+            with open(Path(source_dir) / f"track{i}.m4a", 'wb') as f:
+                f.write(payload)
+
+        total_mb = args.tracks * args.size / (1024 * 1024)
+        print(f"{'workers':>7} {'seconds':>8} {'MB/s':>8} {'tracks/s':>9}")
+        for workers in args.workers:
+            elapsed = run(source_dir, args.tracks, workers, args.rate)
+            print(f"{workers:>7} {elapsed:>8.2f} {total_mb / elapsed:>8.1f} {args.tracks / elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
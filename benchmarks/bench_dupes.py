@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from content_store import AUDIO_MATCH, FINGERPRINT_FRAME, FINGERPRINT_RATE, fingerprint_similarity, pcm_fingerprint
+
+
+def make_track(seed, seconds):
+    # Noise under an envelope that moves every frame or so, standing in
+    # for music, as mono s16le at the fingerprint rate.
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    steps = seconds * FINGERPRINT_RATE // FINGERPRINT_FRAME + 1
+    envelope = np.repeat(rng.uniform(0.05, 1.0, steps), FINGERPRINT_FRAME)[:seconds * FINGERPRINT_RATE]
+    return envelope * rng.normal(0, 0.25, len(envelope))
+
+
+def pcm(samples):
+    import numpy as np
+
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def best_of(runs, callback, *args):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        callback(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio fingerprints for duplicate detection: speed, and "
+                                                 "whether shifted copies match and other tracks don't")
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--shift", type=int, default=5, help="frames the copy starts later")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("numpy is not installed", file=sys.stderr)
+        sys.exit(1)
+
+    track = make_track(1, args.seconds)
+    original = pcm_fingerprint(pcm(track))
+    # The same recording cut a little later, quieter and with some hiss,
+    # as another upload of it would be.
+    rng = np.random.default_rng(2)
+    cut = args.shift * FINGERPRINT_FRAME
+    later = track[cut:] * 0.5 + rng.normal(0, 0.002, len(track) - cut)
+    earlier = np.concatenate([make_track(4, 1)[:cut], track])
+    cases = [
+        ("same audio", original),
+        (f"copy {args.shift} frames later", pcm_fingerprint(pcm(later))),
+        (f"copy {args.shift} frames earlier", pcm_fingerprint(pcm(earlier))),
+        ("unrelated audio", pcm_fingerprint(pcm(make_track(3, args.seconds)))),
+    ]
+    failed = False
+    for name, fingerprint in cases:
+        score = fingerprint_similarity(original, fingerprint)
+        expected = name != "unrelated audio"
+        ok = (score >= AUDIO_MATCH) == expected
+        failed |= not ok
+        print(f"{name:<28} {score:.3f} {'match' if score >= AUDIO_MATCH else 'different'}"
+              f"{'' if ok else '  WRONG'}")
+
+    data = pcm(track)
+    print(f"fingerprint of {args.seconds}s of audio: {best_of(args.runs, pcm_fingerprint, data) * 1000:.1f} ms")
+    print(f"comparison: {best_of(args.runs, fingerprint_similarity, original, cases[3][1]) * 1000:.2f} ms")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames of
+# 1152 samples each.
+FRAME_HEADER = bytes.fromhex("FFFB9064")
+FRAME = FRAME_HEADER + bytes(417 - len(FRAME_HEADER))
+
+
+def id3_frame(frame_id, text):
+    body = b"\x00" + text.encode("latin-1")
+    return frame_id.encode() + struct.pack(">I", len(body)) + b"\x00\x00" + body
+
+
+def id3_tag(title, artist, album):
+    frames = id3_frame("TIT2", title) + id3_frame("TPE1", artist) + id3_frame("TALB", album)
+    size = len(frames)
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x03\x00\x00" + syncsafe + frames
+
+
+def make_corpus(root, files, frames):
+    # artist/album/NN title.mp3, twelve tracks per album, a few albums
+    # per artist.
+    for i in range(files):
+        artist, album = f"Artist {i // 48}", f"Album {i // 12}"
+        folder = Path(root) / artist / album
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(folder / f"{i % 12 + 1:02d} Track {i}.mp3", 'wb') as f:
+            f.write(id3_tag(f"Track {i}", artist, album))
+            f.write(FRAME * frames)
+
+
+def run_import(music_dir, corpus, workers):
+    from core import MusicCore
+
+    core = MusicCore(music_dir)
+    core.load()
+    start = time.perf_counter()
+    added, updated = core.import_files([corpus], workers=workers)
+    elapsed = time.perf_counter() - start
+    core.close(wait=True)
+    return elapsed, len(added), len(updated)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import of a generated MP3 folder: cold, unchanged and touched")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--frames", type=int, default=20, help="MP3 frames per file (~26 ms each)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--touch", type=float, default=0.01, help="fraction of files changed before the last run")
+    args = parser.parse_args()
+
+    try:
+        import mutagen  # noqa: F401
+    except ImportError:
+        print("mutagen is not installed; tags can't be read", file=sys.stderr)
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as corpus:
+        make_corpus(corpus, args.files, args.frames)
+        print(f"{'workers':>7} {'run':<10} {'seconds':>8} {'files/s':>9} {'added':>7} {'updated':>8}")
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as music_dir:
+                runs = [("cold", None), ("unchanged", None), ("touched", args.touch)]
+                for name, touch in runs:
+                    if touch:
+                        paths = sorted(Path(corpus).rglob("*.mp3"))
+                        for path in paths[::max(1, int(1 / touch))]:
+                            with open(path, 'ab') as f:
+                                f.write(FRAME)
+                    elapsed, added, updated = run_import(music_dir, corpus, workers)
+                    print(f"{workers:>7} {name:<10} {elapsed:>8.2f} {args.files / elapsed:>9.0f} "
+                          f"{added:>7} {updated:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from library_store import JSONLibraryStore, SQLiteLibraryStore
+
+
+def make_entries(n, offset=0):
+    for i in range(offset, offset + n):
+        title = f"Artist {i % 997} - Track {i}"
+        yield title, {
+            "filename": f"track_{i}.mp3",
+            "path": f"/music/track_{i}.mp3",
+            "duration": 180 + i % 240,
+        }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench(store_cls, filename, size, ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = store_cls(Path(tmp) / filename)
+        store.put_many(make_entries(size))
+        store.close()
+
+        store = store_cls(Path(tmp) / filename)
+        load = timed(store.load)
+
+        new_entries = list(make_entries(ops, offset=size))
+        start = time.perf_counter()
+        for title, entry in new_entries:
+            store.put(title, entry)
+        insert = (time.perf_counter() - start) / ops
+
+        start = time.perf_counter()
+        for title, _ in new_entries:
+            store.delete(title)
+        delete = (time.perf_counter() - start) / ops
+        store.close()
+    return load, insert, delete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library backend load/insert/delete costs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'tracks':>8} {'load ms':>10} {'insert ms':>10} {'delete ms':>10}")
+    for size in args.sizes:
+        for name, cls, filename in (("json", JSONLibraryStore, "library.json"),
+                                    ("sqlite", SQLiteLibraryStore, "library.db")):
+            load, insert, delete = bench(cls, filename, size, args.ops)
+            print(f"{name:<8} {size:>8} {load * 1000:>10.2f} {insert * 1000:>10.3f} {delete * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
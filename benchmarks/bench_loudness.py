@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loudness import analyze_file, analyze_many
+
+
+def write_wav(path, samples, rate):
+    import numpy as np
+
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def make_tracks(folder, tracks, seconds, rate):
+    # Noise at a different level per track, standing in for music.
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    paths = []
+    for i in range(tracks):
+        level = 10 ** (-(6 + i % 24) / 20)
+        path = Path(folder) / f"track{i}.wav"
+        write_wav(path, rng.normal(0, level / 3, (rate * seconds, 2)), rate)
+        paths.append(path)
+    return paths
+
+
+def reference_check(folder, rate):
+    # EBU Tech 3341 case 1: a 1 kHz stereo sine at -23 dBFS reads -23 LUFS.
+    import numpy as np
+
+    t = np.arange(rate * 20) / rate
+    sine = np.sin(2 * np.pi * 1000 * t) * 10 ** (-23 / 20)
+    path = Path(folder) / "reference.wav"
+    write_wav(path, np.stack([sine, sine], axis=1), rate)
+    return analyze_file(path)["lufs"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loudness analysis throughput over the process pool")
+    parser.add_argument("--tracks", type=int, default=16)
+    parser.add_argument("--seconds", type=int, default=180)
+    parser.add_argument("--rate", type=int, default=44100)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("numpy is not installed", file=sys.stderr)
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"reference sine: {reference_check(folder, args.rate):.2f} LUFS (expected -23.00)")
+        paths = make_tracks(folder, args.tracks, args.seconds, args.rate)
+        audio = args.tracks * args.seconds
+        print(f"{'workers':>7} {'seconds':>8} {'x realtime':>11} {'tracks/s':>9}")
+        for workers in args.workers:
+            start = time.perf_counter()
+            results = list(analyze_many(paths, workers=workers))
+            elapsed = time.perf_counter() - start
+            assert all(result is not None for _, result in results)
+            print(f"{workers:>7} {elapsed:>8.2f} {audio / elapsed:>11.0f} {args.tracks / elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
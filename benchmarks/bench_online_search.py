@@ -0,0 +1,84 @@
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from online_search import LocalSearchProvider, OnlineSearch, SearchCache
+
+
+WORDS = ("love", "night", "heart", "dance", "fire", "dream", "summer", "river",
+         "golden", "shadow", "city", "lights", "remix", "live", "acoustic")
+
+
+def make_catalog(n):
+    return [(f"vid{i:06d}", f"Artist {i % 97} - {WORDS[i % len(WORDS)]} {WORDS[(i * 7) % len(WORDS)]} {i}")
+            for i in range(n)]
+
+
+def timed_search(search, query, page):
+    done = threading.Event()
+    out = {}
+
+    def on_results(results, q, p):
+        out["results"] = results
+        done.set()
+
+    start = time.perf_counter()
+    search.search(query, page, on_results=on_results, on_error=lambda e: done.set())
+    done.wait()
+    return time.perf_counter() - start, out.get("results", [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online search: cache, prefetch and coalescing")
+    parser.add_argument("--catalog", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.3, help="simulated seconds per request")
+    parser.add_argument("--pages", type=int, default=4)
+    args = parser.parse_args()
+
+    provider = LocalSearchProvider(make_catalog(args.catalog), latency=args.latency)
+    search = OnlineSearch(provider, SearchCache())
+    queries = ["night", "dance", "remix"]
+
+    for label, think in (("paging, no pause", 0.0), ("paging, reading page", args.latency * 1.5)):
+        search.cache.entries.clear()
+        for query in queries:
+            waits = []
+            for page in range(args.pages):
+                elapsed, _ = timed_search(search, query, page)
+                waits.append(elapsed)
+                time.sleep(think)
+            print(f"{label:<22} {query!r:<16} " +
+                  " ".join(f"p{page}={wait * 1000:6.1f}ms" for page, wait in enumerate(waits)))
+
+    calls = provider.calls
+    for query in queries:
+        elapsed, _ = timed_search(search, query, 0)
+        print(f"{'repeat (cached)':<22} {query!r:<16} p0={elapsed * 1000:6.1f}ms")
+    print(f"provider calls for repeats: {provider.calls - calls}")
+
+    # Identical requests fired together share one provider call.
+    search.cache.entries.clear()
+    calls = provider.calls
+    futures = [search.fetch("dance", 0) for _ in range(8)]
+    for future in futures:
+        future.result()
+    print(f"8 concurrent identical fetches -> {provider.calls - calls} provider call(s)")
+
+    # Typing fast: only the last query's results are delivered.
+    search.cache.entries.clear()
+    delivered = []
+    for prefix in ("s", "su", "sum", "summ", "summe", "summer"):
+        search.search(prefix, on_results=lambda r, q, p: delivered.append(q), prefetch=False)
+        time.sleep(args.latency / 10)
+    time.sleep(args.latency * 3)
+    print(f"typed 6 prefixes -> delivered {delivered}")
+
+    search.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from play_queue import PlayQueue
+
+
+def bench_list(size, ops, rng):
+    queue = list(range(size))
+    start = time.perf_counter()
+    for _ in range(ops):
+        src = rng.randrange(len(queue))
+        queue.insert(rng.randrange(len(queue)), queue.pop(src))
+        del queue[rng.randrange(len(queue))]
+        queue.append(rng.randrange(size))
+        queue.insert(0, rng.randrange(size))
+        queue.pop(0)
+    return time.perf_counter() - start
+
+
+def bench_play_queue(size, ops, rng):
+    queue = PlayQueue()
+    queue.set_context(range(size))
+    entries = list(queue.entries())
+    start = time.perf_counter()
+    for _ in range(ops):
+        # Entry ids come from whatever row the user clicked, so picking
+        # them from a snapshot is fair; stale ones are skipped.
+        entry_id, after = rng.choice(entries), rng.choice(entries)
+        if entry_id in queue and after in queue:
+            queue.move(entry_id, after)
+        victim = rng.choice(entries)
+        if victim in queue:
+            queue.remove(victim)
+        entries.append(queue.append(rng.randrange(size)))
+        queue.add_next(rng.randrange(size))
+        queue.advance()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play queue edits: Python list vs PlayQueue")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'list us/op':>11} {'PlayQueue us/op':>16}  (move + remove + append + play next + advance)")
+    for size in args.sizes:
+        list_time = bench_list(size, args.ops, random.Random(args.seed))
+        queue_time = bench_play_queue(size, args.ops, random.Random(args.seed))
+        print(f"{size:>8} {list_time / args.ops * 1e6:>11.1f} {queue_time / args.ops * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
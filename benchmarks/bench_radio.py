@@ -0,0 +1,108 @@
+import argparse
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from features import DIMS, FeatureExtractor
+from similarity import FeatureStore, Radio, SimilarityIndex
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def timed(callback, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        callback(i)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    print(f"{name:<34} {percentile(times, 0.5) * 1000:>9.2f} {percentile(times, 0.99) * 1000:>9.2f}")
+
+
+def extraction_speed(seconds, rate=44100):
+    # A drum-like pulse over noise, fed in ten-second blocks as decoded
+    # audio arrives.
+    rng = np.random.default_rng(1)
+    t = np.arange(rate * seconds) / rate
+    pulse = np.exp(-(t % (60 / 124)) * 40) * np.sin(2 * np.pi * 70 * t)
+    mono = (0.6 * pulse + 0.05 * rng.normal(size=len(t))).astype(np.float32)
+    block = np.stack([mono, mono], axis=1)
+    start = time.perf_counter()
+    extractor = FeatureExtractor(rate, 2)
+    for i in range(0, len(block), rate * 10):
+        extractor.add(block[i:i + rate * 10])
+    extractor.result()
+    elapsed = time.perf_counter() - start
+    return seconds / elapsed, extractor.tempo()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Radio mode: nearest-neighbour queries over a memory-mapped "
+                                                 "embedding matrix, incremental updates and feature extraction")
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--clusters", type=int, default=200, help="groups of similar-sounding tracks")
+    parser.add_argument("--seconds", type=int, default=60, help="audio for the extraction timing")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids = [str(uuid.uuid4()) for _ in range(args.tracks)]
+    centers = rng.normal(size=(args.clusters, DIMS)) * 3
+    vectors = (centers[np.arange(args.tracks) % args.clusters]
+               + rng.normal(size=(args.tracks, DIMS))).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as folder:
+        prefix = Path(folder) / "features"
+        index = SimilarityIndex(FeatureStore(prefix))
+        start = time.perf_counter()
+        index.add_many(zip(ids, vectors))
+        print(f"{args.tracks} tracks added one by one in {time.perf_counter() - start:.2f}s")
+        index.close()
+
+        start = time.perf_counter()
+        index = SimilarityIndex(FeatureStore(prefix))
+        print(f"reopened in {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"{Path(f'{prefix}.f32').stat().st_size / 1e6:.1f} MB matrix")
+
+        picks = rng.integers(0, args.tracks, args.queries)
+        recent = ids[:200]
+        print(f"{'':<34} {'p50 ms':>9} {'p99 ms':>9}")
+        report("nearest 10, one seed", timed(lambda i: index.nearest([ids[picks[i]]], 10), args.queries))
+        report("nearest 16, five seeds, 200 out", timed(
+            lambda i: index.nearest(ids[picks[i]:picks[i] + 5], 16, weights=[0.13, 0.22, 0.36, 0.6, 1.0],
+                                    exclude=recent), args.queries))
+
+        radio = Radio(index, seeds=[ids[0]], seed=1)
+
+        def pick(i):
+            radio.mark_played(radio.advance())
+
+        report("radio pick", timed(pick, args.queries))
+        same = sum(ids.index(track_id) % args.clusters == 0 for track_id in list(radio.played)[:50])
+        print(f"{same} of the first 50 radio tracks from the seed's cluster")
+
+        fresh = (centers[rng.integers(0, args.clusters, args.queries)]
+                 + rng.normal(size=(args.queries, DIMS))).astype(np.float32)
+        new_ids = [str(uuid.uuid4()) for _ in range(args.queries)]
+        report("add a track", timed(lambda i: index.add(new_ids[i], fresh[i]), args.queries))
+        report("delete a track", timed(lambda i: index.remove(new_ids[i]), args.queries))
+        index.close()
+
+    speed, bpm = extraction_speed(args.seconds)
+    print(f"feature extraction: {speed:.0f}x real time (tempo read as {bpm:.1f} BPM, played at 124)")
+
+
+if __name__ == "__main__":
+    main()
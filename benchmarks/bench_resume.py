@@ -0,0 +1,150 @@
+import argparse
+import base64
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download_manager import DONE, DownloadManager, HTTPProvider
+
+
+class FlakyServer(ThreadingHTTPServer):
+    # Serves in-memory files with Range, ETag and Digest support. Each
+    # response is cut off part way with probability `drop`, and sends at
+    # most `rate` bytes/s, to stand in for a bad connection.
+    daemon_threads = True
+
+    def __init__(self, files, drop=0.0, rate=None, seed=1):
+        super().__init__(("127.0.0.1", 0), FlakyHandler)
+        self.files = files
+        self.drop = drop
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-response when a download is stopped.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        start, end = 0, len(data) - 1
+        ranged = "Range" in self.headers and self.headers.get("If-Range", etag) == etag
+        if ranged:
+            first, _, last = self.headers["Range"].removeprefix("bytes=").partition("-")
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.end_headers()
+                return
+        body = data[start:end + 1]
+        self.send_response(206 if ranged else 200)
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Digest", "sha-256=" + base64.b64encode(hashlib.sha256(data).digest()).decode())
+        self.end_headers()
+
+        with server.lock:
+            server.requests += 1
+            cut = server.rng.randrange(len(body)) if body and server.rng.random() < server.drop else None
+        to_send = body[:cut] if cut is not None else body
+        for i in range(0, len(to_send), 64 * 1024):
+            chunk = to_send[i:i + 64 * 1024]
+            self.wfile.write(chunk)
+            with server.lock:
+                server.bytes_sent += len(chunk)
+            if server.rate:
+                time.sleep(len(chunk) / server.rate)
+        if cut is not None:
+            self.close_connection = True
+
+
+def run(files, drop, chunk, crash_after=None):
+    server = FlakyServer(files, drop=drop, rate=32 * 1024 * 1024 if crash_after else None)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as out_dir:
+        results = {}
+        state = Path(out_dir) / "downloads.json"
+
+        def keep(item, result):
+            with open(result["path"], 'rb') as f:
+                results[item.video_id] = hashlib.sha256(f.read()).hexdigest()
+            os.remove(result["path"])
+
+        def manager():
+            return DownloadManager(HTTPProvider(chunk_size=chunk), out_dir, state_path=state,
+                                   workers=4, backoff=0.05, max_attempts=10, on_complete=keep)
+
+        start = time.perf_counter()
+        downloads = manager()
+        downloads.start()
+        for name in files:
+            downloads.enqueue(Path(name).stem, name, f"{server.url}/{name}")
+        restarts = 0
+        if crash_after:
+            # Stop part way through and start a new manager on the same
+            # directory, as after a crash or quitting the app.
+            time.sleep(crash_after)
+            downloads.stop()
+            restarts += 1
+            downloads = manager()
+            downloads.start()
+        downloads.wait_idle()
+        elapsed = time.perf_counter() - start
+        ok = all(downloads.get(Path(name).stem).state == DONE and
+                 results.get(Path(name).stem) == hashlib.sha256(data).hexdigest()
+                 for name, data in files.items())
+        downloads.stop()
+    server.shutdown()
+    server.server_close()
+    return elapsed, server.bytes_sent, server.requests, restarts, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranged, resumable downloads against a flaky local HTTP server")
+    parser.add_argument("--tracks", type=int, default=8)
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="bytes per track")
+    parser.add_argument("--chunk", type=int, default=1024 * 1024, help="bytes per range request")
+    parser.add_argument("--drops", type=float, nargs="+", default=[0.0, 0.1, 0.3])
+    args = parser.parse_args()
+
+    files = {f"track{i}.m4a": os.urandom(args.size) for i in range(args.tracks)}
+    total = args.tracks * args.size
+    print(f"{'scenario':<18} {'seconds':>8} {'requests':>9} {'sent/size':>10} {'verified':>9}")
+    scenarios = [(f"drop {drop:.0%}", drop, None) for drop in args.drops]
+    scenarios.append(("restart midway", 0.0, 0.1))
+    for name, drop, crash_after in scenarios:
+        elapsed, sent, requests, restarts, ok = run(files, drop, args.chunk, crash_after)
+        print(f"{name:<18} {elapsed:>8.2f} {requests:>9} {sent / total:>10.2f} {'yes' if ok else 'NO':>9}")
+
+
+if __name__ == "__main__":
+    main()
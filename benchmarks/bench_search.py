@@ -0,0 +1,89 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from search_index import MIN_SUBSTRING_LENGTH, SearchIndex, tokenize
+
+
+WORDS = ("love", "night", "heart", "dance", "fire", "dream", "summer", "river",
+         "golden", "shadow", "city", "lights", "remix", "live", "acoustic",
+         "forever", "wild", "blue", "electric", "midnight", "paradise", "storm")
+SYLLABLES = ("ka", "lo", "mi", "ra", "ten", "vor", "sul", "an", "de", "ri",
+             "mo", "ba", "sha", "ne", "tor", "li", "gen", "ul", "pa", "zo")
+
+
+def make_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_titles(n, rng):
+    artists = [f"{make_word(rng).title()} {make_word(rng).title()}" for _ in range(n // 10 + 1)]
+    vocab = list(WORDS) + [make_word(rng) for _ in range(5000)]
+    return [f"{rng.choice(artists)} - "
+            f"{' '.join(rng.choice(vocab) for _ in range(rng.randint(2, 4))).title()}"
+            for _ in range(n)]
+
+
+def keystrokes(queries):
+    for query in queries:
+        for i in range(1, len(query) + 1):
+            yield query[:i]
+
+
+def linear_scan(titles, query):
+    query_lower = query.lower()
+    return [title for title in titles if query_lower in title.lower()]
+
+
+def missed(index, titles, queries):
+    # Titles the substring scan finds that the index doesn't, for queries
+    # whose first word is long enough to be matched inside a word.
+    total = 0
+    for query in queries:
+        tokens = tokenize(query)
+        if tokens and len(tokens[0]) >= MIN_SUBSTRING_LENGTH:
+            total += len(set(linear_scan(titles, query)) - set(index.search(query)))
+    return total
+
+
+def measure(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.mean(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library search: linear scan vs index")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = list(keystrokes(["midnight city", "golden river", "electric dreams", "kalomi vor",
+                               "ight cit", "ectric dre", "lomi"]))
+
+    print(f"{'tracks':>8} {'build ms':>9} {'scan mean':>10} {'scan p99':>9} "
+          f"{'index mean':>11} {'index p99':>10} {'missed':>7}  (ms per keystroke)")
+    for size in args.sizes:
+        titles = make_titles(size, rng)
+        start = time.perf_counter()
+        index = SearchIndex(titles)
+        build = time.perf_counter() - start
+        scan_mean, scan_p99 = measure(lambda q: linear_scan(titles, q), queries)
+        index_mean, index_p99 = measure(lambda q: index.search(q, limit=args.limit), queries)
+        print(f"{size:>8} {build * 1000:>9.1f} {scan_mean * 1000:>10.3f} {scan_p99 * 1000:>9.3f} "
+              f"{index_mean * 1000:>11.3f} {index_p99 * 1000:>10.3f} {missed(index, titles, queries):>7}")
+
+
+if __name__ == "__main__":
+    main()
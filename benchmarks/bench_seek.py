@@ -0,0 +1,124 @@
+import argparse
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from seek_table import SeekTableCache, build_seek_table, parse_header
+
+
+def write_vbr_mp3(path, minutes, rng):
+    # MPEG-1 Layer III, 44.1 kHz, random bitrate per frame. Payloads are
+    # zeroed: enough for anything that only walks frame headers.
+    frames = int(minutes * 60 * 44100 / 1152)
+    with open(path, 'wb') as f:
+        f.write(b"ID3\x04\x00\x00\x00\x00\x00\x00")
+        info = (0x7FF << 21) | (3 << 19) | (1 << 17) | (1 << 16) | (9 << 12)
+        length = parse_header(info)[0]
+        f.write(struct.pack(">I", info) + b"\x00" * 32 + b"Xing" + b"\x00" * (length - 40))
+        for _ in range(frames):
+            header = (0x7FF << 21) | (3 << 19) | (1 << 17) | (1 << 16) | (rng.randint(1, 14) << 12)
+            length = parse_header(header)[0]
+            f.write(struct.pack(">I", header) + b"\x00" * (length - 4))
+    return frames
+
+
+def scan_to(path, seconds):
+    # What a decoder without an index does: walk headers from the start.
+    target = int(seconds * 44100 / 1152)
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 10
+    frame = -1
+    while frame < target and pos + 4 <= len(data):
+        length = parse_header(struct.unpack_from(">I", data, pos)[0])[0]
+        pos += length
+        frame += 1
+    return pos
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.99) - 1)]
+
+
+def pygame_seeks(path, positions):
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    pygame.mixer.init()
+    pygame.mixer.music.load(path)
+    pygame.mixer.music.play()
+    set_pos, reload = [], []
+    for pos in positions:
+        start = time.perf_counter()
+        pygame.mixer.music.set_pos(pos)
+        set_pos.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        pygame.mixer.music.stop()
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.play(start=pos)
+        reload.append(time.perf_counter() - start)
+    pygame.mixer.quit()
+    return set_pos, reload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seek latency across a long synthetic VBR MP3")
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--seeks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pygame", action="store_true", help="also time pygame set_pos vs reload")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "long_vbr.mp3"
+        frames = write_vbr_mp3(path, args.minutes, rng)
+        size_mb = path.stat().st_size / (1024 * 1024)
+
+        start = time.perf_counter()
+        table = build_seek_table(path)
+        build = time.perf_counter() - start
+        assert table.frame_count == frames, (table.frame_count, frames)
+
+        cache = SeekTableCache()
+        cache.get(path)
+        duration = table.duration
+        positions = [rng.uniform(0, duration) for _ in range(args.seeks)]
+
+        lookups = []
+        for pos in positions:
+            start = time.perf_counter()
+            snapped, offset = cache.get(path).lookup(pos)
+            lookups.append(time.perf_counter() - start)
+            assert abs(snapped - pos) < table.frame_duration
+
+        scans = []
+        for pos in positions[:20]:
+            start = time.perf_counter()
+            scan_to(path, pos)
+            scans.append(time.perf_counter() - start)
+
+        print(f"{args.minutes:g} min VBR file, {frames} frames, {size_mb:.1f} MB")
+        print(f"table build (once per track): {build * 1000:.1f} ms, "
+              f"{table.frame_count * table.offsets.itemsize / 1024:.0f} KB")
+        p50, p99 = percentiles(lookups)
+        print(f"cached lookup:   p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us")
+        p50, p99 = percentiles(scans)
+        print(f"scan from start: p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us")
+
+        if args.pygame:
+            set_pos, reload = pygame_seeks(str(path), positions[:50])
+            for name, samples in (("pygame set_pos", set_pos), ("stop+load+play", reload)):
+                p50, p99 = percentiles(samples)
+                print(f"{name:<15}: p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
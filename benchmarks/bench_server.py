@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import MusicCore
+from library_server import LibraryServer
+
+
+WORDS = ("night", "drive", "summer", "blue", "echo", "river", "gold", "static", "fire", "glass",
+         "ocean", "city", "ghost", "neon", "paper", "heart", "storm", "velvet", "signal", "moon")
+
+# ETag of every track, for the revalidation requests.
+etags = {}
+
+
+def make_library(folder, tracks, size, rng):
+    # Random bytes stand in for audio; the server never decodes anything.
+    core = MusicCore(folder)
+    core.load()
+    audio = Path(folder) / "audio"
+    audio.mkdir()
+    block = os.urandom(size)
+    for i in range(tracks):
+        path = audio / f"{i}.mp3"
+        path.write_bytes(block[i % 997:] + block[:i % 997])
+        title = f"Artist {i % 50} - {' '.join(rng.sample(WORDS, 3))} {i}"
+        core.library[title] = {"filename": path.name, "path": str(path), "duration": 180}
+        core._index_entry(title, core.library[title])
+    core.search_index.add_many(list(core.library))
+    return core
+
+
+async def request(reader, writer, target, headers=()):
+    # One keep-alive request; returns (status, seconds to first byte,
+    # body bytes).
+    lines = [f"GET {target} HTTP/1.1", "Host: bench", *headers]
+    start = time.perf_counter()
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    ttfb = time.perf_counter() - start
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.decode("latin-1").split("\r\n"):
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    status = int(status_line.split()[1])
+    received = 0
+    while received < length and status != 304:
+        chunk = await reader.read(min(1024 * 1024, length - received))
+        if not chunk:
+            raise ConnectionError("closed mid-body")
+        received += len(chunk)
+    return status, ttfb, received
+
+
+async def client(host, port, track_ids, queries, requests, size, rng, results):
+    # A listener: mostly range requests walking through tracks (what an
+    # audio element does), some whole files, revalidations and searches,
+    # all on one connection.
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(requests):
+            pick = rng.random()
+            track = rng.choice(track_ids)
+            if pick < 0.6:
+                start = rng.randrange(0, size, 64 * 1024)
+                target, headers = f"/tracks/{track}", [f"Range: bytes={start}-{start + 256 * 1024 - 1}"]
+                kind = "range"
+            elif pick < 0.75:
+                target, headers, kind = f"/tracks/{track}", [], "full"
+            elif pick < 0.85:
+                target, headers, kind = f"/tracks/{track}", [f"If-None-Match: {etags[track]}"], "revalidate"
+            else:
+                query = urllib.parse.quote(rng.choice(queries))
+                target, headers, kind = f"/search?q={query}&page={rng.randrange(3)}", [], "search"
+            status, ttfb, received = await request(reader, writer, target, headers)
+            results.append((kind, status, ttfb, received))
+    finally:
+        writer.close()
+
+
+async def prepare_etags(host, port, track_ids):
+    reader, writer = await asyncio.open_connection(host, port)
+    for track in track_ids:
+        writer.write(f"HEAD /tracks/{track} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.lower() == "etag":
+                etags[track] = value.strip()
+    writer.close()
+
+
+async def load(host, port, clients, requests, track_ids, size, seed):
+    queries = list(WORDS) + [f"artist {i}" for i in range(10)]
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, track_ids, queries, requests, size,
+                                  random.Random(seed + i), results) for i in range(clients)))
+    return results, time.perf_counter() - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent streams against the library HTTP server")
+    parser.add_argument("--tracks", type=int, default=200)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="bytes per track")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--requests", type=int, default=20, help="per client")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        core = make_library(folder, args.tracks, args.size, rng)
+        server = LibraryServer(core, "127.0.0.1", 0).start()
+        track_ids = [entry["id"] for entry in core.library.values()]
+        asyncio.run(prepare_etags(server.host, server.port, track_ids))
+
+        print(f"{args.tracks} tracks of {args.size / 1e6:.1f} MB, {args.requests} keep-alive requests per client")
+        print(f"{'clients':>8} {'req/s':>8} {'MB/s':>8} {'p50 ttfb ms':>12} {'p99 ttfb ms':>12} {'errors':>7}")
+        for clients in args.clients:
+            results, elapsed = asyncio.run(load(server.host, server.port, clients, args.requests,
+                                                track_ids, args.size, args.seed))
+            expected = {"range": 206, "full": 200, "revalidate": 304, "search": 200}
+            errors = sum(status != expected[kind] for kind, status, _, _ in results)
+            ttfbs = [ttfb for _, _, ttfb, _ in results]
+            received = sum(size for _, _, _, size in results)
+            print(f"{clients:>8} {len(results) / elapsed:>8.0f} {received / elapsed / 1e6:>8.0f} "
+                  f"{percentile(ttfbs, 0.5) * 1000:>12.2f} {percentile(ttfbs, 0.99) * 1000:>12.2f} {errors:>7}")
+        server.stop()
+        core.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shuffle import ShuffleOrder
+
+
+def bench_full_shuffle(track_ids, steps, seed):
+    tracemalloc.start()
+    start = time.perf_counter()
+    order = list(track_ids)
+    random.Random(seed).shuffle(order)
+    first = time.perf_counter() - start
+    for track_id in order[:steps]:
+        pass
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, peak
+
+
+def bench_shuffle_order(track_ids, steps, seed, spread):
+    artist_of = (lambda track_id: track_id % 500) if spread else None
+    tracemalloc.start()
+    start = time.perf_counter()
+    order = ShuffleOrder(track_ids, seed=seed, artist_of=artist_of, spread=spread)
+    order.peek()
+    first = time.perf_counter() - start
+    for _ in range(steps):
+        order.advance()
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shuffle: full list shuffle vs lazy ShuffleOrder")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--spread", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'tracks':>8} {'method':<13} {'first ms':>9} {'total ms':>9} {'peak KiB':>9}  ({args.steps} steps)")
+    for size in args.sizes:
+        track_ids = range(size)
+        for name, run in (("list shuffle", lambda: bench_full_shuffle(track_ids, args.steps, args.seed)),
+                          ("ShuffleOrder", lambda: bench_shuffle_order(track_ids, args.steps, args.seed,
+                                                                       args.spread))):
+            first, total, peak = run()
+            print(f"{size:>8} {name:<13} {first * 1000:>9.2f} {total * 1000:>9.2f} {peak / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
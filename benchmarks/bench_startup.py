@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Modules that must not be imported just to start up; each belongs to a
+# feature (playback, online search, tag reading, transcoding) that loads it
+# on first use.
+HEAVY = ("pygame", "pytubefix", "mutagen", "pydub", "numpy")
+# A child that hasn't started (or shut down) by then is reported as failed
+# instead of hanging the run.
+CHILD_TIMEOUT = 120
+
+
+def import_times(module):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, cwd=ROOT, timeout=CHILD_TIMEOUT)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_part, cumulative_part, name = line.split("|")
+        times[name.strip()] = (int(self_part.split(":")[1]), int(cumulative_part))
+    return times
+
+
+def report_imports(module, top):
+    times = import_times(module)
+    total = times[module][1]
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY)
+    print(f"import {module}: {total / 1000:.1f} ms total")
+    for name, (self_us, cumulative_us) in sorted(
+            times.items(), key=lambda item: -item[1][1])[1:top + 1]:
+        print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+    if heavy:
+        print(f"    heavy modules imported at startup: {', '.join(heavy)}")
+    return not heavy
+
+
+def make_library(music_dir, tracks):
+    from library_store import SQLiteLibraryStore
+
+    store = SQLiteLibraryStore(Path(music_dir) / "library.db")
+    store.put_many((f"Artist {i % 500} - Track {i}",
+                    {"filename": f"{i}.mp3", "path": str(Path(music_dir) / f"{i}.mp3"), "duration": 180})
+                   for i in range(tracks))
+    store.close()
+
+
+def child_core(start):
+    import threading
+    from core import MusicCore
+
+    marks = {"imported": time.time() - start}
+    first = threading.Event()
+    done = threading.Event()
+
+    def on_batch(titles):
+        if not first.is_set():
+            marks["first_rows"] = time.time() - start
+            first.set()
+
+    core = MusicCore()
+    marks["constructed"] = time.time() - start
+    core.on("library_batch", on_batch)
+    core.on("library_loaded", done.set)
+    core.start(rescan=False)
+    done.wait()
+    marks["library_loaded"] = time.time() - start
+    core.close()
+    print(json.dumps(marks))
+
+
+def child_tk(start):
+    import tkinter as tk
+    from spotify_clone_python import SpotifyStyleApp
+
+    marks = {"imported": time.time() - start}
+    root = tk.Tk()
+    app = SpotifyStyleApp(root)
+    marks["constructed"] = time.time() - start
+
+    def mark(name):
+        marks.setdefault(name, time.time() - start)
+        if "library_loaded" in marks and "first_rows" in marks:
+            app.on_closing()
+
+    def poll_rows():
+        if app.results_listbox.size():
+            mark("first_rows")
+        else:
+            root.after(1, poll_rows)
+
+    app.core.on("library_loaded", lambda: root.after(0, mark, "library_loaded"))
+    if app.core.loaded.is_set():
+        root.after(0, mark, "library_loaded")
+    root.bind("<Map>", lambda e: mark("first_frame"), add="+")
+    poll_rows()
+    root.mainloop()
+    print(json.dumps(marks))
+
+
+def run_child(mode, music_dir, runs):
+    results = []
+    env = dict(os.environ, MUSIC_DIR=music_dir)
+    for _ in range(runs):
+        start = time.time()
+        try:
+            out = subprocess.run([sys.executable, __file__, "--child", mode, str(start)],
+                                 capture_output=True, text=True, env=env, cwd=ROOT, timeout=CHILD_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"  {mode}: timed out after {CHILD_TIMEOUT}s")
+            return None
+        if out.returncode != 0:
+            print(f"  {mode}: failed: {(out.stderr.strip().splitlines() or ['?'])[-1]}")
+            return None
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    # Median run per mark.
+    return {key: sorted(r[key] for r in results)[len(results) // 2] for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start: import time and time to first rows")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "START"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, start = args.child
+        {"core": child_core, "tk": child_tk}[mode](float(start))
+        return
+
+    ok = report_imports("cli", args.top)
+    ok = report_imports("spotify_clone_python", args.top) and ok
+
+    modes = ["core"]
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        modes.append("tk")
+    else:
+        print("No display: skipping the Tk time-to-first-frame run")
+
+    print(f"\n{'tracks':>8} {'mode':<5} {'imported':>8} {'ready':>8} {'frame':>8} {'rows':>8} {'loaded':>8}  (ms since launch)")
+    for tracks in args.tracks:
+        with tempfile.TemporaryDirectory() as music_dir:
+            make_library(music_dir, tracks)
+            for mode in modes:
+                marks = run_child(mode, music_dir, args.runs)
+                if marks is None:
+                    continue
+                cells = [marks.get(key) for key in ("imported", "constructed", "first_frame",
+                                                    "first_rows", "library_loaded")]
+                print(f"{tracks:>8} {mode:<5} " + " ".join(
+                    f"{cell * 1000:>8.1f}" if cell is not None else f"{'-':>8}" for cell in cells))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import math
+import struct
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_resume import FlakyServer
+from download_manager import DONE, DownloadManager, HTTPProvider
+from streaming import LiveStream
+
+
+RATE = 44100
+
+
+def make_wav(seconds):
+    # A stereo sine sweep as 16-bit WAV: playable by SDL as it stands, so
+    # no ffmpeg is needed for the stream itself.
+    frames = bytearray()
+    for i in range(RATE * seconds):
+        value = int(12000 * math.sin(2 * math.pi * (220 + i / RATE * 10) * i / RATE))
+        frames += struct.pack("<hh", value, value)
+    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(frames), b"WAVE", b"fmt ", 16, 1, 2,
+                         RATE, RATE * 4, 4, 16, b"data", len(frames))
+    return header + bytes(frames)
+
+
+def play_along(live, duration, total):
+    # Reads the stream at the pace a player would and adds up the time
+    # spent waiting for bytes that hadn't arrived yet.
+    reader = live.reader()
+    byte_rate = total / duration
+    start = time.monotonic()
+    done = 0
+    stalled = 0.0
+    while True:
+        due = start + stalled + done / byte_rate
+        if due > time.monotonic():
+            time.sleep(due - time.monotonic())
+        before = time.monotonic()
+        data = reader.read(64 * 1024)
+        waited = time.monotonic() - before
+        if waited > 0.05:
+            stalled += waited
+        if not data:
+            break
+        done += len(data)
+    return done, stalled
+
+
+def run(data, duration, speed, chunk):
+    byte_rate = len(data) / duration
+    server = FlakyServer({"track.wav": data}, rate=byte_rate * speed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as folder:
+        manager = DownloadManager(HTTPProvider(chunk_size=chunk), folder, workers=1)
+        manager.start()
+        start = time.monotonic()
+        item = manager.stream("track", "Track", f"{server.url}/track.wav")
+        live = LiveStream(item.spool, manager.partial_dir, duration)
+        ready = live.wait_ready(timeout=duration * 4)
+        first_audio = time.monotonic() - start
+        played, stalled = play_along(live, duration, len(data)) if ready else (0, 0.0)
+        manager.wait_idle()
+        downloaded = item.progress
+        stored = Path(folder) / "partial" / "track.wav"
+        intact = item.state == DONE and hashlib.sha256(stored.read_bytes()).digest() == hashlib.sha256(data).digest()
+        live.close()
+        manager.stop()
+    server.shutdown()
+    server.server_close()
+    full = len(data) / (byte_rate * speed)
+    return first_audio, full, stalled, played == len(data), intact and downloaded == 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first audio when playing while downloading, "
+                                                 "against a throttled local HTTP server")
+    parser.add_argument("--seconds", type=int, default=20, help="length of the test track")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[4.0, 1.5, 0.8],
+                        help="download speed as a multiple of the track's bitrate")
+    parser.add_argument("--chunk", type=int, default=1024 * 1024, help="bytes per range request")
+    args = parser.parse_args()
+
+    data = make_wav(args.seconds)
+    print(f"{args.seconds} s WAV, {len(data) / 1e6:.1f} MB")
+    print(f"{'speed':>6} {'first audio s':>14} {'full download s':>16} {'stalled s':>10} {'played':>7} {'stored':>7}")
+    for speed in args.speeds:
+        first_audio, full, stalled, played, intact = run(data, args.seconds, speed, args.chunk)
+        print(f"{speed:>5.1f}x {first_audio:>14.2f} {full:>16.2f} {stalled:>10.2f} "
+              f"{'all' if played else 'short':>7} {'ok' if intact else 'BAD':>7}")
+
+
+if __name__ == "__main__":
+    main()
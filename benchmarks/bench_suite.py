@@ -0,0 +1,246 @@
+import argparse
+import json
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import metrics
+from bench_stream import make_wav
+from core import MainLoop, MusicCore
+from download_manager import LocalStreamProvider
+from online_search import LocalSearchProvider
+
+
+WORDS = ("night", "drive", "summer", "blue", "echo", "river", "gold", "static", "fire", "glass",
+         "ocean", "city", "ghost", "neon", "paper", "heart", "storm", "velvet", "signal", "moon")
+# A p50 or p99 counts as a regression when it is this much slower than the
+# baseline and also slower by more than NOISE_FLOOR seconds, which keeps
+# sub-millisecond jitter from failing a run.
+TOLERANCE = 0.25
+NOISE_FLOOR = 0.0005
+
+
+def fake_reader(path):
+    # Tags without mutagen: every file is a three-minute track.
+    return {"duration": 180.0, "bitrate": 128000, "sample_rate": 44100, "channels": 2,
+            "tags": {}, "loudness": None, "peak": None}
+
+
+class FakePlayer:
+    # The parts of PlaybackEngine the core calls, minus pygame.
+
+    def __init__(self):
+        self.current_file = None
+        self.duration = 0
+
+    def play(self, filepath, duration, start=0.0, volume=1.0):
+        self.current_file = filepath
+        self.duration = duration
+
+    def set_next(self, filepath, duration, token=None, volume=1.0):
+        pass
+
+    def seek(self, pos):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def position(self):
+        return 0.0
+
+
+class HeadlessView:
+    # What the window does when the library changes, minus Tk: batch
+    # events into one refresh on the loop that re-runs the current search
+    # and formats the rows that would be on screen.
+
+    def __init__(self, core, loop, rows=40):
+        self.core = core
+        self.loop = loop
+        self.rows = rows
+        self.query = None
+        self.visible = []
+        self.pending = False
+        self.lock = threading.Lock()
+        core.on("library_batch", lambda titles: self.schedule())
+        core.on("library_changed", lambda title: self.schedule())
+
+    def schedule(self):
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        self.loop.after(50, self.refresh)
+
+    def refresh(self):
+        with self.lock:
+            self.pending = False
+        with metrics.span("library_refresh"):
+            titles = self.core.search_library(self.query) if self.query else self.core.titles()
+            self.visible = [f"♫  {title}" for title in titles[:self.rows]]
+
+
+def make_library(music_dir, audio_dir, tracks, rng):
+    core = MusicCore(music_dir)
+    core.metadata.reader = fake_reader
+    core.load()
+    audio_dir.mkdir()
+    batch = {}
+    for i in range(tracks):
+        path = audio_dir / f"{i}.mp3"
+        path.write_bytes(b"\xff\xfb\x90\x64" + bytes(124))
+        title = f"Artist {i % 200} - {' '.join(rng.sample(WORDS, 3))} {i}"
+        batch[title] = {"filename": path.name, "path": str(path), "duration": 180, "source_url": None}
+        if len(batch) == 1000:
+            core._add_entries(batch)
+            batch = {}
+    if batch:
+        core._add_entries(batch)
+    core.close(wait=True)
+
+
+def make_sources(source_dir, count, seconds):
+    # Distinct WAV files, so each download lands as its own stored file.
+    source_dir.mkdir()
+    data = bytearray(make_wav(seconds))
+    for i in range(count):
+        data[-4:] = struct.pack("<I", i)
+        (source_dir / f"dl{i}.wav").write_bytes(data)
+
+
+def call(loop, callback, *args):
+    # Runs on the loop, as a click handler would in the window.
+    return loop.call(callback, *args).result(timeout=60)
+
+
+def run(args, folder):
+    rng = random.Random(args.seed)
+    folder = Path(folder)
+    metrics.REGISTRY.reset()
+    music_dir = folder / "music"
+    make_library(music_dir, folder / "audio", args.tracks, rng)
+    make_sources(folder / "sources", args.downloads, args.seconds)
+    catalog = [(f"vid{i:08d}", f"Artist {i % 300} - {' '.join(rng.sample(WORDS, 3))}")
+               for i in range(args.catalog)]
+
+    loop = MainLoop()
+    threading.Thread(target=loop.run, name="bench-loop", daemon=True).start()
+    monitor = metrics.LoopMonitor(loop, interval=0.05, threshold=0.05, name="bench_loop")
+    loop.call(monitor.start).result()
+
+    core = MusicCore(music_dir, scheduler=loop,
+                     download_provider=LocalStreamProvider(folder / "sources", bytes_per_second=args.rate),
+                     search_provider=LocalSearchProvider(catalog, latency=args.latency))
+    core.metadata.reader = fake_reader
+    core.player = FakePlayer()
+    view = HeadlessView(core, loop)
+
+    with metrics.span("library_load"):
+        core.start(rescan=False)
+        core.loaded.wait()
+
+    queries = [" ".join(rng.sample(WORDS, rng.randint(1, 2))) for _ in range(args.searches)]
+    for query in queries:
+        view.query = query
+        call(loop, core.search_library, query)
+
+    for query in queries[:args.online]:
+        core.search_online(f"{query} {rng.randrange(1000)}").result(timeout=60)
+
+    titles = core.titles()
+    for _ in range(args.plays):
+        call(loop, core.play, rng.choice(titles), titles)
+        for _ in range(3):
+            call(loop, core.seek, rng.uniform(0, 170))
+
+    view.query = None
+    arrived = threading.Semaphore(0)
+    core.on("library_changed", lambda title: arrived.release())
+    for i in range(args.downloads):
+        core.download(f"dl{i}", f"Download {i}", f"local://dl{i}")
+    for _ in range(args.downloads):
+        if not arrived.acquire(timeout=120):
+            print("downloads did not finish", file=sys.stderr)
+            break
+    time.sleep(0.1)
+
+    loop.call(monitor.stop).result()
+    call(loop, core.stop)
+    core.close(wait=True)
+    loop.quit()
+    return metrics.REGISTRY.snapshot()
+
+
+def compare(snapshot, baseline):
+    regressions = []
+    for name, now in snapshot["timings"].items():
+        before = baseline.get("timings", {}).get(name)
+        if not before:
+            continue
+        for q in ("p50", "p99"):
+            old, new = before.get(q), now.get(q)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + TOLERANCE) and new - old > NOISE_FLOOR:
+                regressions.append((name, q, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drives search, downloads, playback and library refreshes "
+                                                 "headlessly and reports the timings the app records")
+    parser.add_argument("--tracks", type=int, default=20000, help="synthetic library size")
+    parser.add_argument("--catalog", type=int, default=5000, help="results the fake search provider knows")
+    parser.add_argument("--searches", type=int, default=300)
+    parser.add_argument("--online", type=int, default=40, help="online searches (cache misses)")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake search provider latency, seconds")
+    parser.add_argument("--plays", type=int, default=200)
+    parser.add_argument("--downloads", type=int, default=12)
+    parser.add_argument("--seconds", type=int, default=2, help="length of each downloaded track")
+    parser.add_argument("--rate", type=int, default=4 * 1024 * 1024, help="download bytes/s per stream")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the results here as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run; exit 1 on regressions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot = run(args, folder)
+
+    print(f"{'timing':<32} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, summary in snapshot["timings"].items():
+        print(f"{name:<32} {summary['count']:>6} {summary['p50'] * 1000:>9.2f} {summary['p90'] * 1000:>9.2f} "
+              f"{summary['p99'] * 1000:>9.2f} {summary['max'] * 1000:>9.2f}")
+    for name, value in snapshot["counters"].items():
+        print(f"{name:<32} {value:>6}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(snapshot, json.load(f))
+        for name, q, old, new in regressions:
+            print(f"REGRESSION {name} {q}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from transcode import TranscodeSettings, Transcoder, ffmpeg_available, transcode_file
+
+
+def make_source(path, minutes, codec):
+    encoder = {"aac": "aac", "opus": "libopus", "mp3": "libmp3lame"}[codec]
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={minutes * 60}",
+         "-ac", "2", "-c:a", encoder, "-b:a", "128k", str(path)],
+        check=True,
+    )
+
+
+def run_child(mode, source, out_dir):
+    start = time.perf_counter()
+    if mode == "pydub":
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(source)
+        audio.export(str(Path(out_dir) / "out.mp3"), format="mp3", bitrate="192k")
+    else:
+        remux = ("mp3", "aac") if mode == "remux" else ()
+        transcode_file(source, out_dir, "out", TranscodeSettings(remux_codecs=remux))
+    elapsed = time.perf_counter() - start
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "peak_rss_kb": max(self_rss, child_rss)}))
+
+
+def measure(mode, source, tmp):
+    copy = Path(tmp) / f"{mode}_{Path(source).name}"
+    copy.write_bytes(Path(source).read_bytes())
+    out = subprocess.run([sys.executable, __file__, "--child", mode, str(copy), tmp],
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        return None
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def throughput(source, tmp, jobs, minutes):
+    transcoder = Transcoder(TranscodeSettings(remux_codecs=()))
+    sources = []
+    for i in range(jobs):
+        copy = Path(tmp) / f"batch_{i}{Path(source).suffix}"
+        copy.write_bytes(Path(source).read_bytes())
+        sources.append(copy)
+    start = time.perf_counter()
+    futures = [transcoder.submit(path, tmp, f"batch_{i}_out") for i, path in enumerate(sources)]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    transcoder.shutdown()
+    return jobs * minutes * 60 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode peak RSS and throughput: pydub vs ffmpeg pipeline")
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "SOURCE", "OUT_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    if not ffmpeg_available():
+        sys.exit("ffmpeg/ffprobe not found on PATH")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "source.m4a"
+        make_source(source, args.minutes, "aac")
+
+        print(f"{args.minutes:g} min AAC source")
+        print(f"{'path':<10} {'seconds':>8} {'peak RSS MB':>12} {'x realtime':>11}")
+        for mode in ("pydub", "ffmpeg", "remux"):
+            stats = measure(mode, source, tmp)
+            if stats is None:
+                print(f"{mode:<10} {'n/a':>8}")
+                continue
+            print(f"{mode:<10} {stats['seconds']:>8.2f} {stats['peak_rss_kb'] / 1024:>12.1f} "
+                  f"{args.minutes * 60 / stats['seconds']:>11.1f}")
+
+        rate = throughput(source, tmp, args.jobs, args.minutes)
+        print(f"pool of {args.jobs} jobs: {rate:.1f}x realtime aggregate")
+
+
+if __name__ == "__main__":
+    main()
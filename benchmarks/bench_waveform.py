@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from waveform import PeakFile, generate_many
+
+
+def make_tracks(folder, tracks, seconds, rate):
+    # Noise under a slow swell, so the waveform has some shape.
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    t = np.arange(rate * seconds) / rate
+    envelope = 0.2 + 0.6 * np.abs(np.sin(2 * np.pi * t / 40))
+    paths = []
+    for i in range(tracks):
+        path = Path(folder) / f"track{i}.wav"
+        samples = rng.normal(0, 0.25, (len(t), 2)) * envelope[:, None]
+        with wave.open(str(path), 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Waveform peak generation throughput and render cost")
+    parser.add_argument("--tracks", type=int, default=16)
+    parser.add_argument("--seconds", type=int, default=240)
+    parser.add_argument("--rate", type=int, default=44100)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--widths", type=int, nargs="+", default=[200, 800, 1920, 3840])
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("numpy is not installed", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_tracks(folder, args.tracks, args.seconds, args.rate)
+        audio_hours = args.tracks * args.seconds / 3600
+        print(f"{args.tracks} tracks, {audio_hours:.1f} h of audio")
+        print(f"{'workers':>8} {'seconds':>8} {'x real time':>12}")
+        for workers in args.workers:
+            jobs = [(str(path), f"{path}.peaks") for path in paths]
+            start = time.perf_counter()
+            failed = sum(not ok for _, ok in generate_many(jobs, workers=workers))
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>8} {elapsed:>8.2f} {audio_hours * 3600 / elapsed:>12.0f}"
+                  + (f"  ({failed} failed)" if failed else ""))
+
+        peaks = PeakFile(f"{paths[0]}.peaks")
+        size = os.path.getsize(f"{paths[0]}.peaks")
+        print(f"\npeak file: {size / 1024:.0f} KiB for {args.seconds} s, {len(peaks.levels)} levels")
+        print(f"{'width':>8} {'ms/render':>10} {'ms/zoomed':>10}  (zoomed: the first 10 s)")
+        for width in args.widths:
+            runs = 20
+            start = time.perf_counter()
+            for _ in range(runs):
+                peaks.render(width)
+            full = (time.perf_counter() - start) / runs
+            start = time.perf_counter()
+            for _ in range(runs):
+                peaks.render(width, 0, 10)
+            zoomed = (time.perf_counter() - start) / runs
+            print(f"{width:>8} {full * 1000:>10.2f} {zoomed * 1000:>10.2f}")
+        peaks.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
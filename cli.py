@@ -0,0 +1,477 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import metrics
+from core import METRICS_PATH, MainLoop, MusicCore
+from download_manager import parse_video_url
+from library_server import DEFAULT_HTTP_PORT, LibraryServer
+
+
+DEFAULT_PORT = int(os.environ.get("MUSIC_DAEMON_PORT", "47800"))
+
+def first_online_result(core, query):
+    results = core.online_search.fetch(query, 0).result()
+    return results[0] if results else None
+
+
+def resolve_download(core, target):
+    # A watch URL is queued as-is (the real title comes back with the
+    # download); anything else is searched and the top hit is taken.
+    video_id = parse_video_url(target)
+    if video_id:
+        return video_id, video_id, f"https://www.youtube.com/watch?v={video_id}"
+    result = first_online_result(core, target)
+    if result is None:
+        return None
+    return result.video_id, result.title, result.watch_url
+
+
+def cmd_list(core, args):
+    titles = core.titles()
+    for title in titles[:args.limit] if args.limit else titles:
+        print(title)
+    return 0
+
+
+def cmd_search(core, args):
+    query = " ".join(args.query)
+    if not args.online:
+        for title in core.search_library(query, limit=args.limit):
+            print(title)
+        return 0
+    for result in core.online_search.fetch(query, args.page).result():
+        print(f"{result.watch_url}  {result.title}")
+    return 0
+
+
+def progress_printer(verbose):
+    # Progress and throughput on stderr, at most a few times a second
+    # unless every file is wanted.
+    start = time.perf_counter()
+    last = [0.0]
+
+    def progress(done, total, path):
+        now = time.perf_counter()
+        if verbose or now - last[0] >= 0.5 or done == total:
+            last[0] = now
+            rate = done / (now - start) if now > start else 0
+            print(f"[{done}/{total}] {rate:.0f} files/s  {path or ''}", file=sys.stderr)
+
+    return progress
+
+
+def cmd_import(core, args):
+    start = time.perf_counter()
+    added, updated = core.import_files(args.paths, copy=args.copy, workers=args.workers,
+                                       on_progress=progress_printer(args.verbose))
+    for title in added:
+        print(f"+ {title}")
+    for title in updated:
+        print(f"~ {title}")
+    print(f"Imported {len(added)} tracks, updated {len(updated)} ({len(core.library)} in library) "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_rescan(core, args):
+    # Re-reads tags of library files that changed on disk and lists the
+    # ones that are gone.
+    start = time.perf_counter()
+    paths = [entry["path"] for entry in core.library.values()]
+    changed = core.metadata.rescan(paths, workers=args.workers)
+    missing = [title for title, entry in core.library.items() if not os.path.exists(entry["path"])]
+    for title in missing:
+        print(f"missing: {title}")
+    print(f"Rescanned {len(paths)} tracks: {changed} changed, {len(missing)} missing "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_download(core, args):
+    def show(item):
+        if item.state in ("done", "failed", "cancelled"):
+            suffix = f": {item.error}" if item.error and item.state != "done" else ""
+            if item.duplicate:
+                suffix = " (already in library)"
+            print(f"{item.state:<10} {item.title}{suffix}", file=sys.stderr)
+
+    core.on("download_update", show)
+    core.start(rescan=False)
+    queued = []
+    for target in args.targets:
+        resolved = resolve_download(core, target)
+        if resolved is None:
+            print(f"No results for '{target}'", file=sys.stderr)
+            continue
+        queued.append(core.download(*resolved))
+    core.downloads.wait_idle()
+    return 0 if all(item.state == "done" for item in queued) else 1
+
+
+def cmd_loudness(core, args):
+    start = time.perf_counter()
+    audio = [0.0]
+
+    def progress(done, total, title, result):
+        if result is not None:
+            audio[0] += result["seconds"]
+        if args.verbose:
+            gain = f"{result['gain']:+.2f} dB" if result else "failed"
+            print(f"[{done}/{total}] {gain:>10}  {title}", file=sys.stderr)
+
+    analysed = core.analyze_loudness(force=args.all, workers=args.workers, on_progress=progress)
+    elapsed = time.perf_counter() - start
+    speed = audio[0] / elapsed if elapsed else 0
+    print(f"Analysed {analysed} tracks ({audio[0] / 3600:.1f} h of audio) in {elapsed:.1f}s, "
+          f"{speed:.0f}x real time", file=sys.stderr)
+    return 0
+
+
+def cmd_waveforms(core, args):
+    start = time.perf_counter()
+
+    def progress(done, total, title, ok):
+        if args.verbose:
+            print(f"[{done}/{total}] {'ok' if ok else 'failed':>6}  {title}", file=sys.stderr)
+
+    generated = core.generate_waveforms(force=args.all, workers=args.workers, on_progress=progress)
+    print(f"Generated {generated} waveforms in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_features(core, args):
+    start = time.perf_counter()
+
+    def progress(done, total, title, ok):
+        if args.verbose:
+            print(f"[{done}/{total}] {'ok' if ok else 'failed':>6}  {title}", file=sys.stderr)
+
+    try:
+        extracted = core.extract_features(force=args.all, workers=args.workers, on_progress=progress)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Extracted features of {extracted} tracks in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_similar(core, args):
+    title = " ".join(args.title)
+    if title not in core.library:
+        print(f"Not in the library: {title}", file=sys.stderr)
+        return 1
+    similar = core.similar_tracks(title, limit=args.limit)
+    if not similar:
+        print("No audio features for this track; run `features` first", file=sys.stderr)
+        return 1
+    for other, score in similar:
+        print(f"{score:6.3f}  {other}")
+    return 0
+
+
+def cmd_dupes(core, args):
+    def progress(done, total, title):
+        if args.verbose:
+            print(f"[{done}/{total}] {title}", file=sys.stderr)
+
+    groups = core.find_duplicates(audio=args.audio, on_progress=progress)
+    for group in groups:
+        for title in group:
+            print(f"{title}  {core.library[title]['path']}")
+        print()
+    print(f"{len(groups)} sets of duplicates", file=sys.stderr)
+    return 0
+
+
+def cmd_playlist(core, args):
+    action, rest = args.action, args.args
+    if action == "list":
+        for name, track_ids in core.playlists.items():
+            print(f"{name}  ({len(track_ids)})")
+        return 0
+    if not rest:
+        print(f"playlist {action} needs a playlist name", file=sys.stderr)
+        return 2
+    name, rest = rest[0], rest[1:]
+    if action == "create":
+        core.create_playlist(name, rest)
+    elif name not in core.playlists:
+        print(f"No playlist called '{name}'", file=sys.stderr)
+        return 1
+    elif action == "show":
+        for i, title in enumerate(core.playlist_titles(name)):
+            print(f"{i:>4}  {title}")
+    elif action == "add":
+        missing = [title for title in rest if title not in core.library]
+        for title in missing:
+            print(f"Not in library: {title}", file=sys.stderr)
+        core.add_to_playlist(name, rest)
+    elif action == "remove":
+        core.remove_from_playlist(name, [int(i) for i in rest])
+    elif action == "rename":
+        core.rename_playlist(name, rest[0])
+    elif action == "delete":
+        core.delete_playlist(name)
+    return 0
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = {"ok": True, "result": self.server.daemon.dispatch(request["cmd"], request.get("args", []))}
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode())
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Daemon:
+    # Runs the core on a MainLoop in the main thread and takes JSON-line
+    # commands on a local socket. Playback commands are handed to the loop
+    # so the player is only ever touched from one thread.
+
+    def __init__(self, core, loop, port):
+        self.core = core
+        self.loop = loop
+        self.server = ControlServer(("127.0.0.1", port), ControlHandler)
+        self.server.daemon = self
+
+    def serve(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.core.start()
+        try:
+            self.loop.run()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def dispatch(self, cmd, args):
+        core = self.core
+        if cmd == "download":
+            resolved = resolve_download(core, " ".join(args))
+            if resolved is None:
+                raise ValueError("no results")
+            return core.download(*resolved).to_dict()
+        if cmd == "listen":
+            resolved = resolve_download(core, " ".join(args))
+            if resolved is None:
+                raise ValueError("no results")
+            return self.loop.call(core.stream, *resolved).result(timeout=10)
+        if cmd == "search":
+            return core.search_library(" ".join(args), limit=20)
+        if cmd == "downloads":
+            return [item.to_dict() for item in core.downloads.pending()]
+        if cmd == "playlists":
+            return {name: len(track_ids) for name, track_ids in core.playlists.items()}
+        if cmd == "metrics":
+            return metrics.REGISTRY.snapshot()
+
+        actions = {
+            "status": core.status,
+            "play": lambda: core.play(" ".join(args), core.titles()),
+            "playlist": lambda: core.play_playlist(" ".join(args)),
+            "queue": lambda: [title for _, title in core.queue_entries(limit=50)],
+            "enqueue": lambda: core.enqueue(" ".join(args)) is not None,
+            "playnext": lambda: core.enqueue_next(" ".join(args)) is not None,
+            "pause": core.pause,
+            "resume": core.resume,
+            "toggle": core.toggle_play_pause,
+            "next": core.play_next,
+            "previous": core.play_previous,
+            "stop": core.stop,
+            "seek": lambda: core.seek(float(args[0])),
+            "shuffle": lambda: core.set_shuffle(args[0] == "on") if args else core.toggle_shuffle(),
+            "radio": lambda: (core.set_radio(args[0] == "on") if args and args[0] in ("on", "off")
+                              else core.start_radio(" ".join(args)) if args else core.toggle_radio()),
+            "shutdown": self.loop.quit,
+        }
+        if cmd not in actions:
+            raise ValueError(f"unknown command: {cmd}")
+        return self.loop.call(actions[cmd]).result(timeout=10)
+
+
+def cmd_daemon(core, args):
+    loop = core.scheduler
+
+    def log(event):
+        return lambda *values: print(event, *values, flush=True)
+
+    core.on("track_changed", log("playing"))
+    core.on("playback_state", log("state"))
+    core.on("library_changed", log("library"))
+    core.on("error", log("error"))
+
+    def log_download(item):
+        if item.state in ("done", "failed"):
+            print("download", item.state, item.title, flush=True)
+
+    core.on("download_update", log_download)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: loop.quit())
+    print(f"Listening on 127.0.0.1:{args.port}", flush=True)
+    server = None
+    if args.http_port is not None:
+        server = LibraryServer(core, args.http_host, args.http_port).start()
+        print(f"Serving the library on {server.url}", flush=True)
+    if METRICS_PATH:
+        metrics.LoopMonitor(loop, name="daemon_loop").start()
+    try:
+        Daemon(core, loop, args.port).serve()
+    finally:
+        if server is not None:
+            server.stop()
+    return 0
+
+
+def cmd_serve(core, args):
+    # The library over HTTP, without a player.
+    server = LibraryServer(core, args.host, args.port).start()
+    print(f"Serving the library on {server.url}", flush=True)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    stop.wait()
+    server.stop()
+    return 0
+
+
+def cmd_ctl(args):
+    request = json.dumps({"cmd": args.action, "args": args.args}) + "\n"
+    try:
+        with socket.create_connection(("127.0.0.1", args.port), timeout=30) as sock:
+            sock.sendall(request.encode())
+            reply = json.loads(sock.makefile("r", encoding="utf-8").readline())
+    except OSError as e:
+        print(f"Daemon not reachable on port {args.port}: {e}", file=sys.stderr)
+        return 2
+    if not reply["ok"]:
+        print(reply["error"], file=sys.stderr)
+        return 1
+    if reply["result"] is not None:
+        print(json.dumps(reply["result"], indent=2, ensure_ascii=False))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="music", description="Headless music library tools")
+    parser.add_argument("--music-dir", help="library directory (default: $MUSIC_DIR or ~/MusicStreamingApp)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("list", help="list library tracks")
+    p.add_argument("--limit", type=int)
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("search", help="search the library, or YouTube with --online")
+    p.add_argument("query", nargs="+")
+    p.add_argument("--online", action="store_true")
+    p.add_argument("--page", type=int, default=0)
+    p.add_argument("--limit", type=int)
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("import", help="add audio files or folders to the library")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--copy", action="store_true", help="copy files into the library directory")
+    p.add_argument("--workers", type=int, help="tag reader processes (default: one per CPU)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("rescan", help="re-read tags of library files changed on disk")
+    p.add_argument("--workers", type=int, help="tag reader processes (default: one per CPU)")
+    p.set_defaults(func=cmd_rescan)
+
+    p = sub.add_parser("download", help="download YouTube URLs or the top result for each query")
+    p.add_argument("targets", nargs="+")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser("loudness", help="measure track loudness for ReplayGain playback")
+    p.add_argument("--all", action="store_true", help="re-analyse tracks that already have a gain")
+    p.add_argument("--workers", type=int, help="analyser processes (default: one per CPU)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_loudness)
+
+    p = sub.add_parser("waveforms", help="precompute waveform peaks for the player's progress bar")
+    p.add_argument("--all", action="store_true", help="regenerate peaks that are up to date")
+    p.add_argument("--workers", type=int, help="decoder processes (default: one per CPU)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_waveforms)
+
+    p = sub.add_parser("features", help="compute the audio features radio mode picks similar tracks by")
+    p.add_argument("--all", action="store_true", help="recompute features tracks already have")
+    p.add_argument("--workers", type=int, help="decoder processes (default: one per CPU)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_features)
+
+    p = sub.add_parser("similar", help="list the tracks that sound most like one")
+    p.add_argument("title", nargs="+")
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_similar)
+
+    p = sub.add_parser("dupes", help="list tracks stored more than once")
+    p.add_argument("--audio", action="store_true",
+                   help="also match re-encodes of the same recording by audio fingerprint "
+                        "(needs ffmpeg and numpy)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_dupes)
+
+    p = sub.add_parser("playlist", help="manage playlists")
+    p.add_argument("action", choices=("list", "show", "create", "add", "remove", "rename", "delete"))
+    p.add_argument("args", nargs="*", help="playlist name, then titles, indices or the new name")
+    p.set_defaults(func=cmd_playlist)
+
+    p = sub.add_parser("daemon", help="run in the background and accept control commands")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.add_argument("--http-port", type=int, nargs="?", const=DEFAULT_HTTP_PORT,
+                   help="also serve the library over HTTP (see serve)")
+    p.add_argument("--http-host", default="127.0.0.1")
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser("serve", help="serve library tracks and search over HTTP")
+    p.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to serve the whole LAN")
+    p.add_argument("--port", type=int, default=DEFAULT_HTTP_PORT)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("ctl", help="send a command to a running daemon")
+    p.add_argument("action", help="status, play TITLE, playlist NAME, queue, enqueue TITLE, "
+                                   "playnext TITLE, pause, resume, toggle, next, previous, stop, "
+                                   "seek SECONDS, shuffle [on|off], radio [on|off|TITLE], search QUERY, "
+                                   "playlists, download URL|QUERY, listen URL|QUERY, downloads, metrics, "
+                                   "shutdown")
+    p.add_argument("args", nargs="*")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.set_defaults(func=None)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "ctl":
+        return cmd_ctl(args)
+
+    scheduler = None
+    if args.command == "daemon":
+        scheduler = MainLoop()
+    core = MusicCore(args.music_dir, scheduler=scheduler)
+    if args.command != "daemon":
+        core.load()
+    try:
+        return args.func(core, args)
+    finally:
+        core.close(wait=args.command in ("download", "import"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import loudness
+
+
+HASH_CHUNK = 1024 * 1024
+
+# Audio fingerprints: decoded to mono 8 kHz, one energy value per 1/8 s,
+# over the first two minutes of the track.
+FINGERPRINT_RATE = 8000
+FINGERPRINT_FRAME = FINGERPRINT_RATE // 8
+FINGERPRINT_SECONDS = 120
+# Fraction of matching fingerprint bits above which two tracks count as the
+# same recording, how far apart (in frames) their starts may be, and how far
+# apart their durations.
+AUDIO_MATCH = 0.85
+MAX_OFFSET = 16
+DURATION_SLACK = 3
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def durable_replace(tmp, dest):
+    # Flush the new file to disk before renaming it into place, then the
+    # directory entry, so a crash leaves either the old file or the whole
+    # new one and never a truncated file under the final name.
+    with open(tmp, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, dest)
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(os.path.abspath(dest)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class ContentStore:
+    # Audio files named by the SHA-256 of their contents and spread over
+    # two levels of subdirectories (tracks/ab/cd/abcd....mp3), so no folder
+    # ends up with more than a few files however big the library gets, and
+    # two tracks with the same title can never overwrite each other. The
+    # same bytes stored twice end up as one file.
+
+    def __init__(self, root, levels=2, width=2):
+        self.root = Path(root)
+        self.levels = levels
+        self.width = width
+
+    def path_for(self, digest, ext):
+        parts = [digest[i * self.width:(i + 1) * self.width] for i in range(self.levels)]
+        return self.root.joinpath(*parts, digest + ext.lower())
+
+    def put(self, source, move=True):
+        # Returns (digest, path, existed); when the content is already
+        # stored the source is dropped (if moving) and nothing is written.
+        source = Path(source)
+        digest = hash_file(source)
+        dest = self.path_for(digest, source.suffix)
+        existed = dest.exists()
+        if existed:
+            if move:
+                source.unlink()
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(dest.name + ".tmp")
+            if move:
+                shutil.move(str(source), tmp)
+            else:
+                shutil.copy2(source, tmp)
+            durable_replace(tmp, dest)
+        return digest, dest, existed
+
+    def files(self):
+        return (path for path in self.root.glob("/".join(["*"] * (self.levels + 1))) if path.is_file())
+
+
+def audio_fingerprint(path):
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-i", str(path),
+         "-t", str(FINGERPRINT_SECONDS), "-ac", "1", "-ar", str(FINGERPRINT_RATE),
+         "-f", "s16le", "-"],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        return None
+    return pcm_fingerprint(result.stdout)
+
+
+def pcm_fingerprint(data):
+    # Whether the energy goes up or down from one frame to the next, as
+    # bits of one int, the first frame's in the highest bit. That survives
+    # re-encoding, different bitrates and volume changes, which byte
+    # hashes don't. `data` is mono s16le at FINGERPRINT_RATE.
+    import numpy as np
+
+    samples = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+    frames = len(samples) // FINGERPRINT_FRAME
+    if frames < 2:
+        return 0, 0
+    energies = (samples[:frames * FINGERPRINT_FRAME].astype(np.int64).reshape(frames, -1) ** 2).sum(axis=1)
+    rising = energies[1:] > energies[:-1]
+    # packbits pads the last byte with zeros at the low end.
+    bits = int.from_bytes(np.packbits(rising).tobytes(), "big") >> (-len(rising) % 8)
+    return bits, len(rising)
+
+
+def fingerprint_similarity(a, b):
+    (bits_a, len_a), (bits_b, len_b) = a, b
+    best = 0.0
+    for offset in range(-MAX_OFFSET, MAX_OFFSET + 1):
+        # Line b up with a shifted by `offset` frames: drop the first
+        # `shift` frames (the highest bits) of the one that starts
+        # earlier, then the trailing frames of whichever runs longer, and
+        # compare what overlaps.
+        x, y, lx, ly = (bits_a, bits_b, len_a, len_b) if offset >= 0 else (bits_b, bits_a, len_b, len_a)
+        shift = abs(offset)
+        lx -= shift
+        if lx <= 0:
+            continue
+        x &= (1 << lx) - 1
+        n = min(lx, ly)
+        if n < 64:
+            continue
+        x >>= lx - n
+        y >>= ly - n
+        best = max(best, 1 - (x ^ y).bit_count() / n)
+    return best
+
+
+def find_duplicates(entries, audio=False, workers=None, on_progress=None):
+    # Batch job over the whole library: {title: entry} in, lists of titles
+    # that are the same track out. Exact copies are found by content hash;
+    # with audio=True, re-encodes and other sources of the same recording
+    # are found by fingerprint (needs ffmpeg). Hashes computed on the way
+    # are returned so the caller can store them.
+    titles = [title for title, entry in entries.items() if os.path.exists(entry["path"])]
+    hashes = {title: entries[title]["content_hash"] for title in titles
+              if entries[title].get("content_hash")}
+    missing = [title for title in titles if title not in hashes]
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for title, digest in zip(missing, executor.map(lambda t: hash_file(entries[t]["path"]), missing)):
+            hashes[title] = digest
+            done += 1
+            if on_progress:
+                on_progress(done, len(missing), title)
+
+        groups = {}
+        for title in titles:
+            groups.setdefault(hashes[title], []).append(title)
+        parent = {title: group[0] for group in groups.values() for title in group}
+
+        if audio and shutil.which("ffmpeg") and loudness.available():
+            # One fingerprint per distinct file; only tracks of about the
+            # same length are compared.
+            heads = [group[0] for group in groups.values()]
+            total = done + len(heads)
+            fingerprints = {}
+            for title, fingerprint in zip(heads, executor.map(
+                    lambda t: audio_fingerprint(entries[t]["path"]), heads)):
+                if fingerprint is not None:
+                    fingerprints[title] = fingerprint
+                done += 1
+                if on_progress:
+                    on_progress(done, total, title)
+
+            def root(title):
+                while parent[title] != title:
+                    parent[title] = parent[parent[title]]
+                    title = parent[title]
+                return title
+
+            by_length = sorted(fingerprints, key=lambda t: entries[t].get("duration") or 0)
+            for i, a in enumerate(by_length):
+                for b in by_length[i + 1:]:
+                    if (entries[b].get("duration") or 0) - (entries[a].get("duration") or 0) > DURATION_SLACK:
+                        break
+                    if root(a) != root(b) and fingerprint_similarity(fingerprints[a], fingerprints[b]) >= AUDIO_MATCH:
+                        parent[root(b)] = root(a)
+            for title in titles:
+                parent[title] = root(title)
+
+    merged = {}
+    for title in titles:
+        merged.setdefault(parent[title], []).append(title)
+    duplicates = [group for group in merged.values() if len(group) > 1]
+    computed = {title: hashes[title] for title in missing}
+    return duplicates, computed
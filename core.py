@@ -0,0 +1,1165 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future
+from pathlib import Path
+
+import features
+import loudness
+import metrics
+import waveform
+from content_store import ContentStore, find_duplicates
+from download_manager import DownloadManager, YouTubeProvider, default_workers, parse_video_url
+from library_store import open_library_store
+from metadata_cache import MetadataCache
+from pcm import decode_blocks
+from online_search import OnlineSearch, SearchCache, YouTubeSearchProvider
+from play_queue import PlayQueue
+from search_index import SearchIndex
+from shuffle import ShuffleOrder
+from similarity import RADIO_SEEDS, FeatureStore, Radio, SimilarityIndex
+from streaming import LiveStream
+from transcode import Transcoder
+
+
+# Rows in the first batch handed out while the library loads: enough to
+# fill the first screen before the rest arrives.
+FIRST_BATCH = 100
+
+# Longest wait for a streamed track to buffer before giving up on playing
+# it early; the download carries on regardless.
+STREAM_TIMEOUT = 60
+
+# Timings and counters are written here (JSON for a .json path, Prometheus
+# text format otherwise) every MUSIC_METRICS_INTERVAL seconds while the
+# core runs; unset, nothing is exported.
+METRICS_PATH = os.environ.get("MUSIC_METRICS")
+METRICS_INTERVAL = float(os.environ.get("MUSIC_METRICS_INTERVAL", "10"))
+
+AUDIO_EXTENSIONS = {".mp3", ".m4a", ".mp4", ".aac", ".ogg", ".opus", ".flac", ".wav", ".webm"}
+
+
+def default_music_dir():
+    return Path(os.environ.get("MUSIC_DIR") or Path.home() / "MusicStreamingApp")
+
+
+def walk_audio_files(paths):
+    # (path, stat) for every audio file under paths. os.scandir already
+    # knows which entries are directories, so the walk costs one stat per
+    # audio file and nothing for the rest.
+    for root in paths:
+        root = os.path.realpath(root)
+        if os.path.isfile(root):
+            if os.path.splitext(root)[1].lower() in AUDIO_EXTENSIONS:
+                yield root, os.stat(root)
+            continue
+        stack = [root]
+        while stack:
+            try:
+                listing = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with listing:
+                for entry in listing:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                        try:
+                            yield entry.path, entry.stat()
+                        except OSError:
+                            pass
+
+
+class MainLoop:
+    # Stand-in for Tk's event loop when there is no UI: after() and
+    # after_cancel() work from any thread, and every callback runs on the
+    # thread that called run(). The playback engine only needs those two.
+
+    def __init__(self):
+        self.timers = []
+        self.cancelled = set()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = False
+
+    def after(self, ms, callback, *args):
+        with self.condition:
+            timer_id = next(self.counter)
+            heapq.heappush(self.timers, (time.monotonic() + ms / 1000, timer_id, callback, args))
+            self.condition.notify()
+            return timer_id
+
+    def after_cancel(self, timer_id):
+        with self.condition:
+            self.cancelled.add(timer_id)
+
+    def call(self, callback, *args):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(callback(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.after(0, run)
+        return future
+
+    def run(self):
+        self.running = True
+        while True:
+            with self.condition:
+                while self.running:
+                    if self.timers:
+                        delay = self.timers[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self.condition.wait(delay)
+                    else:
+                        self.condition.wait()
+                if not self.running:
+                    return
+                _, timer_id, callback, args = heapq.heappop(self.timers)
+                if timer_id in self.cancelled:
+                    self.cancelled.discard(timer_id)
+                    continue
+            callback(*args)
+
+    def quit(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+class MusicCore:
+    # Everything the app does minus the widgets: the library, local and
+    # online search, the download pipeline and the play queue. Front ends
+    # drive it through these methods and listen with on(); listeners are
+    # called on whichever thread produced the event (download and
+    # transcode workers, or the scheduler's thread for playback events).
+    #
+    # Tracks are keyed by title in the library, but everything that has to
+    # survive renames and re-downloads (playlists, the play queue, history)
+    # refers to the stable per-track "id" instead. Downloaded and copied-in
+    # files live in the content store, named by hash rather than title, and
+    # by_video / by_hash find a track by its source video or its bytes.
+    #
+    # Events: library_batch(titles), library_loaded(), library_changed(title),
+    # playlists_changed(), queue_changed(), download_update(item),
+    # track_changed(title), position(seconds), playback_state(state),
+    # waveform_ready(title), error(message). playback_state is one of
+    # playing, paused, stopped, or buffering while a streamed track fills.
+
+    def __init__(self, music_dir=None, scheduler=None, download_provider=None,
+                 search_provider=None, crossfade=None):
+        self.music_dir = Path(music_dir) if music_dir else default_music_dir()
+        self.music_dir.mkdir(parents=True, exist_ok=True)
+        self.started_at = time.time()
+        self.scheduler = scheduler
+        self.crossfade = crossfade if crossfade is not None else float(os.environ.get("MUSIC_CROSSFADE", "0"))
+        self.replaygain = os.environ.get("MUSIC_REPLAYGAIN", "track") != "off"
+        self.replaygain_preamp = float(os.environ.get("MUSIC_REPLAYGAIN_PREAMP", "0"))
+        self.listeners = defaultdict(list)
+        self.peaks_pending = set()
+
+        self.library_store = open_library_store(self.music_dir)
+        self.library = {}
+        self.ids = {}
+        self.by_video = {}
+        self.by_hash = defaultdict(set)
+        self.content_store = ContentStore(self.music_dir / "tracks")
+        self.playlists = {}
+        self.loaded = threading.Event()
+        self.search_index = SearchIndex()
+        self.metadata = MetadataCache(self.music_dir / "metadata.db")
+        self.rescan_stop = threading.Event()
+        self.online_search = OnlineSearch(search_provider or YouTubeSearchProvider(),
+                                          SearchCache(self.music_dir / "search_cache.json"))
+        self.transcoder = Transcoder()
+        self.downloads = DownloadManager(download_provider or YouTubeProvider(), self.music_dir,
+                                         state_path=self.music_dir / "downloads.json",
+                                         workers=default_workers(),
+                                         on_update=lambda item: self._emit("download_update", item),
+                                         on_complete=self._process_download,
+                                         is_duplicate=self.has_video)
+
+        self.player = None
+        self.current_track = None
+        self.current_file = None
+        self.duration = 0
+        self.is_playing = False
+        self.is_paused = False
+        self.shuffle_mode = False
+        self.shuffle = None
+        seed = os.environ.get("MUSIC_SHUFFLE_SEED")
+        self.shuffle_seed = int(seed) if seed else None
+        self.shuffle_spread = int(os.environ.get("MUSIC_SHUFFLE_SPREAD", "1"))
+        self.queue = PlayQueue()
+        self.upcoming = None
+        self.radio_mode = False
+        self.radio = None
+        self.similarity = None
+        self.similarity_lock = threading.Lock()
+        # The track playing from a download in progress, if any, and the
+        # one still buffering before it can start.
+        self.live = None
+        self.buffering = None
+        self.exporter = None
+        self.on("error", lambda message: metrics.count("errors"))
+
+    def on(self, event, callback):
+        self.listeners[event].append(callback)
+        return callback
+
+    def off(self, event, callback):
+        if callback in self.listeners[event]:
+            self.listeners[event].remove(callback)
+
+    def _emit(self, event, *args):
+        for callback in list(self.listeners[event]):
+            callback(*args)
+
+    def load(self, first_batch=None, batch_size=2000):
+        if not self.loaded.is_set():
+            missing_ids = []
+            for batch in self.library_store.iter_batches(batch_size, first_batch):
+                if self.rescan_stop.is_set():
+                    return
+                for title, entry in batch.items():
+                    if "id" not in entry:
+                        missing_ids.append((title, entry))
+                    self._index_entry(title, entry)
+                self.library.update(batch)
+                self.search_index.add_many(batch)
+                self._emit("library_batch", list(batch))
+            if missing_ids:
+                self.library_store.put_many(missing_ids)
+            self.playlists.update(self.library_store.load_playlists())
+            self.loaded.set()
+            self._emit("library_loaded")
+            self._emit("playlists_changed")
+        self.metadata.load()
+
+    def start(self, rescan=True):
+        # The library streams in on a background thread; front ends show
+        # rows as library_batch events arrive instead of waiting for all.
+        threading.Thread(target=self._load_and_rescan, args=(rescan,), daemon=True).start()
+        self.downloads.start()
+        if METRICS_PATH and self.exporter is None:
+            self.exporter = metrics.Exporter(METRICS_PATH, METRICS_INTERVAL).start()
+
+    def _load_and_rescan(self, rescan):
+        self.load(first_batch=FIRST_BATCH)
+        if not self.rescan_stop.is_set():
+            self.sweep_store()
+        if rescan and not self.rescan_stop.is_set():
+            self.metadata.rescan([entry["path"] for entry in list(self.library.values())],
+                                 stop_event=self.rescan_stop)
+
+    def sweep_store(self):
+        # Stored files no entry points at: left by a crash between storing
+        # a download and writing its library entry. Files newer than this
+        # process may belong to a download finishing right now. Peak files
+        # go with their audio.
+        referenced = {os.path.realpath(entry["path"]) for entry in list(self.library.values())}
+        removed = 0
+        for path in self.content_store.files():
+            stat = path.stat()
+            audio = path.with_suffix("") if path.suffix == ".peaks" else path
+            if os.path.realpath(audio) not in referenced and max(stat.st_mtime, stat.st_ctime) < self.started_at:
+                path.unlink()
+                removed += 1
+        return removed
+
+    def close(self, wait=False):
+        self.rescan_stop.set()
+        self.downloads.stop(wait=wait)
+        self.online_search.shutdown()
+        self.transcoder.shutdown(wait=wait)
+        self._cancel_buffering()
+        self._end_live()
+        if self.player is not None:
+            self.player.shutdown()
+        self.metadata.close()
+        self.library_store.close()
+        if self.similarity is not None:
+            self.similarity.close()
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
+
+    # Library
+
+    def save_library(self, title):
+        with metrics.span("save_library"):
+            if title in self.library:
+                self.library_store.put(title, self.library[title])
+            else:
+                self.library_store.delete(title)
+
+    def export_library(self, path):
+        self.library_store.export_json(path)
+
+    def titles(self):
+        return list(self.library.keys())
+
+    def search_library(self, query, limit=None):
+        with metrics.span("library_search"):
+            return self.search_index.search(query, limit=limit)
+
+    def track_id(self, title):
+        entry = self.library.get(title)
+        return entry["id"] if entry else None
+
+    def has_video(self, video_id):
+        title = self.by_video.get(video_id)
+        return title is not None and os.path.exists(self.library[title]["path"])
+
+    def _index_entry(self, title, entry):
+        entry.setdefault("id", str(uuid.uuid4()))
+        self.ids[entry["id"]] = title
+        # Entries from before video ids were stored still have the URL.
+        video_id = entry.get("video_id") or parse_video_url(entry.get("source_url"))
+        if video_id:
+            self.by_video[video_id] = title
+        if entry.get("content_hash"):
+            self.by_hash[entry["content_hash"]].add(title)
+
+    def _unindex_entry(self, title, entry):
+        self.ids.pop(entry["id"], None)
+        video_id = entry.get("video_id") or parse_video_url(entry.get("source_url"))
+        if self.by_video.get(video_id) == title:
+            del self.by_video[video_id]
+        titles = self.by_hash.get(entry.get("content_hash"))
+        if titles is not None:
+            titles.discard(title)
+            if not titles:
+                del self.by_hash[entry["content_hash"]]
+
+    def _release_file(self, entry):
+        # Stored content can be shared by several entries; the file goes
+        # once nothing refers to it.
+        if entry.get("content_hash") in self.by_hash:
+            return
+        for path in (entry["path"], self.peaks_path(entry["path"])):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def add_track(self, title, entry):
+        old = self.library.get(title)
+        if old is not None:
+            # A re-download keeps its place in playlists and the queue.
+            entry.setdefault("id", old["id"])
+            self._unindex_entry(title, old)
+        self._index_entry(title, entry)
+        if old is not None and old["path"] != entry["path"]:
+            self._release_file(old)
+        self.library[title] = entry
+        self.save_library(title)
+        self.search_index.add(title)
+        self.metadata.refresh(entry["path"])
+        self._emit("library_changed", title)
+
+    def delete_track(self, title):
+        if title not in self.library:
+            return False
+        if self.current_track == title and self.is_playing:
+            self.stop()
+        entry = self.library.pop(title)
+        track_id = entry["id"]
+        self._unindex_entry(title, entry)
+        self._release_file(entry)
+        self.metadata.forget(entry["path"])
+        self.save_library(title)
+        self.search_index.remove(title)
+        self.queue.remove_track(track_id)
+        for order in (self.shuffle, self.radio):
+            if order is not None:
+                order.remove(track_id)
+        index = self.similarity_index(create=False)
+        if index is not None:
+            index.remove(track_id)
+        for name, track_ids in self.playlists.items():
+            if track_id in track_ids:
+                self.playlists[name] = [t for t in track_ids if t != track_id]
+                self.library_store.save_playlist(name, self.playlists[name])
+        self._emit("library_changed", title)
+        self._emit("playlists_changed")
+        self._queue_changed()
+        return True
+
+    def import_files(self, paths, copy=False, on_progress=None, workers=None, batch_size=1000):
+        # Bulk import of local folders. Tags are read by the metadata
+        # cache's worker pool and new entries are written batch_size at a
+        # time. Files imported before are only looked at again when their
+        # mtime or size changed. Returns (added titles, updated titles).
+        files = list(walk_audio_files(paths))
+        known = {}
+        for title, entry in list(self.library.items()):
+            known[entry.get("source_path") or entry["path"]] = title
+        # Files copied in earlier are never re-read; the library has its own
+        # copy.
+        files = [(path, st) for path, st in files
+                 if path not in known or self.library[known[path]]["path"] == path]
+        metas, reread = self.metadata.read_many(files, workers=workers, on_progress=on_progress)
+
+        added, updated = {}, []
+        added_titles = []
+        added_hashes = set()
+        for path, _ in files:
+            meta = metas.get(path)
+            if meta is None or not meta["duration"]:
+                continue
+            if path in known:
+                entry = self.library.get(known[path])
+                if path in reread and entry is not None and entry["path"] == path:
+                    entry["duration"] = meta["duration"]
+                    updated.append(known[path])
+                continue
+
+            tags = meta["tags"]
+            title = tags.get("title") or Path(path).stem
+            if tags.get("artist"):
+                title = f"{tags['artist']} - {title}"
+            if title in self.library or title in added:
+                # Same artist and title from another file (another album,
+                # a live version): keep both.
+                title = f"{title} ({tags.get('album') or Path(path).name})"
+                if title in self.library or title in added:
+                    continue
+
+            stored, digest = Path(path), None
+            if copy:
+                digest, stored, existed = self.content_store.put(path, move=False)
+                # A copy of something already in the library is skipped.
+                if digest in self.by_hash or digest in added_hashes:
+                    if not existed:
+                        stored.unlink()
+                    continue
+                added_hashes.add(digest)
+            added[title] = {
+                "filename": stored.name,
+                "path": str(stored),
+                "duration": meta["duration"],
+                "source_url": None,
+            }
+            if copy:
+                added[title].update(content_hash=digest, source_path=path)
+            if len(added) >= batch_size:
+                self._add_entries(added)
+                added_titles.extend(added)
+                added = {}
+
+        if added:
+            self._add_entries(added)
+            added_titles.extend(added)
+        if updated:
+            self.library_store.put_many((title, self.library[title]) for title in updated)
+            self._emit("library_batch", updated)
+        return added_titles, updated
+
+    def _add_entries(self, entries):
+        for title, entry in entries.items():
+            self._index_entry(title, entry)
+        with metrics.span("save_library_batch"):
+            self.library_store.put_many(entries.items())
+        self.library.update(entries)
+        self.search_index.add_many(entries)
+        self._emit("library_batch", list(entries))
+
+    # Playlists
+
+    def playlist_titles(self, name):
+        return [self.ids[track_id] for track_id in self.playlists[name] if track_id in self.ids]
+
+    def create_playlist(self, name, titles=()):
+        name = name.strip()
+        if not name:
+            raise ValueError("Playlist name can't be empty")
+        if name in self.playlists:
+            raise ValueError(f"A playlist called '{name}' already exists")
+        self.playlists[name] = [self.library[title]["id"] for title in titles if title in self.library]
+        self.library_store.save_playlist(name, self.playlists[name])
+        self._emit("playlists_changed")
+
+    def rename_playlist(self, old, new):
+        new = new.strip()
+        if not new:
+            raise ValueError("Playlist name can't be empty")
+        if new in self.playlists:
+            raise ValueError(f"A playlist called '{new}' already exists")
+        self.playlists = {new if name == old else name: track_ids
+                          for name, track_ids in self.playlists.items()}
+        self.library_store.rename_playlist(old, new)
+        self._emit("playlists_changed")
+
+    def delete_playlist(self, name):
+        if self.playlists.pop(name, None) is not None:
+            self.library_store.delete_playlist(name)
+            self._emit("playlists_changed")
+
+    def add_to_playlist(self, name, titles):
+        self.playlists[name].extend(self.library[title]["id"] for title in titles if title in self.library)
+        self.library_store.save_playlist(name, self.playlists[name])
+        self._emit("playlists_changed")
+
+    def remove_from_playlist(self, name, indices):
+        # Indices are positions in playlist_titles(), which skips ids of
+        # tracks that are gone from the library.
+        live = [i for i, track_id in enumerate(self.playlists[name]) if track_id in self.ids]
+        drop = {live[i] for i in indices if 0 <= i < len(live)}
+        self.playlists[name] = [t for i, t in enumerate(self.playlists[name]) if i not in drop]
+        self.library_store.save_playlist(name, self.playlists[name])
+        self._emit("playlists_changed")
+
+    def move_in_playlist(self, name, src, dst):
+        track_ids = [t for t in self.playlists[name] if t in self.ids]
+        if not (0 <= src < len(track_ids) and 0 <= dst < len(track_ids)):
+            return
+        track_ids.insert(dst, track_ids.pop(src))
+        self.playlists[name] = track_ids
+        self.library_store.save_playlist(name, track_ids)
+        self._emit("playlists_changed")
+
+    def play_playlist(self, name, index=0):
+        return self.play_index(index, self.playlist_titles(name))
+
+    # Online search and downloads
+
+    def search_online(self, query, page=0, on_results=None, on_error=None):
+        return self.online_search.search(query, page, on_results=on_results, on_error=on_error)
+
+    def download(self, video_id, title, url, priority=0):
+        return self.downloads.enqueue(video_id, title, url, priority)
+
+    def cancel_download(self, video_id):
+        return self.downloads.cancel(video_id)
+
+    def stream(self, video_id, title, url, duration=0):
+        # Plays a search result while it downloads. Playback starts once a
+        # few seconds are in and the download looks fast enough to stay
+        # ahead of it; the file goes into the library as usual meanwhile.
+        if self.has_video(video_id):
+            return self.play(self.by_video[video_id])
+        item = self.downloads.stream(video_id, title, url)
+        live = LiveStream(item.spool, self.downloads.partial_dir, duration)
+        self._cancel_buffering()
+        self.buffering = live
+        self._emit("playback_state", "buffering")
+        requested = time.perf_counter()
+
+        def wait():
+            ready = live.wait_ready(timeout=STREAM_TIMEOUT)
+            if ready:
+                metrics.observe("stream_buffering", time.perf_counter() - requested)
+            else:
+                metrics.count("stream_buffering_failures")
+            self._on_scheduler(self._start_stream, live, title, ready)
+
+        threading.Thread(target=wait, name="stream-buffer", daemon=True).start()
+        return True
+
+    def _start_stream(self, live, title, ready):
+        if self.buffering is not live:
+            # Something else was played while this buffered.
+            live.close()
+            return
+        self.buffering = None
+        if not ready:
+            live.close()
+            self._emit("playback_state", "playing" if self.is_playing else "stopped")
+            return
+        self._end_live()
+        try:
+            self.current_file = None
+            self.current_track = title
+            self.duration = live.duration
+            self._ensure_player().play_stream(live.reader(), live.namehint, live.duration)
+        except Exception as e:
+            live.close()
+            self._emit("error", f"Playback failed: {str(e)}")
+            return
+        self.live = live
+        self.is_playing = True
+        self.is_paused = False
+        self._emit("track_changed", title)
+        self._emit("playback_state", "playing")
+        self.prepare_upcoming()
+
+    def _cancel_buffering(self):
+        if self.buffering is not None:
+            self.buffering.close()
+            self.buffering = None
+
+    def _end_live(self):
+        # Before anything stops or replaces the stream: a reader waiting for
+        # data would otherwise hold the mixer up.
+        if self.live is not None:
+            self.live.close()
+            self.live = None
+
+    def _on_scheduler(self, callback, *args):
+        if self.scheduler is None:
+            callback(*args)
+        else:
+            self.scheduler.after(0, callback, *args)
+
+    def _process_download(self, item, result):
+        title = result.get("title") or item.title
+        if self.has_video(item.video_id):
+            # Queued before the library had finished loading.
+            os.remove(result["path"])
+            item.duplicate = True
+            return None
+
+        def add_to_library(converted):
+            with metrics.span("download_analysis"):
+                analysis, peaks, embedding = self._analyze_download(converted["path"])
+            with metrics.span("download_store"):
+                digest, path, _ = self.content_store.put(converted["path"])
+                if peaks is not None:
+                    try:
+                        peaks.write(self.peaks_path(path), path.stat())
+                    except OSError:
+                        pass
+            name = title
+            existing = self.library.get(name)
+            if existing is not None and self.by_video.get(item.video_id) != name:
+                # A different video with the same title gets its own entry.
+                name = f"{title} ({item.video_id})"
+            self.add_track(name, {
+                "filename": path.name,
+                "path": str(path),
+                "duration": result["duration"] or converted["duration"],
+                "source_url": item.url,
+                "video_id": item.video_id,
+                "content_hash": digest,
+                **analysis,
+            })
+            if embedding is not None:
+                self.similarity_index().add(self.library[name]["id"], embedding)
+
+        # Converted under the video id, which unlike the title is unique,
+        # next to the download, then moved into the content store.
+        return self.transcoder.submit(result["path"], self.downloads.partial_dir, item.video_id,
+                                      on_done=add_to_library)
+
+    def _analyze_download(self, path):
+        # Loudness, waveform peaks and the audio-feature embedding for a
+        # single new track from one decode, done right here on the
+        # transcode worker; analyze_loudness(), generate_waveforms() and
+        # extract_features() cover the rest of the library.
+        if not loudness.available():
+            return {}, None, None
+        meter = peaks = extractor = None
+        try:
+            for rate, channels, block in decode_blocks(path):
+                if peaks is None:
+                    peaks = waveform.PeakBuilder(rate, channels)
+                    extractor = features.FeatureExtractor(rate, channels)
+                    if self.replaygain:
+                        meter = loudness.LoudnessMeter(rate, channels)
+                peaks.add(block)
+                extractor.add(block)
+                if meter is not None:
+                    meter.add(block)
+        except Exception:
+            return {}, None, None
+        result = meter.result() if meter is not None else None
+        embedding = extractor.result() if extractor is not None else None
+        return ({"gain": result["gain"], "peak": result["peak"]} if result else {}), peaks, embedding
+
+    def analyze_loudness(self, force=False, workers=None, on_progress=None, batch_size=200):
+        # Batch job: every track without a measured gain (or all of them)
+        # through the loudness analysers' process pool. Results are saved
+        # as they come in, batch_size entries per transaction.
+        todo = [(title, entry["path"]) for title, entry in list(self.library.items())
+                if (force or entry.get("gain") is None) and os.path.exists(entry["path"])]
+        paths = {path: title for title, path in todo}
+        done, analysed, pending = 0, 0, []
+        for path, result in loudness.analyze_many([path for _, path in todo], workers=workers):
+            done += 1
+            title = paths[path]
+            entry = self.library.get(title)
+            if result is not None and entry is not None:
+                entry["gain"], entry["peak"] = result["gain"], result["peak"]
+                pending.append((title, entry))
+                analysed += 1
+            if len(pending) >= batch_size:
+                self.library_store.put_many(pending)
+                pending = []
+            if on_progress:
+                on_progress(done, len(todo), title, result)
+        if pending:
+            self.library_store.put_many(pending)
+        return analysed
+
+    def peaks_path(self, audio_path):
+        return waveform.peaks_path(audio_path, self.music_dir, self.content_store.root)
+
+    def peaks_for(self, title):
+        # The track's waveform if its peak file is there and up to date.
+        # Otherwise None for now: the file is generated in the background
+        # and waveform_ready(title) follows.
+        entry = self.library.get(title)
+        if entry is None:
+            return None
+        path = entry["path"]
+        dest = self.peaks_path(path)
+        peaks = waveform.open_peaks(path, dest)
+        if peaks is None and loudness.available() and dest not in self.peaks_pending:
+            self.peaks_pending.add(dest)
+
+            def generate():
+                try:
+                    if waveform.generate_peaks(path, dest):
+                        self._emit("waveform_ready", title)
+                except Exception:
+                    pass
+                finally:
+                    self.peaks_pending.discard(dest)
+
+            self.transcoder.executor.submit(generate)
+        return peaks
+
+    def generate_waveforms(self, force=False, workers=None, on_progress=None):
+        # Batch job: peak files for every track that has none (or whose
+        # audio changed since), through a process pool.
+        jobs = []
+        for title, entry in list(self.library.items()):
+            path = entry["path"]
+            if not os.path.exists(path):
+                continue
+            dest = self.peaks_path(path)
+            if not force:
+                peaks = waveform.open_peaks(path, dest)
+                if peaks is not None:
+                    peaks.close()
+                    continue
+            jobs.append((title, path, dest))
+        titles = {(path, dest): title for title, path, dest in jobs}
+        done = generated = 0
+        for job, ok in waveform.generate_many([(path, dest) for _, path, dest in jobs], workers=workers):
+            done += 1
+            generated += ok
+            if on_progress:
+                on_progress(done, len(jobs), titles[job], ok)
+        return generated
+
+    def similarity_index(self, create=True):
+        # Opened on first use: it needs numpy, and reading the matrix in is
+        # wasted on sessions that never look for similar tracks. With
+        # create=False, None unless embeddings were stored before.
+        with self.similarity_lock:
+            if self.similarity is None and loudness.available():
+                prefix = self.music_dir / "features"
+                if create or os.path.exists(f"{prefix}.f32"):
+                    self.similarity = SimilarityIndex(FeatureStore(prefix))
+            return self.similarity
+
+    def extract_features(self, force=False, workers=None, on_progress=None, batch_size=200):
+        # Batch job: embeddings for every track that has none (or for all of
+        # them) through the feature extractors' process pool.
+        index = self.similarity_index()
+        if index is None:
+            raise RuntimeError("numpy is needed for audio features")
+        todo = [(entry["id"], title, entry["path"]) for title, entry in list(self.library.items())
+                if (force or entry["id"] not in index) and os.path.exists(entry["path"])]
+        jobs = {path: (track_id, title) for track_id, title, path in todo}
+        done, extracted, pending = 0, 0, []
+        for path, embedding in features.extract_many([path for _, _, path in todo], workers=workers):
+            done += 1
+            track_id, title = jobs[path]
+            if embedding is not None and track_id in self.ids:
+                pending.append((track_id, embedding))
+                extracted += 1
+            if len(pending) >= batch_size:
+                index.add_many(pending)
+                pending = []
+            if on_progress:
+                on_progress(done, len(todo), title, embedding is not None)
+        if pending:
+            index.add_many(pending)
+        return extracted
+
+    def similar_tracks(self, title, limit=20):
+        # [(title, similarity)] of the tracks that sound most like title.
+        entry = self.library.get(title)
+        index = self.similarity_index(create=False)
+        if entry is None or index is None:
+            return []
+        return [(self.ids[track_id], score) for track_id, score in index.nearest([entry["id"]], limit)
+                if track_id in self.ids]
+
+    def find_duplicates(self, audio=False, on_progress=None):
+        duplicates, computed = find_duplicates(dict(self.library), audio=audio, on_progress=on_progress)
+        updated = []
+        for title, digest in computed.items():
+            entry = self.library.get(title)
+            if entry is not None:
+                entry["content_hash"] = digest
+                self.by_hash[digest].add(title)
+                updated.append((title, entry))
+        if updated:
+            self.library_store.put_many(updated)
+        return duplicates
+
+    # Playback
+
+    def _ensure_player(self):
+        if self.player is None:
+            # pygame is only imported once something is actually played.
+            from playback import PlaybackEngine
+
+            self.player = PlaybackEngine(self.scheduler or MainLoop(),
+                                         on_position=lambda pos: self._emit("position", pos),
+                                         on_track_end=self._on_track_end,
+                                         on_track_change=self._on_track_change,
+                                         crossfade=self.crossfade)
+        return self.player
+
+    def play(self, title, playlist=None):
+        if playlist is not None and title in playlist:
+            return self.play_index(playlist.index(title), playlist)
+        if title not in self.library:
+            return False
+        return self._play_track(self.library[title]["id"])
+
+    def play_index(self, index, titles):
+        # Playing from a list makes the rest of that list the queue's
+        # context, the way clicking a row in a playlist does elsewhere.
+        if not 0 <= index < len(titles) or titles[index] not in self.library:
+            return False
+        track_ids = [self.library[title]["id"] for title in titles if title in self.library]
+        start = track_ids.index(self.library[titles[index]]["id"])
+        self.queue.set_context(track_ids, start)
+        if self.shuffle_mode:
+            self.shuffle = self._new_shuffle(exclude={track_ids[start]})
+        self._queue_changed(prepare=False)
+        return self._play_track(track_ids[start])
+
+    def _play_track(self, track_id):
+        title = self.ids.get(track_id)
+        if title is None:
+            return False
+        self.queue.start(track_id)
+        self._mark_played(track_id)
+        return self._play_file(self.library[title]["path"], title)
+
+    def _play_file(self, filepath, title):
+        # play_start covers what happens between a click and the mixer
+        # starting: the tag lookup (a file read on a cold cache), stopping
+        # the previous track and loading this one.
+        with metrics.span("play_start"):
+            meta = self.metadata.get(filepath)
+            if meta is None:
+                return False
+
+            self._cancel_buffering()
+            self._end_live()
+            try:
+                self.current_file = filepath
+                self.current_track = title
+                self.duration = meta["duration"] or self.library.get(title, {}).get("duration", 0)
+                self._ensure_player().play(filepath, self.duration, volume=self.volume_for(title))
+            except Exception as e:
+                self._emit("error", f"Playback failed: {str(e)}")
+                return False
+
+        self.is_playing = True
+        self.is_paused = False
+        self._emit("track_changed", title)
+        self._emit("playback_state", "playing")
+        self.prepare_upcoming()
+        return True
+
+    def volume_for(self, title):
+        # Analysed gain from the library first, then ReplayGain tags the
+        # file came with.
+        entry = self.library.get(title, {})
+        gain, peak = entry.get("gain"), entry.get("peak")
+        if gain is None:
+            meta = self.metadata.peek(entry.get("path", "")) or {}
+            gain, peak = meta.get("loudness"), meta.get("peak")
+        if not self.replaygain or gain is None:
+            return 1.0
+        return loudness.gain_to_volume(gain, peak, self.replaygain_preamp)
+
+    @property
+    def autoplay(self):
+        # What picks the tracks after the hand-queued ones instead of the
+        # context order: the radio, or the shuffle.
+        return self.radio if self.radio is not None else self.shuffle
+
+    def _mark_played(self, track_id):
+        for order in (self.shuffle, self.radio):
+            if order is not None:
+                order.mark_played(track_id)
+
+    def pick_upcoming(self):
+        # (queue entry id, track id); the entry is None for a shuffle or
+        # radio pick, which comes from the context or the whole library
+        # rather than the queue. A radio with nothing to go on (no played
+        # track has an embedding yet) leaves it to the context.
+        entry_id = self.queue.peek()
+        autoplay = self.autoplay
+        if autoplay is not None and entry_id not in self.queue.user_entries:
+            track_id = autoplay.peek()
+            if track_id is not None:
+                return None, track_id
+            if autoplay is self.shuffle:
+                return None
+        if entry_id is None:
+            return None
+        return entry_id, self.queue.track(entry_id)
+
+    def prepare_upcoming(self):
+        self.upcoming = self.pick_upcoming()
+        if self.upcoming is None or self.player is None:
+            return
+
+        title = self.ids.get(self.upcoming[1])
+        if title is None:
+            return
+        filepath = self.library[title]["path"]
+        meta = self.metadata.get(filepath)
+        if meta is not None:
+            duration = meta["duration"] or self.library[title].get("duration", 0)
+            self.player.set_next(filepath, duration, self.upcoming, volume=self.volume_for(title))
+
+    def _take_upcoming(self, upcoming):
+        entry_id, track_id = upcoming
+        if entry_id in self.queue:
+            self.queue.remove(entry_id)
+        elif entry_id is None and self.autoplay is not None and self.autoplay.peek() == track_id:
+            self.autoplay.advance()
+        self._queue_changed(prepare=False)
+        return track_id
+
+    def _on_track_change(self, upcoming):
+        self._end_live()
+        track_id = self._take_upcoming(upcoming)
+        self.queue.start(track_id)
+        self._mark_played(track_id)
+        title = self.ids.get(track_id)
+        self.current_track = title
+        self.current_file = self.player.current_file
+        self.duration = self.player.duration
+        self._emit("track_changed", title)
+        self.prepare_upcoming()
+
+    def _on_track_end(self):
+        self._end_live()
+        self.is_playing = False
+        self.play_next()
+        if not self.is_playing:
+            self._emit("playback_state", "stopped")
+
+    def _upcoming_valid(self, upcoming):
+        if upcoming is None or upcoming[1] not in self.ids:
+            return False
+        entry_id = upcoming[0]
+        if entry_id is None:
+            return self.autoplay is not None and self.autoplay.peek() == upcoming[1]
+        return entry_id == self.queue.peek() and entry_id in self.queue
+
+    def play_next(self):
+        upcoming = self.upcoming if self._upcoming_valid(self.upcoming) else self.pick_upcoming()
+        if upcoming is None:
+            return False
+        return self._play_track(self._take_upcoming(upcoming))
+
+    def play_previous(self):
+        # Early in a track "previous" restarts it, like most players.
+        if self.is_playing and self.position() > 3:
+            self.seek(0)
+            return True
+        track_id = self.queue.back()
+        if track_id is None:
+            return False
+        self._queue_changed(prepare=False)
+        title = self.ids.get(track_id)
+        return self._play_file(self.library[title]["path"], title) if title else False
+
+    # Play queue
+
+    def queue_entries(self, limit=None):
+        autoplay = self.autoplay
+        if autoplay is not None and (autoplay is self.shuffle or autoplay.peek() is not None):
+            # While shuffling (or on the radio) only the hand-queued tracks
+            # are fixed; after them comes the next pick, with no entry id.
+            entries = [(entry_id, self.ids.get(self.queue.track(entry_id)))
+                       for entry_id in itertools.islice(self.queue.entries(), limit)
+                       if entry_id in self.queue.user_entries]
+            track_id = autoplay.peek()
+            if track_id is not None and (limit is None or len(entries) < limit):
+                entries.append((None, self.ids.get(track_id)))
+            return entries
+        return [(entry_id, self.ids.get(self.queue.track(entry_id)))
+                for entry_id in itertools.islice(self.queue.entries(), limit)]
+
+    def enqueue(self, title):
+        if title not in self.library:
+            return None
+        entry_id = self.queue.add(self.library[title]["id"])
+        self._queue_changed()
+        return entry_id
+
+    def enqueue_next(self, title):
+        if title not in self.library:
+            return None
+        entry_id = self.queue.add_next(self.library[title]["id"])
+        self._queue_changed()
+        return entry_id
+
+    def play_queue_entry(self, entry_id):
+        if entry_id is None and self.autoplay is not None:
+            return self.play_next()
+        if entry_id not in self.queue:
+            return False
+        track_id = self.queue.remove(entry_id)
+        self._queue_changed(prepare=False)
+        return self._play_track(track_id)
+
+    def remove_from_queue(self, entry_id):
+        if entry_id in self.queue:
+            self.queue.remove(entry_id)
+            self._queue_changed()
+
+    def move_in_queue(self, entry_id, after=None):
+        if entry_id in self.queue and (after is None or after in self.queue):
+            self.queue.move(entry_id, after)
+            self._queue_changed()
+
+    def clear_queue(self):
+        self.queue.clear()
+        self._queue_changed()
+
+    def _queue_changed(self, prepare=True):
+        if prepare and self.is_playing:
+            self.prepare_upcoming()
+        self._emit("queue_changed")
+
+    def set_shuffle(self, enabled):
+        # Switching shuffle on mid-queue only shuffles what hasn't played
+        # yet; switching it off carries on in order after the current track.
+        self.shuffle_mode = enabled
+        context = self.queue.context
+        if enabled and self.shuffle is None:
+            played = set(self.queue.history)
+            if self.queue.current is not None:
+                played.add(self.queue.current)
+            self.shuffle = self._new_shuffle(exclude=played)
+        elif not enabled and self.shuffle is not None:
+            self.shuffle = None
+            if self.queue.current in context:
+                self.queue.set_context(context, context.index(self.queue.current))
+        self._queue_changed()
+
+    def _new_shuffle(self, exclude=()):
+        return ShuffleOrder(self.queue.context, seed=self.shuffle_seed, exclude=exclude,
+                            artist_of=self._artist_of, spread=self.shuffle_spread,
+                            repeat=self.queue.repeat)
+
+    def _artist_of(self, track_id):
+        # Tracks without an artist tag fall back to the "Artist - Title"
+        # naming downloads use; anything else counts as its own artist.
+        title = self.ids.get(track_id, track_id)
+        entry = self.library.get(title, {})
+        if entry.get("artist"):
+            return entry["artist"]
+        return title.split(" - ", 1)[0] if " - " in title else title
+
+    def toggle_shuffle(self):
+        self.set_shuffle(not self.shuffle_mode)
+        return self.shuffle_mode
+
+    def set_radio(self, enabled):
+        # Radio: once the hand-queued tracks are done, keep playing tracks
+        # that sound like the last few played, from the whole library. It
+        # goes before shuffle while both are on. Tracks need embeddings
+        # (extract_features(), or done at download time).
+        if enabled and self.radio is None:
+            index = self.similarity_index()
+            if index is None:
+                self._emit("error", "Radio needs numpy for audio features")
+                return False
+            seeds = list(self.queue.history)[-RADIO_SEEDS:]
+            if self.queue.current is not None:
+                seeds.append(self.queue.current)
+            self.radio = Radio(index, seeds=seeds, seed=self.shuffle_seed, artist_of=self._artist_of,
+                               spread=self.shuffle_spread, exists=lambda track_id: track_id in self.ids)
+        elif not enabled:
+            self.radio = None
+        self.radio_mode = self.radio is not None
+        self._queue_changed()
+        return self.radio_mode
+
+    def toggle_radio(self):
+        return self.set_radio(not self.radio_mode)
+
+    def start_radio(self, title):
+        # Plays title and keeps going with tracks like it.
+        if title not in self.library:
+            return False
+        if not self.set_radio(True):
+            return False
+        return self._play_track(self.library[title]["id"])
+
+    def toggle_play_pause(self):
+        if not self.is_playing:
+            return
+        if self.is_paused:
+            self.resume()
+        else:
+            self.pause()
+
+    def pause(self):
+        if self.is_playing and not self.is_paused:
+            self.player.pause()
+            self.is_paused = True
+            self._emit("playback_state", "paused")
+
+    def resume(self):
+        if self.is_playing and self.is_paused:
+            self.player.resume()
+            self.is_paused = False
+            self._emit("playback_state", "playing")
+
+    def seek(self, pos):
+        if self.is_playing and self.duration > 0:
+            if self.live is not None:
+                # Not past what has arrived so far.
+                pos = min(pos, max(0.0, self.live.buffered() - 1))
+            with metrics.span("seek"):
+                self.player.seek(pos)
+
+    def position(self):
+        return self.player.position() if self.player is not None and self.is_playing else 0.0
+
+    def stop(self):
+        self._cancel_buffering()
+        self._end_live()
+        if self.player is not None:
+            self.player.stop()
+        self.is_playing = False
+        self.is_paused = False
+        self.current_track = None
+        self._emit("playback_state", "stopped")
+
+    def status(self):
+        return {
+            "track": self.current_track,
+            "state": "stopped" if not self.is_playing else "paused" if self.is_paused else "playing",
+            "position": round(self.position(), 1),
+            "duration": self.duration,
+            "shuffle": self.shuffle_mode,
+            "radio": self.radio_mode,
+            "queue": len(self.queue),
+            "library": len(self.library),
+            "downloads": len(self.downloads.pending()),
+        }
@@ -0,0 +1,596 @@
+import base64
+import heapq
+import http.client
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import wave
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from pathlib import Path
+
+import metrics
+from content_store import durable_replace, hash_file
+from streaming import Spool
+
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PROCESSING = "processing"
+RETRYING = "retrying"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, DOWNLOADING, PROCESSING, RETRYING)
+
+# Bytes asked for per range request. Small enough that a dropped
+# connection costs little, large enough to keep per-request overhead low;
+# YouTube also throttles requests for much larger ranges.
+RANGE_CHUNK = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+CHUNK_RETRIES = 3
+
+# Queue priority of a download someone is waiting to listen to.
+STREAM_PRIORITY = -1
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+VIDEO_URL = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})")
+
+
+def parse_video_url(text):
+    match = VIDEO_URL.search(text or "")
+    return match.group(1) if match else None
+
+
+class DownloadError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadItem:
+    def __init__(self, video_id, title, url, priority=0, attempts=0):
+        self.video_id = video_id
+        self.title = title
+        self.url = url
+        self.priority = priority
+        self.attempts = attempts
+        self.state = QUEUED
+        self.progress = 0.0
+        self.error = None
+        # Set when the video was already in the library and nothing was
+        # downloaded.
+        self.duplicate = False
+        self.cancel_event = threading.Event()
+        # The bytes as they arrive, for playing before the download is done.
+        self.spool = Spool()
+
+    def to_dict(self):
+        return {
+            "video_id": self.video_id,
+            "title": self.title,
+            "url": self.url,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "state": self.state,
+        }
+
+
+def _expected_digest(headers):
+    # Digest: sha-256=<base64> (RFC 3230) or Repr-Digest: sha-256=:<base64>:
+    for name in ("Repr-Digest", "Digest"):
+        for part in (headers.get(name) or "").split(","):
+            algorithm, _, value = part.strip().partition("=")
+            if algorithm.lower() == "sha-256" and value:
+                return base64.b64decode(value.strip(":")).hex()
+    return None
+
+
+def fetch_ranges(url, dest, on_progress, cancel_event, key=None, size=None, sha256=None,
+                 chunk_size=RANGE_CHUNK, headers=None, timeout=30, spool=None):
+    # Downloads url to dest in ranged requests. Bytes land in dest.part and
+    # are fsynced after every range, with a dest.part.json note saying what
+    # they are, so a later call for the same key (same video and stream)
+    # picks up where a crash, stop() or dropped connection left off. The
+    # result is checked against the size and, when known, the SHA-256, then
+    # renamed into place. A spool, if given, is told about every write.
+    dest = Path(dest)
+    part = dest.with_name(dest.name + ".part")
+    note_path = dest.with_name(dest.name + ".part.json")
+    key = key or url
+    note = {}
+    if part.exists() and note_path.exists():
+        try:
+            with open(note_path, 'r', encoding='utf-8') as f:
+                note = json.load(f)
+        except (OSError, ValueError):
+            note = {}
+    if note.get("key") != key:
+        note = {"key": key}
+        open(part, 'wb').close()
+    total = size or note.get("size")
+    sha256 = sha256 or note.get("sha256")
+    offset = part.stat().st_size
+
+    def save_note():
+        note.update(size=total, sha256=sha256)
+        with open(note_path, 'w', encoding='utf-8') as f:
+            json.dump(note, f)
+
+    with open(part, 'r+b') as f:
+        f.seek(offset)
+        if spool is not None:
+            spool.open(part, offset, total)
+        failures = 0
+        while total is None or offset < total:
+            end = offset + chunk_size - 1 if total is None else min(offset + chunk_size, total) - 1
+            request = urllib.request.Request(url, headers=dict(headers or {}, Range=f"bytes={offset}-{end}"))
+            if note.get("etag"):
+                request.add_header("If-Range", note["etag"])
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    whole = response.status != 206
+                    if not whole:
+                        match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                        if not match or int(match.group(1)) != offset:
+                            raise DownloadError(f"Unexpected range from server: {response.headers.get('Content-Range')}")
+                        if match.group(3) != "*":
+                            total = int(match.group(3))
+                    else:
+                        # Range ignored, or the file changed since the part
+                        # was written (If-Range): start over from byte 0.
+                        offset = 0
+                        f.seek(0)
+                        f.truncate()
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length else None
+                        if spool is not None:
+                            spool.grow(0, total)
+                    note["etag"] = response.headers.get("ETag") or note.get("etag")
+                    sha256 = sha256 or _expected_digest(response.headers)
+                    save_note()
+                    while True:
+                        if cancel_event.is_set():
+                            raise DownloadCancelled(url)
+                        data = response.read(READ_SIZE)
+                        if not data:
+                            break
+                        f.write(data)
+                        offset += len(data)
+                        if spool is not None:
+                            f.flush()
+                            spool.grow(offset, total)
+                        on_progress(offset, total or 0)
+            except urllib.error.HTTPError as e:
+                if e.code == 416 and total is not None and offset >= total:
+                    break
+                raise DownloadError(f"HTTP {e.code} for {url}", retryable=e.code >= 500 or e.code in (408, 429))
+            except (OSError, http.client.HTTPException) as e:
+                # Dropped connection mid-range: keep what arrived and ask for
+                # the rest, a few times before leaving it to the manager's
+                # retry (which resumes from the same part file).
+                failures += 1
+                if failures > CHUNK_RETRIES:
+                    raise DownloadError(f"Download interrupted: {e}")
+                time.sleep(0.1 * failures)
+                continue
+            finally:
+                f.flush()
+                os.fsync(f.fileno())
+            failures = 0
+            if whole or (total is None and offset <= end):
+                # The whole body came at once, or a short range without a
+                # known total: either way that's the end.
+                total = total if total is not None else offset
+                break
+
+    if total is not None and offset != total:
+        raise DownloadError(f"Size mismatch: got {offset} bytes, expected {total}")
+    if sha256 and hash_file(part) != sha256:
+        part.unlink()
+        note_path.unlink()
+        raise DownloadError("Checksum mismatch")
+    durable_replace(part, dest)
+    note_path.unlink()
+    return dest
+
+
+def _wav_duration(path):
+    if path.suffix.lower() != ".wav":
+        return 0
+    try:
+        with wave.open(str(path), 'rb') as w:
+            return w.getnframes() / w.getframerate()
+    except (OSError, EOFError, wave.Error):
+        return 0
+
+
+class StreamProvider(ABC):
+    @abstractmethod
+    def fetch(self, item, dest_dir, on_progress, cancel_event):
+        raise NotImplementedError
+
+
+class YouTubeProvider(StreamProvider):
+    def fetch(self, item, dest_dir, on_progress, cancel_event):
+        from pytubefix import YouTube
+
+        yt = YouTube(item.url)
+        audio_stream = yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc().first()
+
+        if not audio_stream:
+            audio_stream = yt.streams.filter(only_audio=True).first()
+
+        if not audio_stream:
+            raise DownloadError("No audio available", retryable=False)
+
+        # Known before the first byte arrives, so a live stream can judge
+        # whether the download will stay ahead of playback.
+        item.spool.duration = yt.length or None
+        # Stream URLs expire, so a resumed download is matched on the video,
+        # format and size rather than the URL it was started from.
+        dest = Path(dest_dir) / f"{item.video_id}.{audio_stream.subtype}"
+        key = f"{item.video_id}:{audio_stream.itag}:{audio_stream.filesize}"
+        path = fetch_ranges(audio_stream.url, dest, on_progress, cancel_event,
+                            key=key, size=audio_stream.filesize or None, spool=item.spool)
+        return {"path": str(path), "duration": yt.length, "title": yt.title}
+
+
+class HTTPProvider(StreamProvider):
+    # Downloads item.url as a plain file, for direct links and for testing
+    # against a local server.
+
+    def __init__(self, chunk_size=RANGE_CHUNK, timeout=30):
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def fetch(self, item, dest_dir, on_progress, cancel_event):
+        suffix = Path(urllib.parse.urlparse(item.url).path).suffix or ".bin"
+        path = fetch_ranges(item.url, Path(dest_dir) / f"{item.video_id}{suffix}", on_progress,
+                            cancel_event, chunk_size=self.chunk_size, timeout=self.timeout,
+                            spool=item.spool)
+        return {"path": str(path), "duration": 0}
+
+
+class LocalStreamProvider(StreamProvider):
+    # Serves "videos" from files named <video_id>.<ext> in a local folder.
+    # Used to exercise the manager without network access.
+
+    def __init__(self, source_dir, chunk_size=256 * 1024, bytes_per_second=None, failures=None):
+        self.source_dir = Path(source_dir)
+        self.chunk_size = chunk_size
+        self.bytes_per_second = bytes_per_second
+        self.failures = dict(failures or {})
+        self.lock = threading.Lock()
+
+    def fetch(self, item, dest_dir, on_progress, cancel_event):
+        with self.lock:
+            if self.failures.get(item.video_id, 0) > 0:
+                self.failures[item.video_id] -= 1
+                raise DownloadError(f"Injected failure for {item.video_id}")
+
+        matches = sorted(self.source_dir.glob(f"{item.video_id}.*"))
+        if not matches:
+            raise DownloadError(f"No source for {item.video_id}", retryable=False)
+        source = matches[0]
+        total = source.stat().st_size
+        duration = _wav_duration(source)
+        item.spool.duration = duration or None
+        dest = Path(dest_dir) / f"{item.video_id}{source.suffix}"
+        part = dest.with_name(dest.name + ".part")
+        done = 0
+        start = time.monotonic()
+        with open(source, 'rb') as src, open(part, 'wb') as dst:
+            item.spool.open(part, 0, total)
+            while True:
+                if cancel_event.is_set():
+                    raise DownloadCancelled(item.video_id)
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                dst.flush()
+                done += len(chunk)
+                item.spool.grow(done, total)
+                on_progress(done, total)
+                if self.bytes_per_second:
+                    ahead = done / self.bytes_per_second - (time.monotonic() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        os.replace(part, dest)
+        return {"path": str(dest), "duration": duration}
+
+
+class DownloadManager:
+    def __init__(self, provider, download_dir, state_path=None, workers=3,
+                 max_attempts=3, backoff=2.0, on_update=None, on_complete=None, is_duplicate=None):
+        self.provider = provider
+        self.download_dir = Path(download_dir)
+        # In-flight and resumable downloads; nothing in here is finished.
+        self.partial_dir = self.download_dir / "partial"
+        self.state_path = Path(state_path) if state_path else None
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_update = on_update
+        self.on_complete = on_complete
+        self.is_duplicate = is_duplicate
+
+        self.items = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self._load_state()
+            self.sweep()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, wait=True):
+        with self.condition:
+            self.running = False
+            for item in self.items.values():
+                if item.state == DOWNLOADING:
+                    item.cancel_event.set()
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.threads = []
+
+    def sweep(self):
+        # Partial files of downloads that are still queued are kept for
+        # resuming; anything else left behind by a crash goes, including
+        # "<id>_temp" files the old layout left in the download directory.
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        pending = {video_id for video_id, item in self.items.items() if item.state in ACTIVE_STATES}
+        removed = 0
+        for path in list(self.partial_dir.iterdir()) + list(self.download_dir.glob("*_temp")):
+            video_id = path.name.split(".")[0].removesuffix("_temp")
+            resumable = path.parent == self.partial_dir and path.name.endswith((".part", ".part.json"))
+            if path.is_file() and not (resumable and video_id in pending):
+                path.unlink()
+                removed += 1
+        return removed
+
+    def get(self, video_id):
+        return self.items.get(video_id)
+
+    def pending(self):
+        with self.condition:
+            return [item for item in self.items.values() if item.state in ACTIVE_STATES]
+
+    def enqueue(self, video_id, title, url, priority=0):
+        with self.condition:
+            # Only a download still under way is reused; a finished one is
+            # replaced, since its track may have been deleted since, and
+            # is_duplicate decides whether it's still in the library.
+            item = self.items.get(video_id)
+            if item is not None and item.state in ACTIVE_STATES:
+                if item.state == QUEUED and priority < item.priority:
+                    item.priority = priority
+                    self._push(item)
+                return item
+            item = DownloadItem(video_id, title, url, priority)
+            self.items[video_id] = item
+            if self.is_duplicate and self.is_duplicate(video_id):
+                item.state = DONE
+                item.progress = 1.0
+                item.duplicate = True
+            else:
+                self._push(item)
+                self._save_state()
+        self._notify(item)
+        return item
+
+    def stream(self, video_id, title, url):
+        # A download to play while it arrives: queued ahead of the others,
+        # with its spool kept open for the player.
+        item = self.enqueue(video_id, title, url, priority=STREAM_PRIORITY)
+        item.spool.wanted = True
+        return item
+
+    def cancel(self, video_id):
+        with self.condition:
+            item = self.items.get(video_id)
+            if item is None or item.state not in ACTIVE_STATES or item.state == PROCESSING:
+                return False
+            item.cancel_event.set()
+            if item.state != DOWNLOADING:
+                item.state = CANCELLED
+            self._save_state()
+            self.condition.notify_all()
+        self._notify(item)
+        return True
+
+    def retry(self, video_id):
+        with self.condition:
+            item = self.items.get(video_id)
+            if item is None or item.state not in (FAILED, CANCELLED):
+                return False
+            item.attempts = 0
+            item.spool = Spool()
+            self._reset(item)
+            self._save_state()
+        self._notify(item)
+        return True
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while any(item.state in ACTIVE_STATES for item in self.items.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _push(self, item):
+        heapq.heappush(self.queue, (item.priority, next(self.counter), item))
+        self.condition.notify()
+
+    def _reset(self, item):
+        item.state = QUEUED
+        item.progress = 0.0
+        item.error = None
+        item.cancel_event = threading.Event()
+        self._push(item)
+
+    def _next_item(self):
+        with self.condition:
+            while self.running:
+                while self.queue:
+                    priority, _, item = heapq.heappop(self.queue)
+                    # Stale heap entries are left behind by re-prioritizing,
+                    # cancelling and retrying.
+                    if item.state == QUEUED and priority == item.priority:
+                        item.state = DOWNLOADING
+                        item.attempts += 1
+                        self._save_state()
+                        return item
+                self.condition.wait()
+            return None
+
+    def _worker(self):
+        while True:
+            item = self._next_item()
+            if item is None:
+                return
+            self._notify(item)
+            self._run(item)
+            with self.condition:
+                self._save_state()
+                self.condition.notify_all()
+            self._notify(item)
+
+    def _run(self, item):
+        last_percent = [-1]
+
+        def on_progress(done, total):
+            item.progress = done / total if total else 0.0
+            percent = int(item.progress * 100)
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                self._notify(item)
+
+        try:
+            with metrics.span("download"):
+                result = self.provider.fetch(item, self.partial_dir, on_progress, item.cancel_event)
+            if item.cancel_event.is_set():
+                raise DownloadCancelled(item.video_id)
+            item.spool.finish()
+            stage = self.on_complete(item, result) if self.on_complete else None
+            if isinstance(stage, Future):
+                # Post-processing runs in its own pool; this worker is free
+                # to start the next download.
+                item.state = PROCESSING
+                stage.add_done_callback(lambda future: self._finish_stage(item, future))
+                return
+        except DownloadCancelled:
+            item.state = self._cancelled_state()
+        except Exception as e:
+            item.error = str(e)
+            retryable = getattr(e, "retryable", True)
+            if item.cancel_event.is_set():
+                item.state = self._cancelled_state()
+            elif retryable and item.attempts < self.max_attempts and self.running:
+                item.state = RETRYING
+                delay = self.backoff * 2 ** (item.attempts - 1)
+                timer = threading.Timer(delay, self._requeue, (item,))
+                timer.daemon = True
+                timer.start()
+            else:
+                item.state = FAILED
+            if item.state != RETRYING:
+                item.spool.fail(item.error or "cancelled")
+        else:
+            item.progress = 1.0
+            item.state = DONE
+
+    def _finish_stage(self, item, future):
+        error = None if future.cancelled() else future.exception()
+        with self.condition:
+            if future.cancelled() or error is not None:
+                item.error = str(error) if error else "cancelled"
+                item.state = FAILED
+            else:
+                item.progress = 1.0
+                item.state = DONE
+            self._save_state()
+            self.condition.notify_all()
+        self._notify(item)
+
+    def _cancelled_state(self):
+        # Downloads interrupted by stop() stay queued so the next start()
+        # picks them up from the persisted state.
+        return CANCELLED if self.running else QUEUED
+
+    def _requeue(self, item):
+        with self.condition:
+            if item.state != RETRYING:
+                return
+            if item.cancel_event.is_set():
+                item.state = CANCELLED
+                self.condition.notify_all()
+                return
+            self._reset(item)
+            self._save_state()
+        self._notify(item)
+
+    def _notify(self, item):
+        if self.on_update:
+            self.on_update(item)
+
+    def _load_state(self):
+        if not self.state_path or not self.state_path.exists():
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in saved:
+            if entry["video_id"] in self.items:
+                continue
+            item = DownloadItem(entry["video_id"], entry["title"], entry["url"],
+                                entry.get("priority", 0), entry.get("attempts", 0))
+            self.items[item.video_id] = item
+            if entry.get("state") in ACTIVE_STATES:
+                self._push(item)
+            else:
+                item.state = entry.get("state", FAILED)
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        saved = [item.to_dict() for item in self.items.values()
+                 if item.state in ACTIVE_STATES + (FAILED,)]
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+
+def default_workers():
+    return int(os.environ.get("MUSIC_DOWNLOAD_WORKERS", "3"))
@@ -0,0 +1,162 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pcm import decode_blocks
+
+
+# Length of an embedding: mean and spread of 15 frame features, then tempo
+# and how clear the beat is.
+DIMS = 32
+FRAME = 2048
+# The onset envelope tempo is read from has a finer step than the spectra.
+ONSET_HOP = 512
+MELS = 40
+MFCCS = 13
+MAX_MEL_HZ = 16000
+# Frames quieter than this (dBFS) don't count towards the timbre figures.
+SILENCE_DB = -60.0
+MIN_FRAMES = 20
+MIN_BPM, MAX_BPM = 60.0, 200.0
+
+
+def _mel(hz):
+    return 2595 * math.log10(1 + hz / 700)
+
+
+class FeatureExtractor:
+    # A compact description of how a track sounds, fed one decoded block
+    # (frames x channels) at a time like LoudnessMeter. Each FRAME of the
+    # mono mix gives MFCCs 1-12 (timbre, leaving out c0, which is just
+    # level), spectral centroid and flatness and the frame's level; the
+    # embedding is their mean and standard deviation over the track's
+    # audible frames. Tempo comes from the autocorrelation of an onset
+    # envelope (rises in energy every ONSET_HOP samples), the only thing
+    # kept per frame: a few kilobytes for a whole album side.
+
+    def __init__(self, rate, channels):
+        import numpy as np
+
+        self.np = np
+        self.rate = rate
+        self.channels = channels
+        self.window = np.hanning(FRAME).astype(np.float32)
+        freqs = np.fft.rfftfreq(FRAME, 1 / rate)
+        self.freqs = (freqs / (rate / 2)).astype(np.float32)
+        top = min(rate / 2, MAX_MEL_HZ)
+        edges = 700 * (10 ** (np.linspace(_mel(20), _mel(top), MELS + 2) / 2595) - 1)
+        bank = np.zeros((MELS, len(freqs)), dtype=np.float32)
+        for i in range(MELS):
+            lo, mid, hi = edges[i:i + 3]
+            rising = (freqs - lo) / (mid - lo)
+            falling = (hi - freqs) / (hi - mid)
+            bank[i] = np.maximum(0, np.minimum(rising, falling))
+        self.bank = bank.T
+        n = np.arange(MELS)
+        self.dct = np.cos(np.pi / MELS * (n[:, None] + 0.5) * np.arange(MFCCS)[None, :]).astype(np.float32)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.sums = np.zeros(15)
+        self.squares = np.zeros(15)
+        self.frames = 0
+        self.onsets = []
+        self.last_energy = None
+
+    def add(self, block):
+        np = self.np
+        if len(block) == 0:
+            return
+        mono = block.mean(axis=1) if block.ndim > 1 else block
+        if len(self.pending):
+            mono = np.concatenate([self.pending, mono])
+        whole = len(mono) // FRAME * FRAME
+        self.pending = mono[whole:]
+        if not whole:
+            return
+        samples = mono[:whole]
+
+        energy = np.log10((samples.reshape(-1, ONSET_HOP) ** 2).sum(axis=1) + 1e-10)
+        previous = energy[0] if self.last_energy is None else self.last_energy
+        self.onsets.append(np.maximum(0, np.diff(energy, prepend=previous)).astype(np.float32))
+        self.last_energy = energy[-1]
+
+        frames = samples.reshape(-1, FRAME)
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        mfcc = np.log10(power @ self.bank + 1e-10) @ self.dct
+        total = power.sum(axis=1) + 1e-12
+        centroid = (power @ self.freqs) / total
+        flatness = np.exp(np.log(power + 1e-12).mean(axis=1)) / (total / power.shape[1])
+        level = 10 * np.log10((frames ** 2).mean(axis=1) + 1e-12)
+        rows = np.column_stack([mfcc[:, 1:], centroid, flatness, level])[level > SILENCE_DB]
+        rows = rows.astype(np.float64)
+        self.sums += rows.sum(axis=0)
+        self.squares += (rows ** 2).sum(axis=0)
+        self.frames += len(rows)
+
+    def tempo(self):
+        # (bpm, strength 0..1), or (0, 0) for anything too short or without
+        # a pulse. Lags near 120 BPM are favoured a little, which is what
+        # keeps half- and double-time readings from winning on a tie.
+        np = self.np
+        if not self.onsets:
+            return 0.0, 0.0
+        envelope = np.concatenate(self.onsets).astype(np.float64)
+        rate = self.rate / ONSET_HOP
+        shortest, longest = int(rate * 60 / MAX_BPM), int(rate * 60 / MIN_BPM) + 1
+        if len(envelope) < longest * 4:
+            return 0.0, 0.0
+        envelope -= envelope.mean()
+        spectrum = np.fft.rfft(envelope, 2 * len(envelope))
+        correlation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2)[:longest + 1]
+        if correlation[0] <= 0:
+            return 0.0, 0.0
+        lags = np.arange(shortest, longest + 1)
+        preference = np.exp(-0.5 * (np.log2(60 * rate / lags / 120) / 1.0) ** 2)
+        best = lags[np.argmax(correlation[lags] * preference)]
+        if shortest < best < longest:
+            # Parabolic interpolation between lags.
+            a, b, c = correlation[best - 1:best + 2]
+            shift = 0.5 * (a - c) / (a - 2 * b + c) if a - 2 * b + c else 0.0
+        else:
+            shift = 0.0
+        bpm = 60 * rate / (best + shift)
+        return float(bpm), float(max(0.0, correlation[best] / correlation[0]))
+
+    def result(self):
+        # The embedding as float32, None if too little was audible.
+        np = self.np
+        if self.frames < MIN_FRAMES:
+            return None
+        mean = self.sums / self.frames
+        spread = np.sqrt(np.maximum(0, self.squares / self.frames - mean ** 2))
+        bpm, strength = self.tempo()
+        # Tempo on a log scale, so 60 and 240 are as far from 120.
+        beat = math.log2(bpm / 120) if bpm else 0.0
+        return np.concatenate([mean, spread, [beat, strength]]).astype(np.float32)
+
+
+def extract_file(path):
+    extractor = None
+    for rate, channels, block in decode_blocks(path):
+        if extractor is None:
+            extractor = FeatureExtractor(rate, channels)
+        extractor.add(block)
+    return extractor.result() if extractor is not None else None
+
+
+def _extract(path):
+    try:
+        return extract_file(path)
+    except Exception:
+        return None
+
+
+def extract_many(paths, workers=None):
+    # Yields (path, embedding or None) as tracks finish, in order.
+    paths = list(paths)
+    if not paths:
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield from zip(paths, executor.map(_extract, paths))
@@ -0,0 +1,312 @@
+import asyncio
+import itertools
+import json
+import os
+import threading
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+
+
+DEFAULT_HTTP_PORT = int(os.environ.get("MUSIC_HTTP_PORT", "47801"))
+
+CONTENT_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".mp4": "audio/mp4",
+    ".aac": "audio/aac",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".flac": "audio/flac",
+    ".wav": "audio/wav",
+    ".webm": "audio/webm",
+}
+REASONS = {200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+           404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable", 431: "Request Header Fields Too Large"}
+
+# Idle keep-alive connections are closed after this many seconds, and after
+# this many requests.
+KEEPALIVE_TIMEOUT = 15
+KEEPALIVE_REQUESTS = 1000
+MAX_HEADER = 16 * 1024
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        url = urllib.parse.urlsplit(target)
+        self.path = urllib.parse.unquote(url.path)
+        self.query = urllib.parse.parse_qs(url.query)
+
+    def param(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise ValueError(431)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise ValueError(400)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise ValueError(400)
+    if length:
+        # Nothing here takes a body; read it so the next request lines up.
+        await reader.readexactly(length)
+    return Request(method, target, version, headers)
+
+
+def parse_range(header, size):
+    # (start, end) for a single "bytes=" range, None to serve the whole
+    # file (no header, or several ranges), or "unsatisfiable".
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, end
+
+
+class LibraryServer:
+    # Serves library files and a search API over HTTP/1.1 on an asyncio
+    # loop in its own thread, so a front end or the daemon can keep running
+    # alongside it. Tracks are addressed by their stable id:
+    #
+    #   GET /tracks/<id>            the file: Range, If-Range, ETag and
+    #                               If-None-Match / If-Modified-Since
+    #   GET /search?q=&page=&size=  JSON page of library matches (all tracks
+    #                               when q is empty)
+    #
+    # Files go out with loop.sendfile(), which is os.sendfile() on plain
+    # sockets, so track bytes never pass through Python. Connections are
+    # kept alive between requests.
+
+    def __init__(self, core, host="127.0.0.1", port=DEFAULT_HTTP_PORT):
+        self.core = core
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.serving = None
+        self.connections = set()
+        self.ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="http-server", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER))
+        # Port 0 picks a free one.
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.serving = self.loop.create_task(self.server.serve_forever())
+        self.ready.set()
+        try:
+            self.loop.run_until_complete(self.serving)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Connections were closed by stop(); let their handlers finish.
+            pending = asyncio.all_tasks(self.loop)
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None and self.serving is not None:
+            def shut_down():
+                self.server.close()
+                for writer in self.connections:
+                    writer.close()
+                self.serving.cancel()
+
+            self.loop.call_soon_threadsafe(shut_down)
+        if self.thread is not None:
+            self.thread.join()
+
+    async def _handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            for _ in range(KEEPALIVE_REQUESTS):
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except ValueError as e:
+                    await self._send(writer, e.args[0], keep_alive=False)
+                    break
+                keep_alive = request.keep_alive
+                try:
+                    await self._dispatch(request, writer, keep_alive)
+                except (BrokenPipeError, ConnectionResetError):
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, RuntimeError):
+            # RuntimeError: sendfile on a transport stop() just closed.
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, request, writer, keep_alive):
+        if request.method not in ("GET", "HEAD"):
+            await self._send(writer, 405, {"Allow": "GET, HEAD"}, keep_alive=keep_alive)
+        elif request.path.startswith("/tracks/"):
+            await self._send_track(request, writer, request.path[len("/tracks/"):], keep_alive)
+        elif request.path == "/search":
+            await self._send_json(request, writer, self.search_page(request), keep_alive)
+        else:
+            await self._send(writer, 404, keep_alive=keep_alive)
+
+    async def _send(self, writer, status, headers=None, body=b"", keep_alive=True, head=False):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}",
+                 f"Date: {formatdate(usegmt=True)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        headers = dict(headers or {})
+        if status != 304:
+            headers.setdefault("Content-Length", str(len(body)))
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body and not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _send_json(self, request, writer, data, keep_alive):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        await self._send(writer, 200, {"Content-Type": "application/json; charset=utf-8",
+                                       "Cache-Control": "no-cache"},
+                         body, keep_alive, head=request.method == "HEAD")
+
+    async def _send_track(self, request, writer, track_id, keep_alive):
+        title = self.core.ids.get(track_id)
+        entry = self.core.library.get(title) if title is not None else None
+        try:
+            f = open(entry["path"], 'rb') if entry is not None else None
+        except OSError:
+            f = None
+        if f is None:
+            await self._send(writer, 404, keep_alive=keep_alive)
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            # The content hash names the bytes themselves; files imported in
+            # place fall back to size and mtime.
+            etag = (f'"{entry["content_hash"]}"' if entry.get("content_hash")
+                    else f'"{size:x}-{stat.st_mtime_ns:x}"')
+            headers = {
+                "Content-Type": CONTENT_TYPES.get(os.path.splitext(entry["path"])[1].lower(),
+                                                  "application/octet-stream"),
+                "Accept-Ranges": "bytes",
+                "ETag": etag,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                "Cache-Control": "no-cache",
+            }
+            if self._not_modified(request, etag, stat.st_mtime):
+                await self._send(writer, 304, headers, keep_alive=keep_alive)
+                return
+
+            span = None
+            if request.headers.get("if-range", etag) in (etag, headers["Last-Modified"]):
+                span = parse_range(request.headers.get("range"), size)
+            if span == "unsatisfiable":
+                headers["Content-Range"] = f"bytes */{size}"
+                await self._send(writer, 416, headers, keep_alive=keep_alive)
+                return
+            status, start, end = (206, *span) if span else (200, 0, size - 1)
+            if span:
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            await self._send(writer, status, headers, keep_alive=keep_alive)
+            if request.method == "HEAD" or end < start:
+                return
+            await asyncio.get_running_loop().sendfile(writer.transport, f, start, end - start + 1)
+
+    def _not_modified(self, request, etag, mtime):
+        match = request.headers.get("if-none-match")
+        if match is not None:
+            return match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in match.split(","))
+        since = request.headers.get("if-modified-since")
+        if since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def search_page(self, request):
+        # One extra result is fetched to tell whether there is a next page,
+        # so paging never needs the full result count.
+        query = request.param("q", "").strip()
+        try:
+            page = max(0, int(request.param("page", 0)))
+            size = max(1, min(MAX_PAGE_SIZE, int(request.param("size", PAGE_SIZE))))
+        except ValueError:
+            page, size = 0, PAGE_SIZE
+        start = page * size
+        if query:
+            titles = self.core.search_library(query, limit=start + size + 1)[start:]
+        else:
+            try:
+                titles = list(itertools.islice(self.core.library, start, start + size + 1))
+            except RuntimeError:
+                # The library changed size mid-walk (a download landed).
+                titles = list(self.core.library)[start:start + size + 1]
+        results = []
+        for title in titles[:size]:
+            entry = self.core.library.get(title)
+            if entry is None:
+                continue
+            meta = self.core.metadata.peek(entry["path"]) or {}
+            tags = meta.get("tags") or {}
+            results.append({
+                "id": entry["id"],
+                "title": title,
+                "artist": tags.get("artist") or entry.get("artist"),
+                "album": tags.get("album") or entry.get("album"),
+                "duration": meta.get("duration") or entry.get("duration"),
+                "url": f"/tracks/{entry['id']}",
+            })
+        return {"query": query, "page": page, "size": size, "more": len(titles) > size, "results": results}
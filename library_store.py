@@ -0,0 +1,333 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+
+COLUMNS = ("id", "artist", "source_url", "filename", "path", "duration", "created_at")
+
+
+class LibraryStore(ABC):
+    @abstractmethod
+    def load(self):
+        raise NotImplementedError
+
+    def iter_batches(self, batch_size=1000, first_batch=None):
+        items = list(self.load().items())
+        start = 0
+        size = first_batch or batch_size
+        while start < len(items):
+            yield dict(items[start:start + size])
+            start += size
+            size = batch_size
+
+    def put(self, title, entry):
+        self.put_many([(title, entry)])
+
+    @abstractmethod
+    def put_many(self, items):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, title):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_playlists(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_playlist(self, name, track_ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename_playlist(self, old, new):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_playlist(self, name):
+        raise NotImplementedError
+
+    def export_json(self, path):
+        library = self.load()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(library, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        pass
+
+
+class JSONLibraryStore(LibraryStore):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.playlists_path = self.path.with_name("playlists.json")
+        self.library = None
+        self.playlists = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            self._ensure_loaded()
+            return dict(self.library)
+
+    def put_many(self, items):
+        with self.lock:
+            self._ensure_loaded()
+            for title, entry in items:
+                self.library[title] = entry
+            self._write()
+
+    def delete(self, title):
+        with self.lock:
+            self._ensure_loaded()
+            self.library.pop(title, None)
+            self._write()
+
+    def load_playlists(self):
+        with self.lock:
+            self._ensure_playlists()
+            return {name: list(track_ids) for name, track_ids in self.playlists.items()}
+
+    def save_playlist(self, name, track_ids):
+        with self.lock:
+            self._ensure_playlists()
+            self.playlists[name] = list(track_ids)
+            self._write_playlists()
+
+    def rename_playlist(self, old, new):
+        with self.lock:
+            self._ensure_playlists()
+            self.playlists = {new if name == old else name: track_ids
+                              for name, track_ids in self.playlists.items()}
+            self._write_playlists()
+
+    def delete_playlist(self, name):
+        with self.lock:
+            self._ensure_playlists()
+            self.playlists.pop(name, None)
+            self._write_playlists()
+
+    def _ensure_playlists(self):
+        if self.playlists is None:
+            self.playlists = {}
+            if self.playlists_path.exists():
+                with open(self.playlists_path, 'r', encoding='utf-8') as f:
+                    self.playlists = json.load(f)
+
+    def _write_playlists(self):
+        tmp_path = self.playlists_path.with_name(self.playlists_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.playlists, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.playlists_path)
+
+    def _ensure_loaded(self):
+        if self.library is None:
+            self.library = {}
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.library = json.load(f)
+
+    def _write(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.library, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class SQLiteLibraryStore(LibraryStore):
+    # Same "songs" layout as data/songs.db, plus the local path and a JSON
+    # column for any extra per-track fields.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS songs (
+            id TEXT PRIMARY KEY,
+            title TEXT UNIQUE NOT NULL,
+            artist TEXT,
+            source_url TEXT,
+            filename TEXT,
+            path TEXT,
+            length_seconds REAL,
+            created_at REAL,
+            meta TEXT
+        )
+    """
+
+    PLAYLIST_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS playlists (
+            name TEXT PRIMARY KEY,
+            created_at REAL,
+            updated_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS playlist_tracks (
+            playlist TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            track_id TEXT NOT NULL,
+            PRIMARY KEY (playlist, position)
+        );
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+        self.conn.executescript(self.PLAYLIST_SCHEMA)
+        self.conn.commit()
+
+    def load(self):
+        library = {}
+        for batch in self.iter_batches(batch_size=10000):
+            library.update(batch)
+        return library
+
+    def iter_batches(self, batch_size=1000, first_batch=None):
+        # Keyset pagination on rowid, so writers can use the connection
+        # between batches without disturbing an open cursor.
+        last = 0
+        size = first_batch or batch_size
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, title, id, artist, source_url, filename, path, "
+                    "length_seconds, created_at, meta FROM songs WHERE rowid > ? "
+                    "ORDER BY rowid LIMIT ?", (last, size)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield {row[1]: self._entry(row[2:]) for row in rows}
+            if len(rows) < size:
+                return
+            size = batch_size
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def put_many(self, items):
+        rows = [self._row(title, entry) for title, entry in items]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO songs (id, title, artist, source_url, filename, path, "
+                "length_seconds, created_at, meta) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(title) DO UPDATE SET artist=excluded.artist, "
+                "source_url=excluded.source_url, filename=excluded.filename, "
+                "path=excluded.path, length_seconds=excluded.length_seconds, "
+                "meta=excluded.meta",
+                rows,
+            )
+
+    def delete(self, title):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM songs WHERE title = ?", (title,))
+
+    def load_playlists(self):
+        with self.lock:
+            names = [row[0] for row in self.conn.execute(
+                "SELECT name FROM playlists ORDER BY created_at, name")]
+            rows = self.conn.execute(
+                "SELECT playlist, track_id FROM playlist_tracks ORDER BY playlist, position").fetchall()
+        playlists = {name: [] for name in names}
+        for name, track_id in rows:
+            if name in playlists:
+                playlists[name].append(track_id)
+        return playlists
+
+    def save_playlist(self, name, track_ids):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO playlists (name, created_at, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET updated_at=excluded.updated_at",
+                (name, now, now),
+            )
+            self.conn.execute("DELETE FROM playlist_tracks WHERE playlist = ?", (name,))
+            self.conn.executemany(
+                "INSERT INTO playlist_tracks (playlist, position, track_id) VALUES (?, ?, ?)",
+                ((name, position, track_id) for position, track_id in enumerate(track_ids)),
+            )
+
+    def rename_playlist(self, old, new):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE playlists SET name = ?, updated_at = ? WHERE name = ?",
+                              (new, time.time(), old))
+            self.conn.execute("UPDATE playlist_tracks SET playlist = ? WHERE playlist = ?", (new, old))
+
+    def delete_playlist(self, name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM playlists WHERE name = ?", (name,))
+            self.conn.execute("DELETE FROM playlist_tracks WHERE playlist = ?", (name,))
+
+    def migrate_json(self, json_path):
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            library = json.load(f)
+        # Merged rather than only imported into an empty database: an older
+        # build may have added tracks to the JSON file since the last
+        # migration. Tracks the database already has are left as they are.
+        with self.lock:
+            titles = {row[0] for row in self.conn.execute("SELECT title FROM songs")}
+            ids = {row[0] for row in self.conn.execute("SELECT id FROM songs")}
+        new = [(title, entry) for title, entry in library.items()
+               if title not in titles and entry.get("id") not in ids]
+        self.put_many(new)
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        return len(new)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _entry(self, row):
+        song_id, artist, source_url, filename, path, duration, created_at, meta = row
+        entry = json.loads(meta) if meta else {}
+        entry.update({
+            "id": song_id,
+            "filename": filename,
+            "path": path,
+            "duration": duration or 0,
+        })
+        if artist is not None:
+            entry["artist"] = artist
+        if source_url is not None:
+            entry["source_url"] = source_url
+        if created_at is not None:
+            entry["created_at"] = created_at
+        return entry
+
+    def _row(self, title, entry):
+        entry.setdefault("id", str(uuid.uuid4()))
+        entry.setdefault("created_at", time.time())
+        meta = {k: v for k, v in entry.items() if k not in COLUMNS}
+        return (
+            entry["id"],
+            title,
+            entry.get("artist"),
+            entry.get("source_url"),
+            entry.get("filename"),
+            entry.get("path"),
+            entry.get("duration", 0),
+            entry["created_at"],
+            json.dumps(meta, ensure_ascii=False) if meta else None,
+        )
+
+
+def open_library_store(music_dir, backend=None):
+    music_dir = Path(music_dir)
+    backend = backend or os.environ.get("MUSIC_LIBRARY_BACKEND", "sqlite")
+    if backend == "json":
+        return JSONLibraryStore(music_dir / "library.json")
+    if backend == "sqlite":
+        store = SQLiteLibraryStore(music_dir / "library.db")
+        store.migrate_json(music_dir / "library.json")
+        return store
+    raise ValueError(f"Unknown library backend: {backend}")
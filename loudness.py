@@ -0,0 +1,157 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pcm import decode_blocks
+
+
+# ReplayGain 2.0 plays every track at -18 LUFS.
+REFERENCE_LUFS = -18.0
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def available():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def k_weighting(rate):
+    # The two BS.1770 pre-filter stages (high shelf, then high pass),
+    # re-derived for any sample rate.
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    highpass = ([1.0, -2.0, 1.0], [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf, highpass
+
+
+class LoudnessMeter:
+    # Integrated loudness (BS.1770 / EBU R128) and sample peak, fed one
+    # block of float samples (frames x channels) at a time.
+    #
+    # Instead of running the K-weighting IIR sample by sample, every 100 ms
+    # frame is taken to the frequency domain in one vectorised rfft and its
+    # power spectrum weighted by the filter's |H|^2: by Parseval that is the
+    # frame's K-weighted mean square. Four consecutive frames make one 400 ms
+    # gating block, as in the standard. Only one float per frame and
+    # channel is kept, never the audio.
+
+    def __init__(self, rate, channels):
+        import numpy as np
+
+        self.np = np
+        self.rate = rate
+        self.channels = channels
+        self.frame = rate // 10
+        bins = np.arange(self.frame // 2 + 1)
+        z = np.exp(-2j * np.pi * bins / self.frame)
+        response = np.ones_like(z)
+        for b, a in k_weighting(rate):
+            response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+        # One-sided spectrum: every bin but DC (and Nyquist) stands for two.
+        weights = np.abs(response) ** 2 * 2
+        weights[0] /= 2
+        if self.frame % 2 == 0:
+            weights[-1] /= 2
+        self.weights = weights / (self.frame * self.frame)
+        self.energies = []
+        self.pending = np.zeros((0, channels), dtype=np.float32)
+        self.peak = 0.0
+        self.samples = 0
+
+    def add(self, block):
+        np = self.np
+        if len(block) == 0:
+            return
+        self.samples += len(block)
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        if len(self.pending):
+            block = np.concatenate([self.pending, block])
+        whole = len(block) // self.frame * self.frame
+        self.pending = block[whole:]
+        if not whole:
+            return
+        frames = block[:whole].reshape(-1, self.frame, self.channels)
+        spectrum = np.fft.rfft(frames, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) * self.weights[None, :, None]
+        # Mean square per frame, summed over channels (all weighted 1.0:
+        # only stereo and mono are decoded).
+        self.energies.append(power.sum(axis=(1, 2)))
+
+    def integrated(self):
+        np = self.np
+        if not self.energies:
+            return None
+        frames = np.concatenate(self.energies)
+        if len(frames) < 4:
+            return None
+        blocks = (frames[:-3] + frames[1:-2] + frames[2:-1] + frames[3:]) / 4
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+        gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def result(self):
+        # {"gain": dB to reach REFERENCE_LUFS, "peak": linear sample peak,
+        #  "lufs": integrated loudness, "seconds": audio length}
+        lufs = self.integrated()
+        if lufs is None:
+            return None
+        return {
+            "gain": round(REFERENCE_LUFS - lufs, 2),
+            "peak": round(self.peak, 6),
+            "lufs": round(lufs, 2),
+            "seconds": self.samples / self.rate,
+        }
+
+
+def analyze_file(path):
+    meter = None
+    for rate, channels, block in decode_blocks(path):
+        if meter is None:
+            meter = LoudnessMeter(rate, channels)
+        meter.add(block)
+    return meter.result() if meter is not None else None
+
+
+def _analyze(path):
+    try:
+        return analyze_file(path)
+    except Exception:
+        return None
+
+
+def analyze_many(paths, workers=None):
+    # Yields (path, result or None) as tracks finish, in order. One track
+    # per task: each is seconds of FFT work, far more than the round trip.
+    paths = list(paths)
+    if not paths:
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield from zip(paths, executor.map(_analyze, paths))
+
+
+def gain_to_volume(gain, peak=None, preamp=0.0):
+    # Mixer volume can only turn things down, so tracks that would need a
+    # boost play at full volume; the peak keeps a boost from clipping.
+    volume = 10 ** ((gain + preamp) / 20)
+    if peak:
+        volume = min(volume, 1 / peak)
+    return max(0.0, min(1.0, volume))
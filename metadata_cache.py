@@ -0,0 +1,268 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Rows written per transaction when many files are read at once.
+STORE_BATCH = 500
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def _parse_gain(value):
+    if value is None:
+        return None
+    try:
+        return float(str(value).lower().replace("db", "").strip())
+    except ValueError:
+        return None
+
+
+def read_metadata(path):
+    import mutagen
+
+    audio = mutagen.File(path, easy=True)
+    if audio is None:
+        raise ValueError(f"Unrecognized audio file: {path}")
+    info = audio.info
+    tags = {}
+    if audio.tags:
+        for key, value in audio.tags.items():
+            value = _first(value)
+            if value is not None:
+                tags[key.lower()] = str(value)
+    return {
+        "duration": float(getattr(info, "length", 0) or 0),
+        "bitrate": getattr(info, "bitrate", None),
+        "sample_rate": getattr(info, "sample_rate", None),
+        "channels": getattr(info, "channels", None),
+        "tags": tags,
+        "loudness": _parse_gain(tags.get("replaygain_track_gain")),
+        "peak": _parse_gain(tags.get("replaygain_track_peak")),
+    }
+
+
+def _read(reader, path):
+    try:
+        return reader(path)
+    except Exception:
+        # Cache the failure too so unreadable files aren't re-parsed on
+        # every play; a later change to the file invalidates it.
+        return {"duration": 0, "bitrate": None, "sample_rate": None,
+                "channels": None, "tags": {}, "loudness": None, "peak": None}
+
+
+def _read_chunk(reader, paths):
+    return [_read(reader, path) for path in paths]
+
+
+class MetadataCache:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS track_metadata (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            duration REAL,
+            bitrate INTEGER,
+            sample_rate INTEGER,
+            channels INTEGER,
+            tags TEXT,
+            loudness REAL,
+            peak REAL
+        )
+    """
+
+    def __init__(self, db_path, reader=read_metadata):
+        self.reader = reader
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+        self.conn.commit()
+        self.entries = {}
+        self.loaded = False
+
+    def load(self):
+        # Entries written since the cache was opened are newer than the
+        # stored rows, so they win.
+        with self.lock:
+            if self.loaded:
+                return
+            rows = self.conn.execute(
+                "SELECT path, mtime, size, duration, bitrate, sample_rate, channels, "
+                "tags, loudness, peak FROM track_metadata").fetchall()
+            for row in rows:
+                self.entries.setdefault(row[0], self._from_row(row))
+            self.loaded = True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path):
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+            return entry
+        return self._refresh(path, st)
+
+    def peek(self, path):
+        return self.entries.get(str(path))
+
+    def refresh(self, path):
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.forget(path)
+            return None
+        return self._refresh(path, st)
+
+    def update(self, path, **fields):
+        path = str(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            entry = dict(entry, **fields)
+            self._store(path, entry)
+            return entry
+
+    def forget(self, path):
+        path = str(path)
+        with self.lock, self.conn:
+            self.entries.pop(path, None)
+            self.conn.execute("DELETE FROM track_metadata WHERE path = ?", (path,))
+
+    def read_many(self, files, workers=None, processes=True, on_progress=None, stop_event=None):
+        # files: (path, os.stat_result) pairs. Entries whose mtime and size
+        # still match are used as they are; the rest are parsed by a pool
+        # (processes by default, since tag parsing is pure Python) and
+        # written back in batched transactions. Returns ({path: entry},
+        # set of paths that were (re)read).
+        result = {}
+        stale = []
+        for path, st in files:
+            path = str(path)
+            entry = self.entries.get(path)
+            if entry is not None and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                result[path] = entry
+            else:
+                stale.append((path, st))
+        done = len(result)
+        total = done + len(stale)
+        if on_progress and done:
+            on_progress(done, total, None)
+        if not stale:
+            return result, set()
+
+        workers = workers or os.cpu_count() or 1
+        if processes:
+            # spawn, not fork: the app has threads (Tk, downloads, playback)
+            # that a forked child would inherit mid-operation.
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata")
+        # Paths go out in chunks so each task is worth the round trip to a
+        # worker process.
+        chunk = max(1, min(64, len(stale) // (workers * 4)))
+        chunks = [stale[i:i + chunk] for i in range(0, len(stale), chunk)]
+        pending = []
+        try:
+            for files_chunk, entries in zip(chunks, executor.map(
+                    _read_chunk, [self.reader] * len(chunks), [[p for p, _ in c] for c in chunks])):
+                for (path, st), entry in zip(files_chunk, entries):
+                    entry["mtime"] = st.st_mtime
+                    entry["size"] = st.st_size
+                    result[path] = entry
+                    pending.append((path, entry))
+                if len(pending) >= STORE_BATCH:
+                    self._store_many(pending)
+                    pending = []
+                done += len(files_chunk)
+                if on_progress:
+                    on_progress(done, total, files_chunk[-1][0])
+                if stop_event is not None and stop_event.is_set():
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if pending:
+                self._store_many(pending)
+        return result, {path for path, _ in stale if path in result}
+
+    def rescan(self, paths, prune=True, stop_event=None, workers=None):
+        paths = [str(path) for path in paths]
+        changed = 0
+        files = []
+        for path in paths:
+            if stop_event is not None and stop_event.is_set():
+                return changed
+            try:
+                files.append((path, os.stat(path)))
+            except OSError:
+                if path in self.entries:
+                    self.forget(path)
+                    changed += 1
+        _, reread = self.read_many(files, workers=workers, stop_event=stop_event)
+        changed += len(reread)
+        if stop_event is not None and stop_event.is_set():
+            return changed
+        if prune:
+            keep = set(paths)
+            for path in [path for path in self.entries if path not in keep]:
+                self.forget(path)
+                changed += 1
+        return changed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _refresh(self, path, st):
+        entry = _read(self.reader, path)
+        entry["mtime"] = st.st_mtime
+        entry["size"] = st.st_size
+        with self.lock:
+            self._store(path, entry)
+        return entry
+
+    def _store(self, path, entry):
+        self._store_many([(path, entry)])
+
+    def _store_many(self, items):
+        with self.lock, self.conn:
+            for path, entry in items:
+                self.entries[path] = entry
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO track_metadata (path, mtime, size, duration, bitrate, "
+                "sample_rate, channels, tags, loudness, peak) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((path, entry["mtime"], entry["size"], entry.get("duration"), entry.get("bitrate"),
+                  entry.get("sample_rate"), entry.get("channels"),
+                  json.dumps(entry.get("tags") or {}, ensure_ascii=False),
+                  entry.get("loudness"), entry.get("peak")) for path, entry in items),
+            )
+
+    def _from_row(self, row):
+        path, mtime, size, duration, bitrate, sample_rate, channels, tags, loudness, peak = row
+        return {
+            "mtime": mtime,
+            "size": size,
+            "duration": duration or 0,
+            "bitrate": bitrate,
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "tags": json.loads(tags) if tags else {},
+            "loudness": loudness,
+            "peak": peak,
+        }
@@ -0,0 +1,245 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+# Histogram bucket upper bounds in seconds: four per decade from 100 us to
+# 100 s, which keeps quantile estimates within about 30%.
+BUCKETS = tuple(round(10 ** (exponent / 4), 6) for exponent in range(-16, 9))
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        # Linear within the bucket the rank falls in, as Prometheus'
+        # histogram_quantile() does; the last bucket is capped at the max.
+        with self.lock:
+            counts, count, largest = list(self.counts), self.count, self.max
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = min(self.bounds[i], largest) if i < len(self.bounds) else largest
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return largest
+
+    def summary(self):
+        summary = {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6)}
+        for q in QUANTILES:
+            value = self.quantile(q)
+            summary[f"p{round(q * 100)}"] = round(value, 6) if value is not None else None
+        return summary
+
+
+class Span:
+    # Times a with-block into <name>_seconds; an exception leaving the
+    # block also counts towards <name>_errors.
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if kind is not None:
+            self.registry.count(f"{self.name}_errors", **self.labels)
+        return False
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _label_text(labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}" if labels else ""
+
+
+class Registry:
+    # Timings (histograms, in seconds) and counters, keyed by name and
+    # labels. Recording is a lock and a bisect, cheap enough for every
+    # search keystroke; nothing runs in the background unless an Exporter
+    # is started.
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, **labels):
+        return Span(self, name, labels)
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(seconds)
+
+    def count(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def histogram(self, name, **labels):
+        return self.histograms.get(_key(name, labels))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        return {
+            "time": time.time(),
+            "timings": {f"{name}_seconds{_label_text(labels)}": histogram.summary()
+                        for (name, labels), histogram in histograms},
+            "counters": {f"{name}_total{_label_text(labels)}": value for (name, labels), value in counters},
+        }
+
+    def prometheus(self, prefix="music_"):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        declared = set()
+        for (name, labels), histogram in histograms:
+            metric = f"{prefix}{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            with histogram.lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, n in zip(histogram.bounds + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{_label_text(labels)} {total!r}")
+            lines.append(f"{metric}_count{_label_text(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = f"{prefix}{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # JSON for a .json path, Prometheus text format otherwise (for a
+        # node_exporter textfile collector, say). Replaced atomically so a
+        # scraper never reads half a file.
+        path = str(path)
+        text = (json.dumps(self.snapshot(), indent=1) if path.endswith(".json") else self.prometheus())
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+span = REGISTRY.span
+observe = REGISTRY.observe
+count = REGISTRY.count
+
+
+class Exporter:
+    # Writes the registry to a file every `interval` seconds, and once more
+    # on stop().
+
+    def __init__(self, path, interval=10.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="metrics-export", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            self.registry.write(self.path)
+        except OSError:
+            pass
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self._write()
+
+
+class LoopMonitor:
+    # Stall detection for an event loop with after() (Tk's, or MainLoop):
+    # a timer asks to run every `interval` seconds and records how late it
+    # actually ran. Anything over `threshold` means the loop was blocked
+    # that long, and the UI with it.
+
+    def __init__(self, scheduler, interval=0.25, threshold=0.2, name="loop", registry=REGISTRY):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.threshold = threshold
+        self.name = name
+        self.registry = registry
+        self.due = None
+        self.timer = None
+
+    def start(self):
+        self.due = time.perf_counter() + self.interval
+        self.timer = self.scheduler.after(int(self.interval * 1000), self._tick)
+        return self
+
+    def stop(self):
+        if self.timer is not None:
+            self.scheduler.after_cancel(self.timer)
+            self.timer = None
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self.due)
+        self.registry.observe(f"{self.name}_lag", lag)
+        if lag >= self.threshold:
+            self.registry.observe(f"{self.name}_stall", lag)
+        self.due = now + self.interval
+        self.timer = self.scheduler.after(int(self.interval * 1000), self._tick)
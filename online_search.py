@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+
+
+PAGE_SIZE = 15
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+def cache_key(query, page):
+    return f"{page}:{' '.join(query.lower().split())}"
+
+
+class SearchResult:
+    def __init__(self, video_id, title, watch_url, length=None):
+        self.video_id = video_id
+        self.title = title
+        self.watch_url = watch_url
+        self.length = length
+
+    def to_dict(self):
+        return {
+            "video_id": self.video_id,
+            "title": self.title,
+            "watch_url": self.watch_url,
+            "length": self.length,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["video_id"], data["title"], data["watch_url"], data.get("length"))
+
+
+class SearchProvider(ABC):
+    @abstractmethod
+    def search(self, query, page, page_size):
+        raise NotImplementedError
+
+
+class YouTubeSearchProvider(SearchProvider):
+    def __init__(self, suffix=" official audio", max_sessions=8):
+        self.suffix = suffix
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def search(self, query, page, page_size):
+        from pytubefix import Search
+
+        with self.lock:
+            session = self.sessions.get(query)
+            if session is None:
+                session = (Search(query + self.suffix), threading.Lock())
+                self.sessions[query] = session
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(query)
+
+        search, lock = session
+        end = (page + 1) * page_size
+        with lock:
+            results = search.results
+            while len(results) < end:
+                before = len(results)
+                search.get_next_results()
+                results = search.results
+                if len(results) == before:
+                    break
+            videos = results[page * page_size:end]
+        return [SearchResult(video.video_id, video.title, video.watch_url) for video in videos]
+
+
+class LocalSearchProvider(SearchProvider):
+    # Substring search over an in-memory catalog of (video_id, title)
+    # pairs, with optional artificial latency; stands in for the network.
+
+    def __init__(self, catalog, latency=0.0):
+        self.catalog = list(catalog)
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def search(self, query, page, page_size):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        query = query.lower()
+        matches = [SearchResult(video_id, title, f"local://{video_id}")
+                   for video_id, title in self.catalog if query in title.lower()]
+        return matches[page * page_size:(page + 1) * page_size]
+
+
+class SearchCache:
+    def __init__(self, path=None, max_entries=256, ttl=6 * 3600):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._load()
+
+    def get(self, query, page):
+        key = cache_key(query, page)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, results = entry
+            if time.time() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return results
+
+    def put(self, query, page, results):
+        with self.lock:
+            key = cache_key(query, page)
+            self.entries[key] = (time.time(), results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._save()
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, stored_at, results in saved:
+            if now - stored_at <= self.ttl:
+                self.entries[key] = (stored_at, [SearchResult.from_dict(r) for r in results])
+
+    def _save(self):
+        if not self.path:
+            return
+        saved = [[key, stored_at, [r.to_dict() for r in results]]
+                 for key, (stored_at, results) in self.entries.items()]
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class OnlineSearch:
+    def __init__(self, provider, cache=None, page_size=PAGE_SIZE, workers=4):
+        self.provider = provider
+        self.cache = cache or SearchCache()
+        self.page_size = page_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search")
+        self.inflight = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def search(self, query, page=0, on_results=None, on_error=None, prefetch=True):
+        # Only the most recent search() call gets its callbacks; anything
+        # still running for an older query is dropped when it finishes.
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+
+        def deliver(future):
+            if generation != self.generation:
+                return
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    on_error(error)
+                return
+            results = future.result()
+            if on_results:
+                on_results(results, query, page)
+            if prefetch and len(results) == self.page_size:
+                self.fetch(query, page + 1, generation)
+
+        future = self.fetch(query, page, generation)
+        future.add_done_callback(deliver)
+        return future
+
+    def fetch(self, query, page, generation=None):
+        cached = self.cache.get(query, page)
+        if cached is not None:
+            metrics.count("online_search_cache_hits")
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        key = cache_key(query, page)
+        with self.lock:
+            entry = self.inflight.get(key)
+            if entry is not None:
+                # Coalesce with the identical request already in flight and
+                # make sure it now counts as wanted by the newest search.
+                if generation is not None:
+                    entry[1] = max(entry[1] or 0, generation)
+                return entry[0]
+            entry = [None, generation]
+            self.inflight[key] = entry
+            entry[0] = self.executor.submit(self._run, query, page, key, entry)
+            return entry[0]
+
+    def _run(self, query, page, key, entry):
+        try:
+            generation = entry[1]
+            if generation is not None and generation != self.generation:
+                # A newer search arrived while this one was still queued.
+                raise SearchCancelled(query)
+            with metrics.span("online_search"):
+                results = self.provider.search(query, page, self.page_size)
+            self.cache.put(query, page, results)
+            return results
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
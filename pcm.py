@@ -0,0 +1,58 @@
+import shutil
+import subprocess
+import wave
+
+
+# Audio decoded per step; memory use doesn't grow with the length of the
+# track.
+BLOCK_SECONDS = 10
+DECODE_RATE = 48000
+
+
+def decode_blocks(path, block_seconds=BLOCK_SECONDS):
+    # Yields (rate, channels, float32 frames x channels) blocks. WAV is
+    # read directly; everything else is decoded by ffmpeg through a pipe.
+    import numpy as np
+
+    if str(path).lower().endswith(".wav"):
+        with wave.open(str(path), 'rb') as w:
+            rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+            while True:
+                data = w.readframes(rate * block_seconds)
+                if not data:
+                    return
+                yield rate, channels, _pcm_to_float(np, data, width).reshape(-1, channels)
+        return
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed to decode " + str(path))
+    channels = 2
+    process = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-i", str(path),
+         "-vn", "-ac", str(channels), "-ar", str(DECODE_RATE), "-f", "f32le", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    size = DECODE_RATE * block_seconds * channels * 4
+    try:
+        while True:
+            data = process.stdout.read(size)
+            if not data:
+                break
+            data = data[:len(data) // (channels * 4) * channels * 4]
+            yield DECODE_RATE, channels, np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def _pcm_to_float(np, data, width):
+    if width == 1:
+        return (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 0x800000
+    dtype = {2: np.int16, 4: np.int32}[width]
+    return np.frombuffer(data, dtype=dtype).astype(np.float32) / float(2 ** (8 * width - 1))
@@ -0,0 +1,181 @@
+import itertools
+from collections import defaultdict, deque
+
+
+class PlayQueue:
+    # Upcoming tracks as a doubly linked list threaded through dicts, so
+    # adding, removing and moving an entry is O(1) however long the queue
+    # is. Entries get their own ids because the same track can be queued
+    # more than once; the entry ids stay valid while other entries move.
+    #
+    # Tracks the user queued by hand ("play next" / "add to queue") sit in
+    # front of the ones that came from the playlist or view being played
+    # (the context), the way most players do it. Finished tracks go to the
+    # history, which is what "previous" walks back through.
+
+    def __init__(self, history_size=500):
+        self.next = {}
+        self.prev = {}
+        self.track_of = {}
+        self.entries_of = defaultdict(set)
+        self.head = None
+        self.tail = None
+        self.user_entries = set()
+        self.user_tail = None
+        self.counter = itertools.count(1)
+        self.context = []
+        self.repeat = True
+        self.current = None
+        self.history = deque(maxlen=history_size)
+
+    def __len__(self):
+        return len(self.track_of)
+
+    def __iter__(self):
+        return self.entries()
+
+    def __contains__(self, entry_id):
+        return entry_id in self.track_of
+
+    def entries(self):
+        entry_id = self.head
+        while entry_id is not None:
+            yield entry_id
+            entry_id = self.next[entry_id]
+
+    def tracks(self, limit=None):
+        return [self.track_of[entry_id] for entry_id in itertools.islice(self.entries(), limit)]
+
+    def track(self, entry_id):
+        return self.track_of[entry_id]
+
+    def peek(self):
+        if self.head is None:
+            self._refill()
+        return self.head
+
+    def set_context(self, track_ids, start=None):
+        # Playing from a view or playlist replaces what is queued from the
+        # previous context but keeps hand-queued tracks in front of it.
+        for entry_id in [e for e in self.entries() if e not in self.user_entries]:
+            self.remove(entry_id)
+        self.context = list(track_ids)
+        after = self.context[start + 1:] if start is not None else self.context
+        for track_id in after:
+            self._insert_after(self.tail, track_id)
+
+    def add(self, track_id):
+        entry_id = self._insert_after(self.user_tail, track_id)
+        self.user_entries.add(entry_id)
+        self.user_tail = entry_id
+        return entry_id
+
+    def add_next(self, track_id):
+        entry_id = self._insert_after(None, track_id)
+        self.user_entries.add(entry_id)
+        if self.user_tail is None:
+            self.user_tail = entry_id
+        return entry_id
+
+    def append(self, track_id):
+        return self._insert_after(self.tail, track_id)
+
+    def remove(self, entry_id):
+        prev_id = self.prev.pop(entry_id)
+        next_id = self.next.pop(entry_id)
+        if prev_id is None:
+            self.head = next_id
+        else:
+            self.next[prev_id] = next_id
+        if next_id is None:
+            self.tail = prev_id
+        else:
+            self.prev[next_id] = prev_id
+        track_id = self.track_of.pop(entry_id)
+        entries = self.entries_of[track_id]
+        entries.discard(entry_id)
+        if not entries:
+            del self.entries_of[track_id]
+        if entry_id in self.user_entries:
+            self.user_entries.discard(entry_id)
+            if self.user_tail == entry_id:
+                self.user_tail = prev_id if prev_id in self.user_entries else None
+        return track_id
+
+    def move(self, entry_id, after=None):
+        # after=None moves the entry to the front.
+        if entry_id == after:
+            return
+        user = entry_id in self.user_entries
+        track_id = self.remove(entry_id)
+        self._link(entry_id, track_id, after)
+        if user:
+            self.user_entries.add(entry_id)
+            if self.user_tail is None or self.user_tail == after:
+                self.user_tail = entry_id
+
+    def remove_track(self, track_id):
+        for entry_id in list(self.entries_of.get(track_id, ())):
+            self.remove(entry_id)
+        self.context = [t for t in self.context if t != track_id]
+        self.history = deque((t for t in self.history if t != track_id), maxlen=self.history.maxlen)
+        if self.current == track_id:
+            self.current = None
+
+    def clear(self):
+        self.next.clear()
+        self.prev.clear()
+        self.track_of.clear()
+        self.entries_of.clear()
+        self.user_entries.clear()
+        self.head = self.tail = self.user_tail = None
+
+    def start(self, track_id):
+        # Something new starts playing: the old track becomes history.
+        if self.current is not None and self.current != track_id:
+            self.history.append(self.current)
+        self.current = track_id
+
+    def advance(self):
+        entry_id = self.peek()
+        if entry_id is None:
+            return None
+        track_id = self.remove(entry_id)
+        self.start(track_id)
+        return track_id
+
+    def back(self):
+        # Go back to what actually played last; the current track is put
+        # back at the front so "next" returns to it.
+        if not self.history:
+            return None
+        if self.current is not None:
+            self.add_next(self.current)
+        self.current = self.history.pop()
+        return self.current
+
+    def _refill(self):
+        if self.repeat and self.context:
+            for track_id in self.context:
+                self._insert_after(self.tail, track_id)
+
+    def _insert_after(self, after, track_id):
+        entry_id = next(self.counter)
+        self._link(entry_id, track_id, after)
+        return entry_id
+
+    def _link(self, entry_id, track_id, after):
+        if after is None:
+            next_id = self.head
+            self.head = entry_id
+        else:
+            next_id = self.next[after]
+            self.next[after] = entry_id
+        self.prev[entry_id] = after
+        self.next[entry_id] = next_id
+        if next_id is None:
+            self.tail = entry_id
+        else:
+            self.prev[next_id] = entry_id
+        self.track_of[entry_id] = track_id
+        self.entries_of[track_id].add(entry_id)
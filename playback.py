@@ -0,0 +1,422 @@
+import io
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import pygame
+
+from seek_table import SeekTableCache
+
+
+END_EVENT = pygame.USEREVENT + 1
+
+STOPPED = "stopped"
+PLAYING = "playing"
+PAUSED = "paused"
+
+# How long to keep re-checking once the clock says the track should be over.
+END_POLL_MS = 250
+
+
+class PlaybackClock:
+    def __init__(self, time_fn=time.monotonic):
+        self.time_fn = time_fn
+        self.anchor_pos = 0.0
+        self.anchor_time = None
+
+    @property
+    def running(self):
+        return self.anchor_time is not None
+
+    def start(self, pos=0.0):
+        self.anchor_pos = pos
+        self.anchor_time = self.time_fn()
+
+    def pause(self):
+        self.anchor_pos = self.position()
+        self.anchor_time = None
+
+    def resume(self):
+        if self.anchor_time is None:
+            self.anchor_time = self.time_fn()
+
+    def seek(self, pos):
+        self.anchor_pos = pos
+        if self.anchor_time is not None:
+            self.anchor_time = self.time_fn()
+
+    def stop(self):
+        self.anchor_pos = 0.0
+        self.anchor_time = None
+
+    def position(self):
+        if self.anchor_time is None:
+            return self.anchor_pos
+        return self.anchor_pos + self.time_fn() - self.anchor_time
+
+
+def decode_tail(path, seconds, frequency, channels):
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+         "-sseof", f"-{seconds}", "-i", str(path), "-vn",
+         "-ac", str(channels), "-ar", str(frequency), "-f", "wav", "pipe:1"],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="replace").strip())
+    return result.stdout
+
+
+class UpcomingTrack:
+    def __init__(self, filepath, duration, token, volume=1.0):
+        self.filepath = filepath
+        self.duration = duration
+        self.token = token
+        self.volume = volume
+        self.queued = False
+
+
+class PlaybackEngine:
+    # Only wakes up while playing: once per displayed second, and around
+    # the expected end of the track to pick up pygame's end event. While
+    # paused or stopped nothing is scheduled at all.
+    #
+    # The upcoming track is handed to pygame's music queue so SDL switches
+    # to it without a gap. With crossfade enabled, the last seconds of the
+    # current track are decoded ahead of time into a Sound that fades out
+    # on a mixer channel while the next track fades in as music.
+    #
+    # Each track can come with its own volume (its ReplayGain); it is set on
+    # the music stream when the track starts.
+    #
+    # play_stream() plays from a file object instead of a path: a track
+    # that is still downloading. It has no seek table or crossfade tail,
+    # and seeks only as far as the decoder can on the open stream.
+
+    def __init__(self, scheduler, on_position=None, on_track_end=None,
+                 on_track_change=None, crossfade=0.0):
+        self.scheduler = scheduler
+        self.on_position = on_position
+        self.on_track_end = on_track_end
+        self.on_track_change = on_track_change
+        self.crossfade = crossfade
+        self.clock = PlaybackClock()
+        self.state = STOPPED
+        self.duration = 0
+        self.volume = 1.0
+        self.current_file = None
+        self.upcoming = None
+        self.tail = None
+        self.tail_channel = None
+        self.generation = 0
+        self.timer = None
+        self.rendered = None
+        self.seek_tables = SeekTableCache()
+        # Track time at which the loaded stream starts; non-zero after a
+        # fallback seek that reopened the file at a frame's byte offset.
+        self.stream_base = 0.0
+        self.stream_file = None
+
+        pygame.mixer.init()
+        # The end event needs pygame's event queue, which comes with the
+        # video subsystem; the dummy driver gives the queue without a second
+        # display connection next to Tk's (or a fight over the Cocoa app on
+        # macOS). A driver set by the user is left alone.
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        try:
+            pygame.display.init()
+            pygame.mixer.music.set_endevent(END_EVENT)
+            self.events = True
+        except pygame.error:
+            self.events = False
+        self.can_crossfade = self.events and shutil.which("ffmpeg") is not None
+
+    def position(self):
+        return min(self.clock.position(), self.duration) if self.duration else self.clock.position()
+
+    def play(self, filepath, duration, start=0.0, volume=1.0):
+        self._stop_tail()
+        pygame.mixer.music.stop()
+        pygame.mixer.music.load(filepath)
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play(start=start)
+        self._clear_end_events()
+        self.volume = volume
+        self.current_file = filepath
+        self.duration = duration
+        self.upcoming = None
+        self.state = PLAYING
+        self.clock.start(start)
+        self.rendered = None
+        self.stream_base = 0.0
+        self._close_stream_file()
+        self.seek_tables.prefetch(filepath)
+        self._load_tail()
+        self._reschedule()
+
+    def play_stream(self, stream, namehint, duration, volume=1.0):
+        self._stop_tail()
+        pygame.mixer.music.stop()
+        self._close_stream_file()
+        pygame.mixer.music.load(stream, namehint)
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play()
+        self._clear_end_events()
+        self.volume = volume
+        self.current_file = None
+        self.stream_file = stream
+        self.duration = duration
+        self.upcoming = None
+        self.state = PLAYING
+        self.clock.start(0.0)
+        self.rendered = None
+        self.stream_base = 0.0
+        self._load_tail()
+        self._reschedule()
+
+    def set_next(self, filepath, duration, token=None, volume=1.0):
+        self.upcoming = UpcomingTrack(filepath, duration, token, volume)
+        if self.state != STOPPED and not self._crossfade_enabled():
+            self._queue_upcoming()
+        if self.state == PLAYING:
+            self._reschedule()
+
+    def pause(self):
+        if self.state != PLAYING:
+            return
+        pygame.mixer.music.pause()
+        pygame.mixer.pause()
+        self.clock.pause()
+        self.state = PAUSED
+        self._cancel_timer()
+
+    def resume(self):
+        if self.state != PAUSED:
+            return
+        pygame.mixer.music.unpause()
+        pygame.mixer.unpause()
+        self.clock.resume()
+        self.state = PLAYING
+        self._reschedule()
+
+    def seek(self, pos):
+        if self.state == STOPPED:
+            return
+        self._stop_tail()
+        if self.current_file is None:
+            try:
+                pygame.mixer.music.set_pos(pos)
+            except pygame.error:
+                return
+            self.clock.seek(pos)
+            self.rendered = None
+            self._render()
+            if self.state == PLAYING:
+                self._reschedule()
+            return
+        table = self.seek_tables.peek(self.current_file)
+        offset = None
+        if table is not None:
+            pos, offset = table.lookup(pos)
+
+        # Seek on the open decoder when SDL supports it; otherwise reopen,
+        # starting straight at the target frame when the table knows where
+        # it is so VBR files don't have to be scanned from the start.
+        try:
+            if pos < self.stream_base:
+                raise pygame.error("target is before the loaded stream")
+            pygame.mixer.music.set_pos(pos - self.stream_base)
+        except pygame.error:
+            self._reopen_at(pos, offset)
+
+        self.clock.seek(pos)
+        self.rendered = None
+        self._render()
+        if self.state == PLAYING:
+            self._reschedule()
+
+    def _reopen_at(self, pos, offset):
+        pygame.mixer.music.stop()
+        self._close_stream_file()
+        if offset is not None:
+            self.stream_file = open(self.current_file, 'rb')
+            self.stream_file.seek(offset)
+            pygame.mixer.music.load(self.stream_file, "mp3")
+            pygame.mixer.music.play()
+            self.stream_base = pos
+        else:
+            pygame.mixer.music.load(self.current_file)
+            pygame.mixer.music.play(start=pos)
+            self.stream_base = 0.0
+        if self.state == PAUSED:
+            pygame.mixer.music.pause()
+        self._clear_end_events()
+        # stop() also drops pygame's queued track.
+        if self.upcoming is not None and self.upcoming.queued:
+            self._queue_upcoming()
+
+    def _close_stream_file(self):
+        if self.stream_file is not None:
+            self.stream_file.close()
+            self.stream_file = None
+
+    def stop(self):
+        self._stop_tail()
+        pygame.mixer.music.stop()
+        self._clear_end_events()
+        self.clock.stop()
+        self.state = STOPPED
+        self.current_file = None
+        self.upcoming = None
+        self.tail = None
+        self.stream_base = 0.0
+        self._close_stream_file()
+        self._cancel_timer()
+
+    def shutdown(self):
+        self.stop()
+        pygame.mixer.quit()
+        if self.events:
+            pygame.display.quit()
+
+    def _crossfade_enabled(self):
+        return (self.crossfade > 0 and self.can_crossfade and self.current_file is not None
+                and self.duration > 2 * self.crossfade)
+
+    def _queue_upcoming(self):
+        # Without the end event there is no way to tell when pygame moved
+        # on to a queued track, so fall back to starting it on track end.
+        if self.events and self.upcoming is not None:
+            pygame.mixer.music.queue(self.upcoming.filepath)
+            self.upcoming.queued = True
+
+    def _load_tail(self):
+        self.tail = None
+        self.generation += 1
+        if not self._crossfade_enabled():
+            return
+        generation = self.generation
+        path = self.current_file
+        frequency, _, channels = pygame.mixer.get_init()
+
+        def work():
+            try:
+                data = decode_tail(path, self.crossfade, frequency, channels)
+            except Exception:
+                return
+            if generation == self.generation:
+                self.tail = data
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def _stop_tail(self):
+        if self.tail_channel is not None:
+            self.tail_channel.stop()
+            self.tail_channel = None
+
+    def _clear_end_events(self):
+        if self.events:
+            pygame.event.clear(END_EVENT)
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.scheduler.after_cancel(self.timer)
+            self.timer = None
+
+    def _crossfade_point(self):
+        if self.upcoming is None or self.upcoming.queued or not self._crossfade_enabled():
+            return None
+        return self.duration - self.crossfade
+
+    def _reschedule(self):
+        self._cancel_timer()
+        pos = self.clock.position()
+        delay = math.floor(pos) + 1 - pos
+        if self.duration:
+            delay = min(delay, max(0.0, self.duration - pos))
+        fade_at = self._crossfade_point()
+        if fade_at is not None:
+            delay = min(delay, max(0.0, fade_at - pos))
+        self.timer = self.scheduler.after(max(1, int(delay * 1000) + 1), self._tick)
+
+    def _tick(self):
+        self.timer = None
+        if self.state != PLAYING:
+            return
+        if self._ended():
+            upcoming = self.upcoming
+            if upcoming is not None and upcoming.queued:
+                self._switch_to(upcoming, self.clock.position() - self.duration)
+                return
+            self.state = STOPPED
+            self.clock.stop()
+            if self.on_track_end:
+                self.on_track_end()
+            return
+        fade_at = self._crossfade_point()
+        if fade_at is not None and self.clock.position() >= fade_at:
+            self._start_crossfade()
+            return
+        self._render()
+        if self.duration and self.clock.position() >= self.duration:
+            self.timer = self.scheduler.after(END_POLL_MS, self._tick)
+        else:
+            self._reschedule()
+
+    def _start_crossfade(self):
+        upcoming = self.upcoming
+        if self.tail is None:
+            # The tail isn't decoded yet; settle for a gapless switch.
+            self._queue_upcoming()
+            self._reschedule()
+            return
+        fade_ms = int(self.crossfade * 1000)
+        remaining_ms = int(max(0.0, self.duration - self.clock.position()) * 1000)
+        tail = pygame.mixer.Sound(file=io.BytesIO(self.tail))
+        pygame.mixer.music.load(upcoming.filepath)
+        pygame.mixer.music.set_volume(upcoming.volume)
+        pygame.mixer.music.play(fade_ms=fade_ms)
+        self._clear_end_events()
+        self.tail_channel = tail.play()
+        if self.tail_channel is not None:
+            self.tail_channel.set_volume(self.volume)
+            self.tail_channel.fadeout(max(1, remaining_ms))
+        self._switch_to(upcoming, 0.0)
+
+    def _switch_to(self, upcoming, offset):
+        # After a gapless switch this lands up to one tick into the track.
+        pygame.mixer.music.set_volume(upcoming.volume)
+        self.volume = upcoming.volume
+        self.current_file = upcoming.filepath
+        self.duration = upcoming.duration
+        self.upcoming = None
+        self.stream_base = 0.0
+        self._close_stream_file()
+        self.seek_tables.prefetch(upcoming.filepath)
+        self.clock.start(max(0.0, offset))
+        self.rendered = None
+        self._load_tail()
+        if self.on_track_change:
+            self.on_track_change(upcoming.token)
+        if self.state == PLAYING:
+            self._render()
+            self._reschedule()
+
+    def _ended(self):
+        if self.events:
+            # Drain everything so unrelated events can't pile up in the queue.
+            if any(event.type == END_EVENT for event in pygame.event.get()):
+                return True
+        if self.duration and self.clock.position() < self.duration:
+            return False
+        return not pygame.mixer.music.get_busy()
+
+    def _render(self):
+        second = int(self.position())
+        if second != self.rendered:
+            self.rendered = second
+            if self.on_position:
+                self.on_position(self.position())
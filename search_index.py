@@ -0,0 +1,194 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
+from itertools import chain
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+EXACT_SCORE = 3.0
+PREFIX_SCORE = 2.0
+FUZZY_SCORE = 1.0
+SUBSTRING_SCORE = 0.5
+MIN_FUZZY_LENGTH = 4
+MIN_SUBSTRING_LENGTH = 3
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def within_one_edit(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        if a[i + 1:] == b[i + 1:]:
+            return True
+        return a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    def __init__(self, keys=()):
+        self.lock = threading.RLock()
+        self.doc_tokens = {}
+        self.doc_rank = {}
+        self.postings = defaultdict(set)
+        self.gram_postings = defaultdict(set)
+        self.vocab = []
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def __contains__(self, key):
+        return key in self.doc_tokens
+
+    def rebuild(self, keys):
+        with self.lock:
+            self.doc_tokens.clear()
+            self.doc_rank.clear()
+            self.postings.clear()
+            self.gram_postings.clear()
+            self.vocab = []
+            for key in keys:
+                self._add(key)
+
+    def add(self, key, text=None):
+        with self.lock:
+            if key in self.doc_tokens:
+                self._remove(key)
+            self._add(key, text)
+
+    def add_many(self, keys):
+        with self.lock:
+            for key in keys:
+                if key in self.doc_tokens:
+                    self._remove(key)
+                self._add(key)
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.doc_tokens:
+                self._remove(key)
+
+    def _add(self, key, text=None):
+        tokens = tuple(dict.fromkeys(tokenize(text if text is not None else key)))
+        self.doc_tokens[key] = tokens
+        self.doc_rank[key] = (len(tokens), key)
+        for token in tokens:
+            docs = self.postings[token]
+            if not docs:
+                bisect.insort(self.vocab, token)
+                for gram in trigrams(token):
+                    self.gram_postings[gram].add(token)
+            docs.add(key)
+
+    def _remove(self, key):
+        del self.doc_rank[key]
+        for token in self.doc_tokens.pop(key):
+            docs = self.postings[token]
+            docs.discard(key)
+            if not docs:
+                del self.postings[token]
+                del self.vocab[bisect.bisect_left(self.vocab, token)]
+                for gram in trigrams(token):
+                    grams = self.gram_postings[gram]
+                    grams.discard(token)
+                    if not grams:
+                        del self.gram_postings[gram]
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self.vocab, prefix)
+        end = bisect.bisect_left(self.vocab, prefix + "\U0010ffff", start)
+        return self.vocab[start:end]
+
+    def _fuzzy_tokens(self, token):
+        if len(token) < MIN_FUZZY_LENGTH:
+            return []
+        grams = trigrams(token)
+        counts = Counter(chain.from_iterable(
+            self.gram_postings[gram] for gram in grams if gram in self.gram_postings))
+        # One edit touches at most three trigrams, or four for a transposition.
+        needed = len(grams) - 4
+        return [candidate for candidate, shared in counts.items()
+                if shared >= needed and candidate != token
+                and within_one_edit(token, candidate)]
+
+    def _substring_tokens(self, token):
+        # Tokens with `token` inside them but not at the start (prefixes
+        # are their own tier): every trigram of the token is one of theirs,
+        # so intersect those postings, smallest first, and check what's
+        # left.
+        if len(token) < MIN_SUBSTRING_LENGTH:
+            return []
+        postings = []
+        for gram in {token[i:i + 3] for i in range(len(token) - 2)}:
+            tokens = self.gram_postings.get(gram)
+            if not tokens:
+                return []
+            postings.append(tokens)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return [candidate for candidate in candidates
+                if token in candidate and not candidate.startswith(token)]
+
+    def _token_tiers(self, token):
+        exact = self.postings.get(token, set())
+        prefix = set().union(*(self.postings[c] for c in self._prefix_tokens(token)))
+        prefix -= exact
+        fuzzy = set().union(*(self.postings[c] for c in self._fuzzy_tokens(token)))
+        fuzzy -= exact
+        fuzzy -= prefix
+        substring = set().union(*(self.postings[c] for c in self._substring_tokens(token)))
+        substring -= exact
+        substring -= prefix
+        substring -= fuzzy
+        return ((EXACT_SCORE, exact), (PREFIX_SCORE, prefix), (FUZZY_SCORE, fuzzy),
+                (SUBSTRING_SCORE, substring))
+
+    def search(self, query, limit=None):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self.lock:
+            # Docs are bucketed by total score so ranking only needs set
+            # operations plus a sort (or partial sort) inside each bucket.
+            groups = None
+            for token in tokens:
+                tiers = self._token_tiers(token)
+                if groups is None:
+                    groups = {score: docs for score, docs in tiers if docs}
+                    continue
+                merged = defaultdict(set)
+                for score, docs in groups.items():
+                    for tier_score, tier_docs in tiers:
+                        matched = docs & tier_docs
+                        if matched:
+                            merged[score + tier_score] |= matched
+                groups = merged
+                if not groups:
+                    return []
+
+            rank = self.doc_rank.__getitem__
+            results = []
+            for score in sorted(groups, reverse=True):
+                docs = groups[score]
+                if limit is not None and limit - len(results) < len(docs):
+                    results.extend(heapq.nsmallest(limit - len(results), docs, key=rank))
+                    break
+                results.extend(sorted(docs, key=rank))
+        return results
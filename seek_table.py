@@ -0,0 +1,204 @@
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    25: (11025, 12000, 8000),
+}
+
+# Give up if no frame header shows up this far into the audio data.
+MAX_SYNC_SEARCH = 64 * 1024
+
+
+class SeekTableError(Exception):
+    pass
+
+
+def parse_header(header):
+    if header >> 21 != 0x7FF:
+        return None
+    version_bits = (header >> 19) & 3
+    layer_bits = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 15
+    rate_index = (header >> 10) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    version = {3: 1, 2: 2, 0: 25}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (header >> 9) & 1
+    mono = ((header >> 6) & 3) == 3
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    return length, samples, sample_rate, side_info
+
+
+def id3v2_size(data):
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class SeekTable:
+    # Byte offset of every audio frame, so any time maps to the frame that
+    # contains it (and back to that frame's exact start time) in O(1).
+
+    def __init__(self, offsets, samples_per_frame, sample_rate, audio_end):
+        self.offsets = offsets
+        self.samples_per_frame = samples_per_frame
+        self.sample_rate = sample_rate
+        self.audio_end = audio_end
+
+    @property
+    def frame_count(self):
+        return len(self.offsets)
+
+    @property
+    def frame_duration(self):
+        return self.samples_per_frame / self.sample_rate
+
+    @property
+    def duration(self):
+        return self.frame_count * self.frame_duration
+
+    def lookup(self, seconds):
+        if not self.offsets:
+            return 0.0, 0
+        frame = int(max(0.0, seconds) / self.frame_duration)
+        frame = min(frame, len(self.offsets) - 1)
+        return frame * self.frame_duration, self.offsets[frame]
+
+
+def build_seek_table(path):
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SeekTableError(f"Empty file: {path}")
+    with data:
+        return _scan_frames(data, path)
+
+
+def _scan_frames(data, path):
+    pos = id3v2_size(data[:10])
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    offsets = array('Q')
+    samples_per_frame = sample_rate = None
+    unpack = struct.unpack_from
+    while pos + 4 <= end:
+        frame = parse_header(unpack(">I", data, pos)[0])
+        if frame is None or pos + frame[0] > end:
+            if not offsets and pos > MAX_SYNC_SEARCH:
+                break
+            # Not a frame header (junk or a stray tag): resync on the next 0xFF.
+            pos = data.find(b"\xff", pos + 1, end)
+            if pos < 0:
+                break
+            continue
+        length, samples, rate, side_info = frame
+        if samples_per_frame is None:
+            samples_per_frame, sample_rate = samples, rate
+            tag = data[pos + 4 + side_info:pos + 8 + side_info]
+            if tag in (b"Xing", b"Info") or data[pos + 36:pos + 40] == b"VBRI":
+                # LAME/Fraunhofer info frame: silent, not part of the audio.
+                pos += length
+                continue
+        offsets.append(pos)
+        pos += length
+
+    if not offsets:
+        raise SeekTableError(f"No MPEG audio frames found in {path}")
+    return SeekTable(offsets, samples_per_frame, sample_rate, end)
+
+
+class SeekTableCache:
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.tables = OrderedDict()
+        self.building = set()
+        self.lock = threading.Lock()
+
+    def peek(self, path):
+        key = str(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.tables.get(key)
+            if entry is None or entry[0] != (st.st_mtime, st.st_size):
+                return None
+            self.tables.move_to_end(key)
+            return entry[1]
+
+    def get(self, path):
+        table = self.peek(path)
+        if table is None:
+            table = self._build(str(path))
+        return table
+
+    def prefetch(self, path):
+        key = str(path)
+        if not key.lower().endswith(".mp3"):
+            return
+        with self.lock:
+            if key in self.building:
+                return
+        if self.peek(key) is not None:
+            return
+        threading.Thread(target=self._build, args=(key,), daemon=True).start()
+
+    def _build(self, key):
+        with self.lock:
+            self.building.add(key)
+        try:
+            st = os.stat(key)
+            table = build_seek_table(key)
+        except (OSError, SeekTableError):
+            return None
+        finally:
+            with self.lock:
+                self.building.discard(key)
+        with self.lock:
+            self.tables[key] = ((st.st_mtime, st.st_size), table)
+            self.tables.move_to_end(key)
+            while len(self.tables) > self.max_entries:
+                self.tables.popitem(last=False)
+        return table
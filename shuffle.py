@@ -0,0 +1,122 @@
+import random
+from collections import deque
+
+
+# How many later candidates to look at before giving up on artist spread.
+SPREAD_ATTEMPTS = 8
+
+
+class LazyPermutation:
+    # Fisher-Yates drawn one position at a time. Only positions that have
+    # been swapped are stored, so each draw costs O(1) time and at most one
+    # dict entry, and nothing is allocated up front for huge ranges.
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+        self.drawn = 0
+        self.swaps = {}
+
+    def __len__(self):
+        return self.n - self.drawn
+
+    def draw(self):
+        if self.drawn >= self.n:
+            return None
+        i = self.drawn
+        j = self.rng.randrange(i, self.n)
+        value = self.swaps.get(j, j)
+        self.swaps[j] = self.swaps.pop(i, i)
+        self.drawn += 1
+        return value
+
+
+class ShuffleOrder:
+    # A no-repeat random order over track_ids. Tracks in `exclude` (the ones
+    # already played when shuffle was switched on) are skipped rather than
+    # copied out, so the track list is never duplicated. With `spread`, a
+    # candidate by one of the last `spread` artists is held back for a few
+    # draws when something else is available.
+
+    def __init__(self, track_ids, seed=None, exclude=(), artist_of=None, spread=0, repeat=True):
+        self.track_ids = track_ids
+        self.rng = random.Random(seed)
+        self.exclude = set(exclude)
+        self.removed = set()
+        self.artist_of = artist_of
+        self.spread = spread if artist_of else 0
+        self.repeat = repeat
+        self.permutation = LazyPermutation(len(track_ids), self.rng)
+        self.deferred = deque()
+        self.recent_artists = deque(maxlen=max(1, self.spread))
+        self.upcoming = None
+        self.last = None
+
+    def peek(self):
+        if self.upcoming is None:
+            self.upcoming = self._draw()
+        return self.upcoming
+
+    def advance(self):
+        track_id = self.peek()
+        self.upcoming = None
+        if track_id is not None:
+            self.last = track_id
+            if self.spread:
+                self.recent_artists.append(self.artist_of(track_id))
+        return track_id
+
+    def remove(self, track_id):
+        self.removed.add(track_id)
+        if self.upcoming == track_id:
+            self.upcoming = None
+        if track_id in self.deferred:
+            self.deferred.remove(track_id)
+
+    def mark_played(self, track_id):
+        # Tracks played out of order (picked by hand or queued) don't come
+        # up again in this round.
+        self.exclude.add(track_id)
+        if track_id in self.deferred:
+            self.deferred.remove(track_id)
+
+    def _next_candidate(self):
+        while True:
+            index = self.permutation.draw()
+            if index is None:
+                return None
+            track_id = self.track_ids[index]
+            if track_id not in self.exclude and track_id not in self.removed:
+                return track_id
+
+    def _draw(self):
+        track_id = self._pick()
+        if track_id is None and self.repeat and self.track_ids:
+            # Start a new round over everything, without letting the track
+            # that just played come straight back.
+            self.permutation = LazyPermutation(len(self.track_ids), self.rng)
+            self.exclude = set()
+            track_id = self._pick()
+            if track_id is not None and track_id == self.last:
+                second = self._pick()
+                if second is not None:
+                    self.deferred.appendleft(track_id)
+                    track_id = second
+        return track_id
+
+    def _pick(self):
+        held = []
+        choice = None
+        for _ in range(SPREAD_ATTEMPTS if self.spread else 1):
+            candidate = self.deferred.popleft() if self.deferred else self._next_candidate()
+            if candidate is None:
+                break
+            if not self.spread or self.artist_of(candidate) not in self.recent_artists:
+                choice = candidate
+                break
+            held.append(candidate)
+        if choice is None and held:
+            # Everything nearby is by a recent artist; take the first anyway.
+            choice = held.pop(0)
+        self.deferred.extend(held)
+        return choice
@@ -0,0 +1,324 @@
+import os
+import random
+import struct
+import threading
+from collections import deque
+
+import metrics
+from features import DIMS
+
+
+MAGIC = b"FEAT"
+VERSION = 1
+# magic, version, dims, rows in use; rows start at HEADER_SIZE.
+HEADER = struct.Struct("<4sHHQ")
+HEADER_SIZE = 64
+ID_SIZE = 36
+MIN_CAPACITY = 1024
+# The standardisation is refitted once the number of tracks has moved this
+# far from the count it was fitted on.
+REFIT_CHANGE = 0.25
+# Radio: how many of the last played tracks steer the next pick, how much
+# less each older one counts, and how many of the nearest tracks it picks
+# from, as long as they are within RADIO_MARGIN (cosine) of the nearest.
+RADIO_SEEDS = 5
+RADIO_DECAY = 0.6
+RADIO_POOL = 8
+RADIO_MARGIN = 0.1
+RADIO_HISTORY = 200
+
+
+class FeatureStore:
+    # Track embeddings as a memory-mapped float32 matrix, <prefix>.f32,
+    # one row per track, with the track ids in a parallel file of fixed
+    # 36-byte records, <prefix>.ids. Rows never move: a deleted track's row
+    # is blanked and reused by the next one added, so an update touches one
+    # row of each file. Both files grow by doubling.
+    #
+    # Embeddings can always be computed again, so a file from another
+    # version (or a torn one) is simply started over.
+
+    def __init__(self, prefix, dims=DIMS):
+        import numpy as np
+
+        self.np = np
+        self.dims = dims
+        self.vectors_path = f"{prefix}.f32"
+        self.ids_path = f"{prefix}.ids"
+        self.rows = 0
+        self.capacity = 0
+        self.header = self.vectors = self.ids = None
+        self._open()
+        self.row_of = {}
+        self.free = []
+        for row, track_id in enumerate(self.ids[:self.rows].tolist()):
+            if track_id:
+                self.row_of[track_id.decode()] = row
+            else:
+                self.free.append(row)
+        self.free.reverse()
+
+    def _open(self):
+        np = self.np
+        try:
+            with open(self.vectors_path, 'rb') as f:
+                magic, version, dims, rows = HEADER.unpack(f.read(HEADER.size))
+            size = os.path.getsize(self.vectors_path)
+            capacity = (size - HEADER_SIZE) // (4 * self.dims)
+            valid = (magic == MAGIC and version == VERSION and dims == self.dims and rows <= capacity
+                     and os.path.getsize(self.ids_path) >= capacity * ID_SIZE)
+        except (OSError, struct.error):
+            valid = False
+        if not valid:
+            capacity, rows = MIN_CAPACITY, 0
+            self._allocate(capacity, fresh=True)
+        self.capacity = capacity
+        self.header = np.memmap(self.vectors_path, dtype=np.uint8, mode="r+", shape=(HEADER_SIZE,))
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", offset=HEADER_SIZE,
+                                 shape=(capacity, self.dims))
+        self.ids = np.memmap(self.ids_path, dtype=f"S{ID_SIZE}", mode="r+", shape=(capacity,))
+        self.rows = rows
+
+    def _allocate(self, capacity, fresh=False):
+        mode = 'wb' if fresh else 'r+b'
+        with open(self.vectors_path, mode) as f:
+            if fresh:
+                f.write(HEADER.pack(MAGIC, VERSION, self.dims, 0).ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + capacity * self.dims * 4)
+        with open(self.ids_path, mode) as f:
+            f.truncate(capacity * ID_SIZE)
+
+    def _grow(self):
+        self.flush()
+        self.header = self.vectors = self.ids = None
+        capacity = self.capacity * 2
+        self._allocate(capacity)
+        rows = self.rows
+        self._open()
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, track_id):
+        return track_id in self.row_of
+
+    def put(self, track_id, vector):
+        # The row the track's embedding now lives in.
+        row = self.row_of.get(track_id)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                if self.rows == self.capacity:
+                    self._grow()
+                row = self.rows
+        # Vector before id, and the row count last: a crash part way leaves
+        # a row that reads as empty.
+        self.vectors[row] = vector
+        self.ids[row] = track_id.encode()
+        self.row_of[track_id] = row
+        if row >= self.rows:
+            self.rows = row + 1
+            self.header[:HEADER.size] = self.np.frombuffer(
+                HEADER.pack(MAGIC, VERSION, self.dims, self.rows), dtype=self.np.uint8)
+        return row
+
+    def delete(self, track_id):
+        row = self.row_of.pop(track_id, None)
+        if row is not None:
+            self.ids[row] = b""
+            self.vectors[row] = 0
+            self.free.append(row)
+        return row
+
+    def flush(self):
+        for array in (self.header, self.vectors, self.ids):
+            if array is not None:
+                array.flush()
+
+    def close(self):
+        self.flush()
+        self.header = self.vectors = self.ids = None
+
+
+class SimilarityIndex:
+    # Cosine nearest neighbours over a FeatureStore. Raw embeddings mix
+    # scales (MFCCs in tens, flatness below one), so rows are standardised
+    # with the library's own mean and spread and then scaled to unit length
+    # into an in-memory copy; a query is then one matrix-vector product
+    # over every track plus an argpartition, a few milliseconds for 100k
+    # tracks. Adding and deleting update single rows of both the store and
+    # the copy.
+
+    def __init__(self, store):
+        np = store.np
+        self.np = np
+        self.store = store
+        self.lock = threading.Lock()
+        self.unit = np.zeros((store.capacity, store.dims), dtype=np.float32)
+        self.alive = np.zeros(store.capacity, dtype=bool)
+        for row in store.row_of.values():
+            self.alive[row] = True
+        self.mean = np.zeros(store.dims, dtype=np.float32)
+        self.scale = np.ones(store.dims, dtype=np.float32)
+        self.fitted = 0
+        self._refit()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, track_id):
+        return track_id in self.store
+
+    def _refit(self):
+        np = self.np
+        rows = self.store.rows
+        alive = self.alive[:rows]
+        raw = np.asarray(self.store.vectors[:rows])
+        if alive.any():
+            self.mean = raw[alive].mean(axis=0)
+            self.scale = np.maximum(raw[alive].std(axis=0), 1e-6)
+        self.unit[:rows] = self._normalize(raw)
+        self.unit[:rows][~alive] = 0
+        self.fitted = int(alive.sum())
+
+    def _normalize(self, vectors):
+        np = self.np
+        z = (vectors - self.mean) / self.scale
+        norms = np.linalg.norm(z, axis=-1, keepdims=True)
+        return (z / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def add(self, track_id, vector):
+        np = self.np
+        with self.lock:
+            row = self.store.put(track_id, np.asarray(vector, dtype=np.float32))
+            if row >= len(self.unit):
+                grown = max(self.store.capacity, row + 1)
+                self.unit = np.concatenate([self.unit, np.zeros((grown - len(self.unit), self.store.dims),
+                                                                dtype=np.float32)])
+                self.alive = np.concatenate([self.alive, np.zeros(grown - len(self.alive), dtype=bool)])
+            self.alive[row] = True
+            if abs(len(self.store) - self.fitted) > REFIT_CHANGE * max(self.fitted, 100):
+                self._refit()
+            else:
+                self.unit[row] = self._normalize(self.store.vectors[row])
+
+    def add_many(self, items):
+        for track_id, vector in items:
+            self.add(track_id, vector)
+        self.store.flush()
+
+    def remove(self, track_id):
+        with self.lock:
+            row = self.store.delete(track_id)
+            if row is not None:
+                self.alive[row] = False
+                self.unit[row] = 0
+
+    def nearest(self, track_ids, count=10, weights=None, exclude=()):
+        # [(track id, similarity)] of the `count` tracks closest to the
+        # weighted mix of track_ids, best first, leaving out the seeds and
+        # `exclude`. With unit rows, the weighted sum of cosines to several
+        # seeds is the cosine to the weighted sum of the seeds, so any
+        # number of seeds still costs one pass over the matrix.
+        np = self.np
+        with self.lock:
+            rows = [self.store.row_of[t] for t in track_ids if t in self.store.row_of]
+            if not rows:
+                return []
+            if weights is None:
+                weights = np.ones(len(rows), dtype=np.float32)
+            else:
+                weights = np.asarray([w for t, w in zip(track_ids, weights) if t in self.store.row_of],
+                                     dtype=np.float32)
+            query = weights @ self.unit[rows]
+            n = self.store.rows
+            scores = self.unit[:n] @ query / max(float(weights.sum()), 1e-12)
+            scores[~self.alive[:n]] = -np.inf
+            scores[rows] = -np.inf
+            for track_id in exclude:
+                row = self.store.row_of.get(track_id)
+                if row is not None:
+                    scores[row] = -np.inf
+            count = min(count, n)
+            if count <= 0:
+                return []
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top])]
+            ids = self.store.ids
+            return [(ids[row].decode(), float(scores[row])) for row in top if scores[row] > -np.inf]
+
+    def close(self):
+        self.store.close()
+
+
+class Radio:
+    # Endless upcoming tracks that sound like what has been playing, with
+    # ShuffleOrder's interface so the core can put either after the
+    # hand-queued tracks. The last RADIO_SEEDS played tracks steer it, the
+    # newest most; the pick is random among the RADIO_POOL nearest (those
+    # about as near as the nearest), so a station doesn't settle into a
+    # loop, and nothing played in the last RADIO_HISTORY tracks comes back.
+    # With `spread`, candidates by one of the last `spread` artists are
+    # passed over while others are close.
+
+    def __init__(self, index, seeds=(), seed=None, artist_of=None, spread=0, exists=None):
+        self.index = index
+        self.rng = random.Random(seed)
+        self.artist_of = artist_of
+        self.spread = spread if artist_of else 0
+        self.exists = exists
+        self.seeds = deque(maxlen=RADIO_SEEDS)
+        self.played = deque(maxlen=RADIO_HISTORY)
+        self.removed = set()
+        self.recent_artists = deque(maxlen=max(1, self.spread))
+        for track_id in seeds:
+            self.mark_played(track_id)
+        self.upcoming = None
+
+    def peek(self):
+        if self.upcoming is None:
+            self.upcoming = self._pick()
+        return self.upcoming
+
+    def advance(self):
+        track_id = self.peek()
+        self.upcoming = None
+        return track_id
+
+    def remove(self, track_id):
+        self.removed.add(track_id)
+        if self.upcoming == track_id:
+            self.upcoming = None
+
+    def mark_played(self, track_id):
+        # Whatever plays, picked by the radio or not, steers what comes
+        # next; only tracks with an embedding can.
+        self.played.append(track_id)
+        if track_id in self.index:
+            if track_id in self.seeds:
+                self.seeds.remove(track_id)
+            self.seeds.append(track_id)
+        if self.spread:
+            self.recent_artists.append(self.artist_of(track_id))
+        self.upcoming = None
+
+    def _pick(self):
+        seeds = list(self.seeds)
+        if not seeds:
+            return None
+        weights = [RADIO_DECAY ** (len(seeds) - 1 - i) for i in range(len(seeds))]
+        exclude = set(self.played) | self.removed
+        with metrics.span("radio_pick"):
+            nearest = self.index.nearest(seeds, RADIO_POOL * 2, weights=weights, exclude=exclude)
+        nearest = [(track_id, score) for track_id, score in nearest
+                   if self.exists is None or self.exists(track_id)]
+        if not nearest:
+            return None
+        best = nearest[0][1]
+        candidates = [track_id for track_id, score in nearest if score >= best - RADIO_MARGIN]
+        if self.spread:
+            varied = [t for t in candidates if self.artist_of(t) not in self.recent_artists]
+            candidates = varied or candidates
+        return self.rng.choice(candidates[:RADIO_POOL])
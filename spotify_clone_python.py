@@ -1,67 +1,55 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import threading
-import os
-import json
-import random
-from pathlib import Path
-from pytubefix import YouTube, Search
-import pygame
-from mutagen.mp3 import MP3
+from tkinter import ttk, messagebox, simpledialog
+
+import metrics
+from core import METRICS_PATH, MusicCore
+from download_manager import QUEUED, DOWNLOADING, PROCESSING, RETRYING, DONE, FAILED
+from virtual_list import VirtualListbox
+from waveform_bar import WaveformBar
 
 
 class SpotifyStyleApp:
-    def __init__(self, root):
+    def __init__(self, root, core=None):
         self.root = root
         self.root.title("Music Streaming")
         self.root.geometry("1200x700")
         self.root.configure(bg="#000000")
         
-        pygame.mixer.init()
-        
-        self.music_dir = Path.home() / "MusicStreamingApp"
-        self.music_dir.mkdir(exist_ok=True)
-        self.library_file = self.music_dir / "library.json"
+        self.core = core or MusicCore(scheduler=self.root)
+        self.core.on("library_batch", lambda titles: self._schedule_library_refresh())
+        self.core.on("library_loaded", self._schedule_library_refresh)
+        self.core.on("library_changed", lambda title: self._schedule_library_refresh())
+        self.core.on("playlists_changed", lambda: self.root.after(0, self._show_playlists_change))
+        self.core.on("queue_changed", lambda: self.root.after(0, self._show_queue_change))
+        self.core.on("download_update", self.on_download_update)
+        self.core.on("track_changed", self._show_now_playing)
+        self.core.on("position", self.on_playback_position)
+        self.core.on("playback_state", self._show_playback_state)
+        self.core.on("waveform_ready", lambda title: self.root.after(0, self._show_waveform, title))
+        self.core.on("error", lambda message: messagebox.showerror("Error", message))
         
-        self.current_track = None
-        self.current_track_index = -1
-        self.is_playing = False
-        self.is_paused = False
-        self.current_file = None
-        self.duration = 0
-        self.is_seeking = False
         self.search_mode = "library"
+        self.library_view = []
+        self.library_query = None
+        self.current_playlist_name = None
+        self.library_refresh_pending = False
         self.search_results = []
-        self.library = self.load_library()
-        self.shuffle_mode = False
-        self.current_playlist = []
-        self.last_seek_pos = 0
+        self.search_query = None
+        self.search_page = 0
+        self.search_loading = False
+        self.search_exhausted = False
         
         self.setup_styles()
         self.setup_ui()
-        self.update_progress()
         self.show_all_library_songs()
-
-    def load_library(self):
-        if self.library_file.exists():
-            with open(self.library_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-
-    def save_library(self):
-        with open(self.library_file, 'w', encoding='utf-8') as f:
-            json.dump(self.library, f, indent=2, ensure_ascii=False)
+        self.core.start()
+        # Stall detection wakes the loop four times a second, so it only
+        # runs while metrics are being exported.
+        self.loop_monitor = metrics.LoopMonitor(self.root, name="ui_loop").start() if METRICS_PATH else None
 
     def setup_styles(self):
         style = ttk.Style()
         style.theme_use('clam')
-        
-        style.configure("Spotify.Horizontal.TScale",
-                       background="#000000",
-                       troughcolor="#404040",
-                       borderwidth=0,
-                       lightcolor="#1DB954",
-                       darkcolor="#1DB954")
 
     def setup_ui(self):
         main_container = tk.Frame(self.root, bg="#000000")
@@ -90,6 +78,7 @@ class SpotifyStyleApp:
         nav_items = [
             ("🏠  Home", lambda: self.switch_view("library")),
             ("🔍  Search", lambda: self.switch_view("search")),
+            ("📃  Queue", lambda: self.switch_view("queue")),
         ]
         
         for text, command in nav_items:
@@ -110,10 +99,31 @@ class SpotifyStyleApp:
         library_label.pack(anchor="w", padx=20, pady=(0, 10))
         
         self.library_count = tk.Label(sidebar, 
-                                     text=f"{len(self.library)} songs",
+                                     text=f"{len(self.core.library)} songs",
                                      font=("Arial", 12),
                                      bg="#000000", fg="#B3B3B3")
         self.library_count.pack(anchor="w", padx=20)
+        
+        playlists_header = tk.Frame(sidebar, bg="#000000")
+        playlists_header.pack(fill="x", padx=20, pady=(20, 5))
+        
+        tk.Label(playlists_header, text="Playlists", font=("Arial", 11, "bold"),
+                 bg="#000000", fg="#B3B3B3").pack(side="left")
+        
+        tk.Button(playlists_header, text="+", font=("Arial", 12, "bold"),
+                  bg="#000000", fg="#B3B3B3", bd=0, cursor="hand2",
+                  activebackground="#000000", activeforeground="#FFFFFF",
+                  command=self.new_playlist).pack(side="right")
+        
+        self.playlist_listbox = tk.Listbox(sidebar, font=("Arial", 12),
+                                           bg="#000000", fg="#B3B3B3",
+                                           selectbackground="#282828",
+                                           selectforeground="#FFFFFF",
+                                           bd=0, highlightthickness=0,
+                                           activestyle="none", exportselection=False)
+        self.playlist_listbox.pack(fill="both", expand=True, padx=20, pady=(0, 10))
+        self.playlist_listbox.bind("<<ListboxSelect>>", lambda e: self.open_selected_playlist())
+        self.playlist_listbox.bind("<Button-3>", self.show_playlist_menu)
 
     def setup_main_content(self, parent):
         main_area = tk.Frame(parent, bg="#121212")
@@ -136,6 +146,7 @@ class SpotifyStyleApp:
                                      insertbackground="#FFFFFF")
         self.search_entry.pack(side="left", fill="both", expand=True, pady=10)
         self.search_entry.bind("<Return>", lambda e: self.handle_search())
+        self.search_entry.bind("<KeyRelease>", self.on_search_typed)
         self.search_entry.insert(0, "What do you want to listen to?")
         self.search_entry.bind("<FocusIn>", self.on_entry_focus_in)
         self.search_entry.bind("<FocusOut>", self.on_entry_focus_out)
@@ -178,17 +189,19 @@ class SpotifyStyleApp:
                                troughcolor="#121212", width=12)
         scrollbar.pack(side="right", fill="y")
         
-        self.results_listbox = tk.Listbox(list_container, font=("Arial", 12),
-                                         bg="#121212", fg="#FFFFFF",
-                                         selectbackground="#282828",
-                                         selectforeground="#1DB954",
-                                         yscrollcommand=scrollbar.set,
-                                         bd=0, highlightthickness=0,
-                                         activestyle="none")
+        self.results_listbox = VirtualListbox(list_container, font=("Arial", 12),
+                                             bg="#121212", fg="#FFFFFF",
+                                             selectbackground="#282828",
+                                             selectforeground="#1DB954",
+                                             yscrollcommand=scrollbar.set,
+                                             bd=0, highlightthickness=0,
+                                             activestyle="none",
+                                             on_reach_end=self.load_more_results)
         self.results_listbox.pack(side="left", fill="both", expand=True)
         self.results_listbox.bind("<Double-Button-1>", lambda e: self.handle_selection())
         self.results_listbox.bind("<Delete>", lambda e: self.delete_selected())
         self.results_listbox.bind("<space>", lambda e: self.toggle_play_pause())
+        self.results_listbox.bind("<Button-3>", self.show_track_menu)
         
         scrollbar.config(command=self.results_listbox.yview)
 
@@ -222,6 +235,12 @@ class SpotifyStyleApp:
                                      activebackground="#181818")
         self.shuffle_btn.pack(side="left", padx=8)
         
+        self.radio_btn = tk.Button(controls, text="📻", font=("Arial", 16),
+                                   bg="#181818", fg="#B3B3B3", bd=0,
+                                   cursor="hand2", command=self.toggle_radio,
+                                   activebackground="#181818")
+        self.radio_btn.pack(side="left", padx=8)
+        
         prev_btn = tk.Button(controls, text="⏮", font=("Arial", 20),
                            bg="#181818", fg="#FFFFFF", bd=0,
                            cursor="hand2", command=self.play_previous,
@@ -248,14 +267,10 @@ class SpotifyStyleApp:
                                   font=("Arial", 9), bg="#181818", fg="#B3B3B3")
         self.time_label.pack(side="left", padx=(0, 10))
         
-        self.progress_bar = ttk.Scale(progress_container, from_=0, to=100,
-                                     orient="horizontal", 
-                                     style="Spotify.Horizontal.TScale",
-                                     command=self.on_progress_change)
+        self.progress_bar = WaveformBar(progress_container, bg="#181818", height=28,
+                                        on_scrub=self.on_progress_change,
+                                        on_seek=self.on_seek)
         self.progress_bar.pack(side="left", fill="x", expand=True)
-        self.progress_bar.bind("<ButtonPress-1>", 
-                              lambda e: setattr(self, 'is_seeking', True))
-        self.progress_bar.bind("<ButtonRelease-1>", self.on_seek)
         
         self.duration_label = tk.Label(progress_container, text="0:00",
                                       font=("Arial", 9), bg="#181818", fg="#B3B3B3")
@@ -271,6 +286,17 @@ class SpotifyStyleApp:
             self.search_entry.insert(0, "What do you want to listen to?")
             self.search_entry.config(fg="#6A6A6A")
 
+    def on_search_typed(self, event):
+        if self.search_mode != "library" or event.keysym == "Return":
+            return
+        query = self.search_entry.get().strip()
+        if query == "What do you want to listen to?":
+            return
+        if query:
+            self.search_library(query)
+        else:
+            self.show_all_library_songs()
+
     def switch_view(self, view):
         if view == "library":
             self.search_mode = "library"
@@ -282,8 +308,15 @@ class SpotifyStyleApp:
         elif view == "search":
             self.search_mode = "search"
             self.content_title.config(text="Search")
-            self.results_listbox.delete(0, tk.END)
+            self.search_query = None
+            self.results_listbox.set_items([])
             self.search_entry.focus()
+        elif view == "queue":
+            self.search_mode = "queue"
+            self.content_title.config(text="Queue")
+            self.show_queue()
+        self.current_playlist_name = None
+        self.playlist_listbox.selection_clear(0, tk.END)
 
     def search_mode_set(self, mode):
         self.search_mode = mode
@@ -302,52 +335,99 @@ class SpotifyStyleApp:
             self.search_library(query)
 
     def search_online(self, query):
-        self.results_listbox.delete(0, tk.END)
+        self.search_results = []
+        self.search_query = query
+        self.search_page = 0
+        self.search_loading = True
+        self.search_exhausted = False
+        self.results_listbox.set_items(self.search_results, self.format_search_row)
         self.content_title.config(text=f"Searching for '{query}'...")
-        threading.Thread(target=self._search_thread, args=(query,), daemon=True).start()
+        self._fetch_results(query, 0)
 
-    def _search_thread(self, query):
-        try:
-            s = Search(query + " official audio")
-            results = s.results[:15]
-            self.search_results = results
-            self.root.after(0, self._update_results, results, query)
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Search failed: {str(e)}"))
+    def load_more_results(self):
+        # Called by the list once its last row is in view; the next page
+        # has usually been prefetched already and comes from the cache.
+        if self.search_mode != "search" or self.search_query is None:
+            return
+        if self.search_loading or self.search_exhausted:
+            return
+        self.search_loading = True
+        self._fetch_results(self.search_query, self.search_page + 1)
+
+    def _fetch_results(self, query, page):
+        self.core.search_online(
+            query, page,
+            on_results=lambda results, q, p: self.root.after(0, self._update_results, results, q, p),
+            on_error=lambda e: self.root.after(0, self._search_failed, query, e))
 
-    def _update_results(self, results, query):
-        self.results_listbox.delete(0, tk.END)
-        for video in results:
-            self.results_listbox.insert(tk.END, f"♫  {video.title}")
-        self.content_title.config(text=f"Results for '{query}'")
+    def _search_failed(self, query, error):
+        if query != self.search_query:
+            return
+        self.search_loading = False
+        messagebox.showerror("Error", f"Search failed: {str(error)}")
+
+    def _update_results(self, results, query, page):
+        if query != self.search_query or self.search_mode != "search":
+            return
+        self.search_loading = False
+        self.search_page = page
+        if len(results) < self.core.online_search.page_size:
+            self.search_exhausted = True
+        if page == 0:
+            self.content_title.config(text=f"Results for '{query}'")
+        self.results_listbox.extend(results)
 
     def search_library(self, query):
-        self.results_listbox.delete(0, tk.END)
-        query_lower = query.lower()
-        matches = [title for title in self.library.keys() if query_lower in title.lower()]
-        
-        for title in matches:
-            self.results_listbox.insert(tk.END, f"♫  {title}")
-        
-        self.current_playlist = matches
+        self.library_query = query
+        matches = self.core.search_library(query)
+        self.results_listbox.set_items(matches, self.format_track_row)
+        self.library_view = matches
         self.content_title.config(text=f"Found {len(matches)} songs")
 
-    def show_all_library_songs(self):
-        self.results_listbox.delete(0, tk.END)
-        all_songs = list(self.library.keys())
-        
-        for title in all_songs:
-            self.results_listbox.insert(tk.END, f"♫  {title}")
-        
-        self.current_playlist = all_songs
+    def show_all_library_songs(self, keep_position=False):
+        self.library_query = None
+        all_songs = self.core.titles()
+        self.results_listbox.set_items(all_songs, self.format_track_row, keep_position)
+        self.library_view = all_songs
         self.library_count.config(text=f"{len(all_songs)} songs")
 
+    def _schedule_library_refresh(self):
+        # Called from loader and download threads; batches that land close
+        # together are folded into one redraw.
+        if not self.library_refresh_pending:
+            self.library_refresh_pending = True
+            self.root.after(50 if self.library_view else 0, self._show_library_change)
+
+    def _show_library_change(self):
+        self.library_refresh_pending = False
+        with metrics.span("library_refresh"):
+            self.library_count.config(text=f"{len(self.core.library)} songs")
+            if self.search_mode == "playlist":
+                self.show_playlist(self.current_playlist_name, keep_position=True)
+            if self.search_mode != "library":
+                return
+            if self.library_query:
+                self.search_library(self.library_query)
+            else:
+                self.show_all_library_songs(keep_position=True)
+
     def handle_selection(self):
         if self.search_mode == "search":
-            self.download_selected()
+            self.stream_selected()
+        elif self.search_mode == "queue":
+            self.play_from_queue()
         else:
             self.play_from_library()
 
+    def stream_selected(self):
+        selection = self.results_listbox.curselection()
+        if not selection:
+            return
+        
+        video = self.search_results[selection[0]]
+        self.core.stream(video.video_id, video.title, video.watch_url, video.length or 0)
+        self.results_listbox.refresh()
+
     def download_selected(self):
         selection = self.results_listbox.curselection()
         if not selection:
@@ -355,229 +435,264 @@ class SpotifyStyleApp:
         
         index = selection[0]
         video = self.search_results[index]
-        self.content_title.config(text="Downloading...")
-        threading.Thread(target=self._download_thread, args=(video,), daemon=True).start()
+        self.core.download(video.video_id, video.title, video.watch_url)
+        self.results_listbox.refresh()
 
-    def _download_thread(self, video):
-        try:
-            yt = YouTube(video.watch_url)
-            audio_stream = yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc().first()
-            
-            if not audio_stream:
-                audio_stream = yt.streams.filter(only_audio=True).first()
-            
-            if not audio_stream:
-                self.root.after(0, lambda: messagebox.showerror("Error", "No audio available"))
-                return
-            
-            safe_title = "".join(c for c in video.title if c.isalnum() or c in (' ', '-', '_')).strip()
-            temp_filename = f"{safe_title}_temp"
-            final_filename = f"{safe_title}.mp3"
-            final_filepath = self.music_dir / final_filename
-            
-            downloaded_file = audio_stream.download(output_path=str(self.music_dir), filename=temp_filename)
-            
-            try:
-                from pydub import AudioSegment
-                audio = AudioSegment.from_file(downloaded_file)
-                audio.export(str(final_filepath), format="mp3", bitrate="192k")
-                os.remove(downloaded_file)
-            except ImportError:
-                if os.path.exists(downloaded_file):
-                    os.rename(downloaded_file, str(final_filepath))
-            
-            self.library[video.title] = {
-                "filename": final_filename,
-                "path": str(final_filepath),
-                "duration": yt.length
-            }
-            self.save_library()
-            
-            self.root.after(0, lambda: self.content_title.config(text="Download complete!"))
-            self.root.after(0, self.show_all_library_songs)
-            
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Download failed: {str(e)}"))
+    def on_download_update(self, item):
+        self.root.after(0, self._show_download_update, item)
+
+    def _show_download_update(self, item):
+        if self.search_mode == "search":
+            self.results_listbox.refresh()
+        
+        active = len(self.core.downloads.pending())
+        if item.state == DONE and item.duplicate:
+            self.content_title.config(text="Already in your library")
+        elif item.state == DONE:
+            self.content_title.config(text="Download complete!")
+        elif item.state == FAILED:
+            messagebox.showerror("Error", f"Download failed: {item.error}")
+        elif active:
+            self.content_title.config(text=f"Downloading {active} song{'s' if active > 1 else ''}...")
+
+    def format_search_row(self, video):
+        item = self.core.downloads.get(video.video_id)
+        if item is None:
+            if self.core.has_video(video.video_id):
+                return f"✓  {video.title}"
+            return f"♫  {video.title}"
+        if item.state == DOWNLOADING:
+            status = f"⬇ {int(item.progress * 100)}%"
+        elif item.state == PROCESSING:
+            status = "converting..."
+        elif item.state == QUEUED:
+            status = "queued"
+        elif item.state == RETRYING:
+            status = "retrying..."
+        elif item.state == DONE:
+            status = "✓"
+        elif item.state == FAILED:
+            status = "failed"
+        else:
+            status = "cancelled"
+        return f"♫  {video.title}    {status}"
 
     def play_from_library(self):
         selection = self.results_listbox.curselection()
         if not selection:
             return
         
-        index = selection[0]
-        self.current_track_index = index
-        title = self.current_playlist[index]
-        
-        if title not in self.library:
-            return
-        
-        filepath = self.library[title]["path"]
-        if os.path.exists(filepath):
-            self._play_file(filepath, title)
+        self.core.play_index(selection[0], self.library_view)
 
-    def _play_file(self, filepath, title):
-        try:
-            if self.is_playing:
-                pygame.mixer.music.stop()
-            
-            self.current_file = filepath
-            self.current_track = title
-            
-            try:
-                audio = MP3(filepath)
-                self.duration = audio.info.length
-            except:
-                self.duration = self.library.get(title, {}).get("duration", 0)
-            
-            pygame.mixer.music.load(filepath)
-            pygame.mixer.music.play()
-            
-            self.is_playing = True
-            self.is_paused = False
-            self.last_seek_pos = 0
-            
-            self.now_playing.config(text=title)
-            self.play_pause_btn.config(text="⏸")
-            self.duration_label.config(text=self.format_time(self.duration))
-            self.progress_bar.config(to=self.duration if self.duration > 0 else 100)
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Playback failed: {str(e)}")
+    def show_queue(self, keep_position=False):
+        self.results_listbox.set_items(self.core.queue_entries(), self.format_queue_row, keep_position)
 
-    def play_next(self):
-        if not self.current_playlist:
-            return
-        
-        if self.shuffle_mode:
-            self.play_random_song()
-        else:
-            next_index = (self.current_track_index + 1) % len(self.current_playlist)
-            self.current_track_index = next_index
-            title = self.current_playlist[next_index]
-            
-            if title in self.library:
-                filepath = self.library[title]["path"]
-                if os.path.exists(filepath):
-                    self._play_file(filepath, title)
+    def _show_queue_change(self):
+        if self.search_mode == "queue":
+            self.show_queue(keep_position=True)
 
-    def play_previous(self):
-        if not self.current_playlist:
+    def play_from_queue(self):
+        selection = self.results_listbox.curselection()
+        if not selection:
             return
         
-        if self.shuffle_mode:
-            self.play_random_song()
-        else:
-            prev_index = (self.current_track_index - 1) % len(self.current_playlist)
-            self.current_track_index = prev_index
-            title = self.current_playlist[prev_index]
-            
-            if title in self.library:
-                filepath = self.library[title]["path"]
-                if os.path.exists(filepath):
-                    self._play_file(filepath, title)
+        self.core.play_queue_entry(self.results_listbox.items[selection[0]][0])
 
-    def play_random_song(self):
-        if not self.library or not self.current_playlist:
+    def selected_titles(self):
+        selection = self.results_listbox.curselection()
+        if not selection or self.search_mode == "search":
+            return []
+        item = self.results_listbox.items[selection[0]]
+        return [item[1] if self.search_mode == "queue" else item]
+
+    def show_track_menu(self, event):
+        index = self.results_listbox.nearest(event.y)
+        self.results_listbox.select(index)
+        if self.search_mode == "search":
+            if index < len(self.search_results):
+                menu = tk.Menu(self.root, tearoff=0)
+                menu.add_command(label="Play", command=self.stream_selected)
+                menu.add_command(label="Download", command=self.download_selected)
+                menu.tk_popup(event.x_root, event.y_root)
+            return
+        titles = self.selected_titles()
+        if not titles:
             return
         
-        random_index = random.randint(0, len(self.current_playlist) - 1)
-        self.current_track_index = random_index
-        title = self.current_playlist[random_index]
-        filepath = self.library[title]["path"]
-        
-        if os.path.exists(filepath):
-            self._play_file(filepath, title)
+        menu = tk.Menu(self.root, tearoff=0)
+        menu.add_command(label="Play next", command=lambda: [self.core.enqueue_next(t) for t in titles])
+        menu.add_command(label="Add to queue", command=lambda: [self.core.enqueue(t) for t in titles])
+        menu.add_command(label="Start radio", command=lambda: self.start_radio(titles[0]))
+        
+        playlists_menu = tk.Menu(menu, tearoff=0)
+        for name in self.core.playlists:
+            playlists_menu.add_command(label=name,
+                                       command=lambda n=name: self.core.add_to_playlist(n, titles))
+        playlists_menu.add_separator()
+        playlists_menu.add_command(label="New playlist...", command=lambda: self.new_playlist(titles))
+        menu.add_cascade(label="Add to playlist", menu=playlists_menu)
+        
+        if self.search_mode == "playlist":
+            menu.add_command(label="Remove from playlist", command=self.delete_selected)
+        elif self.search_mode == "queue":
+            entry_id = self.results_listbox.items[index][0]
+            menu.add_command(label="Move to top", command=lambda: self.core.move_in_queue(entry_id))
+            menu.add_command(label="Remove from queue", command=self.delete_selected)
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def new_playlist(self, titles=()):
+        name = simpledialog.askstring("New Playlist", "Playlist name:", parent=self.root)
+        if not name:
+            return
+        try:
+            self.core.create_playlist(name, titles)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+
+    def open_selected_playlist(self):
+        selection = self.playlist_listbox.curselection()
+        if selection:
+            self.show_playlist(self.playlist_listbox.get(selection[0]))
+
+    def show_playlist(self, name, keep_position=False):
+        self.search_mode = "playlist"
+        self.current_playlist_name = name
+        self.library_view = self.core.playlist_titles(name)
+        self.results_listbox.set_items(self.library_view, self.format_track_row, keep_position)
+        self.content_title.config(text=f"{name} ({len(self.library_view)})")
+
+    def show_playlist_menu(self, event):
+        index = self.playlist_listbox.nearest(event.y)
+        if index < 0 or index >= self.playlist_listbox.size():
+            return
+        name = self.playlist_listbox.get(index)
+        menu = tk.Menu(self.root, tearoff=0)
+        menu.add_command(label="Play", command=lambda: self.core.play_playlist(name))
+        menu.add_command(label="Rename...", command=lambda: self.rename_playlist(name))
+        menu.add_command(label="Delete", command=lambda: self.delete_playlist(name))
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def rename_playlist(self, name):
+        new = simpledialog.askstring("Rename Playlist", "New name:", initialvalue=name, parent=self.root)
+        if not new or new == name:
+            return
+        try:
+            self.core.rename_playlist(name, new)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if self.current_playlist_name == name:
+            self.current_playlist_name = new
+
+    def delete_playlist(self, name):
+        if messagebox.askyesno("Delete Playlist", f"Delete playlist '{name}'?"):
+            self.core.delete_playlist(name)
+            if self.current_playlist_name == name:
+                self.switch_view("library")
+
+    def _show_playlists_change(self):
+        names = list(self.core.playlists)
+        self.playlist_listbox.delete(0, tk.END)
+        self.playlist_listbox.insert(tk.END, *names)
+        if self.current_playlist_name in names:
+            self.playlist_listbox.selection_set(names.index(self.current_playlist_name))
+            if self.search_mode == "playlist":
+                self.show_playlist(self.current_playlist_name, keep_position=True)
+
+    def _show_now_playing(self, title):
+        duration = self.core.duration
+        self.now_playing.config(text=title)
+        self.play_pause_btn.config(text="⏸")
+        self.duration_label.config(text=self.format_time(duration))
+        self.progress_bar.set_track(duration, self.core.peaks_for(title))
+        self.time_label.config(text=self.format_time(0))
+
+    def _show_waveform(self, title):
+        if title == self.core.current_track:
+            self.progress_bar.set_peaks(self.core.peaks_for(title))
+
+    def _show_playback_state(self, state):
+        if state == "buffering":
+            self.now_playing.config(text="Buffering...")
+            return
+        self.play_pause_btn.config(text="⏸" if state == "playing" else "▶")
+        self.now_playing.config(text=self.core.current_track or "No track playing")
+
+    def play_next(self):
+        self.core.play_next()
+
+    def play_previous(self):
+        self.core.play_previous()
 
     def toggle_shuffle(self):
-        self.shuffle_mode = not self.shuffle_mode
-        if self.shuffle_mode:
+        if self.core.toggle_shuffle():
             self.shuffle_btn.config(fg="#1DB954")
         else:
             self.shuffle_btn.config(fg="#B3B3B3")
 
+    def toggle_radio(self):
+        self.core.toggle_radio()
+        self._show_radio()
+
+    def start_radio(self, title):
+        self.core.start_radio(title)
+        self._show_radio()
+
+    def _show_radio(self):
+        self.radio_btn.config(fg="#1DB954" if self.core.radio_mode else "#B3B3B3")
+
     def delete_selected(self):
         selection = self.results_listbox.curselection()
         if not selection:
             return
         
         if self.search_mode == "search":
-            messagebox.showwarning("Wrong Mode", "Switch to Library view to delete songs.")
+            video = self.search_results[selection[0]]
+            if not self.core.cancel_download(video.video_id):
+                messagebox.showwarning("Wrong Mode", "Switch to Library view to delete songs.")
             return
         
         index = selection[0]
-        if not self.current_playlist or index >= len(self.current_playlist):
+        if self.search_mode == "queue":
+            self.core.remove_from_queue(self.results_listbox.items[index][0])
+            return
+        if self.search_mode == "playlist":
+            self.core.remove_from_playlist(self.current_playlist_name, [index])
+            return
+        if index >= len(self.library_view):
             return
         
-        title = self.current_playlist[index]
+        title = self.library_view[index]
         
         confirm = messagebox.askyesno("Delete Song", 
                                      f"Delete '{title}' from library?")
         if not confirm:
             return
         
-        if self.current_track == title and self.is_playing:
-            pygame.mixer.music.stop()
-            self.is_playing = False
-            self.now_playing.config(text="No track playing")
-        
-        if title in self.library:
-            filepath = self.library[title]["path"]
-            try:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-            except Exception as e:
-                messagebox.showerror("Error", f"Could not delete: {str(e)}")
-                return
-            
-            del self.library[title]
-            self.save_library()
-            self.show_all_library_songs()
+        try:
+            self.core.delete_track(title)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not delete: {str(e)}")
 
     def toggle_play_pause(self):
-        if not self.is_playing:
-            return
-            
-        if self.is_paused:
-            pygame.mixer.music.unpause()
-            self.is_paused = False
-            self.play_pause_btn.config(text="⏸")
-        else:
-            pygame.mixer.music.pause()
-            self.is_paused = True
-            self.play_pause_btn.config(text="▶")
-
-    def update_progress(self):
-        if self.is_playing and not self.is_paused and not self.is_seeking:
-            if pygame.mixer.music.get_busy():
-                pos = pygame.mixer.music.get_pos() / 1000.0 + self.last_seek_pos
-                if pos <= self.duration:
-                    self.progress_bar.set(pos)
-                    self.time_label.config(text=self.format_time(pos))
-            else:
-                if self.is_playing and not self.is_paused:
-                    if self.shuffle_mode:
-                        self.play_random_song()
-                    else:
-                        self.play_next()
-        
-        self.root.after(100, self.update_progress)
+        self.core.toggle_play_pause()
+
+    def on_playback_position(self, pos):
+        if not self.progress_bar.dragging:
+            self.progress_bar.set(pos)
+            self.time_label.config(text=self.format_time(pos))
 
     def on_progress_change(self, value):
-        if self.is_seeking:
-            self.time_label.config(text=self.format_time(float(value)))
-
-    def on_seek(self, event):
-        if self.is_playing and self.duration > 0:
-            pos = float(self.progress_bar.get())
-            pygame.mixer.music.stop()
-            pygame.mixer.music.load(self.current_file)
-            pygame.mixer.music.play(start=pos)
-            self.last_seek_pos = pos
-            
-            if self.is_paused:
-                pygame.mixer.music.pause()
-        
-        self.is_seeking = False
+        self.time_label.config(text=self.format_time(value))
+
+    def on_seek(self, value):
+        self.core.seek(value)
+
+    def format_track_row(self, title):
+        return f"♫  {title}"
+
+    def format_queue_row(self, entry):
+        return f"♫  {entry[1]}"
 
     def format_time(self, seconds):
         minutes = int(seconds // 60)
@@ -585,8 +700,9 @@ class SpotifyStyleApp:
         return f"{minutes}:{secs:02d}"
 
     def on_closing(self):
-        pygame.mixer.music.stop()
-        pygame.mixer.quit()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        self.core.close()
         self.root.destroy()
 
 
@@ -594,4 +710,4 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = SpotifyStyleApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
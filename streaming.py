@@ -0,0 +1,338 @@
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+
+# Containers SDL_mixer decodes itself, with the name hint pygame wants for
+# a file object; anything else is converted on the fly.
+PLAYABLE = {".mp3": "mp3", ".ogg": "ogg", ".opus": "opus", ".flac": "flac", ".wav": "wav"}
+# Audio buffered before playback starts.
+PREBUFFER_SECONDS = 4
+# Bytes per second assumed while a stream's size or duration is unknown.
+DEFAULT_BYTE_RATE = 24000
+# Format of the on-the-fly conversion.
+LIVE_BITRATE = "192k"
+READ_SIZE = 64 * 1024
+
+
+class Spool:
+    # A file one thread writes while others read it as it grows. The
+    # writer owns the file and only reports on it: open() once the file
+    # exists, grow() after each flushed write, then finish() or fail().
+    # Readers go through a descriptor opened at open(), so the file can be
+    # renamed or unlinked once it is complete without pulling the data out
+    # from under playback.
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.read_lock = threading.Lock()
+        self.fd = None
+        self.path = None
+        self.size = 0
+        self.total = None
+        self.done = False
+        self.error = None
+        self.closed = False
+        # Set by whoever plays from the spool; unwanted spools drop their
+        # descriptor as soon as the download is complete. Readers hold()
+        # it while they play and release() it after.
+        self.wanted = False
+        self.holds = 0
+        self.opened_at = None
+        self.opened_size = 0
+        # Seconds of audio in the whole file, when the writer knows.
+        self.duration = None
+
+    def open(self, path, size=0, total=None):
+        with self.condition:
+            if self.closed:
+                return
+            if self.fd is None:
+                self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                self.path = str(path)
+            self.size = size
+            self.total = total or self.total
+            self.opened_at = time.monotonic()
+            self.opened_size = size
+            self.condition.notify_all()
+
+    def grow(self, size, total=None):
+        with self.condition:
+            self.size = size
+            self.total = total or self.total
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.total = self.size
+            self.condition.notify_all()
+            if not self.wanted:
+                self._close_fd()
+
+    def fail(self, error):
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+            if not self.wanted:
+                self._close_fd()
+
+    def hold(self):
+        with self.condition:
+            self.holds += 1
+            self.wanted = True
+
+    def release(self):
+        # The last reader gone: the descriptor goes once the writer is
+        # done with the file too, as for a spool nobody wanted. The spool
+        # itself belongs to the writer and stays open for whoever reads it
+        # next.
+        with self.condition:
+            self.holds = max(0, self.holds - 1)
+            self.condition.notify_all()
+            if not self.holds:
+                self.wanted = False
+                if self.done or self.error is not None:
+                    self._close_fd()
+
+    def close(self):
+        # Wakes any reader waiting for data; they see the end of the file.
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            self._close_fd()
+
+    def _close_fd(self):
+        with self.read_lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    @property
+    def ended(self):
+        return self.done or self.error is not None or self.closed
+
+    def wait(self, predicate, timeout=None):
+        # Until predicate(spool) holds or nothing more is coming.
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self) or self.ended, timeout)
+
+    def rate(self):
+        # Bytes per second written since open(), None until measurable.
+        if self.opened_at is None:
+            return None
+        elapsed = time.monotonic() - self.opened_at
+        if elapsed < 0.2 or self.size <= self.opened_size:
+            return None
+        return (self.size - self.opened_size) / elapsed
+
+    def read_at(self, pos, n):
+        # Blocks until data past pos arrives; b"" means the end.
+        with self.condition:
+            self.condition.wait_for(lambda: self.fd is not None and (self.size > pos or self.ended)
+                                    or self.closed or self.error is not None)
+            if self.fd is None or self.closed:
+                return b""
+            n = min(n, self.size - pos)
+        if n <= 0:
+            return b""
+        with self.read_lock:
+            if self.fd is None:
+                return b""
+            os.lseek(self.fd, pos, os.SEEK_SET)
+            return os.read(self.fd, n)
+
+    def reader(self):
+        return SpoolReader(self)
+
+
+class SpoolReader(io.RawIOBase):
+    # A file object over a spool, for pygame.mixer.music.load(). Seeking
+    # from the end waits until the size is known.
+
+    def __init__(self, spool):
+        super().__init__()
+        self.spool = spool
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.spool.read_at(self.pos, len(buffer))
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.spool.wait(lambda s: s.total is not None)
+            self.pos = (self.spool.total if self.spool.total is not None else self.spool.size) + offset
+        self.pos = max(0, self.pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+def _convert(source, dest_path, output):
+    # ffmpeg reading the source spool as it grows and writing MP3 into
+    # another; returns the process.
+    process = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-i", "pipe:0",
+         "-vn", "-c:a", "libmp3lame", "-b:a", LIVE_BITRATE, "-f", "mp3", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+
+    def feed():
+        reader = source.reader()
+        try:
+            while True:
+                data = reader.read(READ_SIZE)
+                if not data:
+                    break
+                process.stdin.write(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def drain():
+        written = 0
+        with open(dest_path, 'wb') as f:
+            output.open(dest_path)
+            while True:
+                data = process.stdout.read1(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                f.flush()
+                written += len(data)
+                output.grow(written)
+        if process.wait() == 0 and source.done:
+            output.finish()
+        else:
+            output.fail("conversion stopped")
+
+    threading.Thread(target=feed, name="live-feed", daemon=True).start()
+    threading.Thread(target=drain, name="live-drain", daemon=True).start()
+    return process
+
+
+class LiveStream:
+    # What the player reads while a track is still downloading: the
+    # download's own spool when SDL_mixer can decode its format, otherwise
+    # an MP3 spool ffmpeg fills from it on the fly. The download itself is
+    # untouched and goes on into the library as usual; the download's spool
+    # is only held, never closed, so the same download can be streamed
+    # again.
+
+    def __init__(self, source, scratch_dir, duration=0):
+        self.source = source
+        self.source.hold()
+        self.closed = False
+        self.scratch_dir = Path(scratch_dir)
+        self.given_duration = duration or 0
+        self.spool = None
+        self.namehint = None
+        self.process = None
+        self.scratch = None
+
+    def wait_ready(self, timeout=None, prebuffer=PREBUFFER_SECONDS):
+        # Blocks until playback can start and is not expected to catch up
+        # with the download: PREBUFFER_SECONDS are in, and at the rate it
+        # has been arriving the rest lands before playback gets there.
+        # False if the download failed or it took longer than timeout.
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        if not self.source.wait(lambda s: s.fd is not None or self.closed, remaining()):
+            return False
+        if self.closed or self.source.fd is None:
+            return False
+        if not self.source.wait(lambda s: self._keeps_up(prebuffer) or self.closed, remaining()):
+            return False
+        if self.closed or self.source.error is not None or self.source.closed:
+            return False
+        if self.spool is None:
+            self._open_output()
+        wanted = prebuffer * DEFAULT_BYTE_RATE
+        return self.spool.wait(lambda s: s.size >= wanted, remaining()) and self.spool.error is None
+
+    @property
+    def duration(self):
+        # As the caller gave it, or else as the download reports it.
+        return self.given_duration or self.source.duration or 0
+
+    def _keeps_up(self, prebuffer):
+        spool = self.source
+        duration = self.duration
+        if spool.total is None or not duration:
+            return spool.size >= prebuffer * DEFAULT_BYTE_RATE
+        if spool.size < min(spool.total, prebuffer * spool.total / duration):
+            return False
+        rate = spool.rate()
+        if rate is None:
+            return False
+        return (spool.total - spool.size) / rate < duration * 0.9
+
+    def _open_output(self):
+        name = Path(self.source.path.removesuffix(".part")).name
+        suffix = Path(name).suffix.lower()
+        if suffix in PLAYABLE or shutil.which("ffmpeg") is None:
+            # Without ffmpeg, let SDL try whatever it is.
+            self.spool = self.source
+            self.namehint = PLAYABLE.get(suffix, suffix.lstrip("."))
+            return
+        self.spool = Spool()
+        self.spool.wanted = True
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+        self.scratch = self.scratch_dir / f"{name.split('.')[0]}.live.mp3"
+        self.process = _convert(self.source, self.scratch, self.spool)
+        self.spool.wait(lambda s: s.fd is not None)
+        self.namehint = "mp3"
+
+    def reader(self):
+        return self.spool.reader()
+
+    def buffered(self):
+        # Seconds of audio that can be played (or sought to) right now.
+        spool = self.source
+        duration = self.duration
+        if spool.done:
+            return duration
+        if spool.total and duration:
+            return spool.size / spool.total * duration
+        return spool.size / DEFAULT_BYTE_RATE
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.source.release()
+        if self.spool is not None and self.spool is not self.source:
+            self.spool.close()
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        if self.scratch is not None:
+            try:
+                self.scratch.unlink()
+            except OSError:
+                pass
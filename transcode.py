@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+
+
+# ffprobe codec name -> (ffmpeg encoder, file extension)
+CODECS = {
+    "mp3": ("libmp3lame", ".mp3"),
+    "aac": ("aac", ".m4a"),
+    "opus": ("libopus", ".opus"),
+    "vorbis": ("libvorbis", ".ogg"),
+    "flac": ("flac", ".flac"),
+}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class TranscodeSettings:
+    def __init__(self, codec="mp3", bitrate="192k", remux_codecs=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.codec = codec
+        self.bitrate = bitrate
+        # Sources already in one of these codecs are stream-copied into
+        # their own container instead of being re-encoded.
+        self.remux_codecs = tuple(remux_codecs) if remux_codecs is not None else (codec,)
+
+    @classmethod
+    def from_env(cls):
+        codec = os.environ.get("MUSIC_TRANSCODE_CODEC", "mp3")
+        remux = os.environ.get("MUSIC_TRANSCODE_REMUX")
+        return cls(codec=codec,
+                   bitrate=os.environ.get("MUSIC_TRANSCODE_BITRATE", "192k"),
+                   remux_codecs=remux.split(",") if remux else None)
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def probe(path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "stream=codec_name,bit_rate,sample_rate,channels:format=duration",
+         "-of", "json", str(path)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise TranscodeError(f"ffprobe failed: {result.stderr.strip()}")
+    info = json.loads(result.stdout)
+    streams = info.get("streams") or [{}]
+    stream = streams[0]
+    return {
+        "codec": stream.get("codec_name"),
+        "bit_rate": int(stream["bit_rate"]) if stream.get("bit_rate") else None,
+        "sample_rate": int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+        "channels": stream.get("channels"),
+        "duration": float(info.get("format", {}).get("duration") or 0),
+    }
+
+
+def transcode_file(source, dest_dir, stem, settings):
+    source = Path(source)
+    dest_dir = Path(dest_dir)
+
+    if not ffmpeg_available():
+        dest = dest_dir / (stem + CODECS[settings.codec][1])
+        os.replace(source, dest)
+        return {"path": str(dest), "codec": None, "remuxed": True, "duration": 0}
+
+    info = probe(source)
+    remux = info["codec"] in settings.remux_codecs and info["codec"] in CODECS
+    if remux:
+        codec_args = ["-c:a", "copy"]
+        ext = CODECS[info["codec"]][1]
+    else:
+        encoder, ext = CODECS[settings.codec]
+        codec_args = ["-c:a", encoder]
+        if settings.codec != "flac":
+            codec_args += ["-b:a", settings.bitrate]
+
+    dest = dest_dir / (stem + ext)
+    tmp = dest_dir / (stem + ".part" + ext)
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+         "-i", str(source), "-map", "0:a:0", "-vn", *codec_args, str(tmp)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        if tmp.exists():
+            tmp.unlink()
+        raise TranscodeError(f"ffmpeg failed: {result.stderr.strip()}")
+
+    os.replace(tmp, dest)
+    if source != dest:
+        source.unlink()
+    return {
+        "path": str(dest),
+        "codec": info["codec"] if remux else settings.codec,
+        "remuxed": remux,
+        "duration": info["duration"],
+    }
+
+
+class Transcoder:
+    # The encoding itself happens in ffmpeg child processes, so the pool
+    # only has to bound how many run at once; threads are enough for that.
+
+    def __init__(self, settings=None, workers=None):
+        self.settings = settings or TranscodeSettings.from_env()
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                           thread_name_prefix="transcode")
+
+    def submit(self, source, dest_dir, stem, on_done=None):
+        return self.executor.submit(self._run, source, dest_dir, stem, on_done)
+
+    def _run(self, source, dest_dir, stem, on_done):
+        with metrics.span("transcode"):
+            result = transcode_file(source, dest_dir, stem, self.settings)
+        if on_done:
+            on_done(result)
+        return result
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,157 @@
+import tkinter as tk
+import tkinter.font as tkfont
+
+import metrics
+
+
+class VirtualListbox(tk.Listbox):
+    # Only the rows in view (plus a few below the fold) exist in Tk; the
+    # items themselves stay in a Python sequence and are formatted on
+    # demand as the view scrolls. Indices passed in and out of this widget
+    # are always positions in that sequence.
+
+    def __init__(self, master=None, buffer_rows=5, on_reach_end=None, **kwargs):
+        self.yscrollcommand = kwargs.pop("yscrollcommand", None)
+        self.on_reach_end = on_reach_end
+        kwargs.setdefault("exportselection", False)
+        super().__init__(master, **kwargs)
+        self.buffer_rows = buffer_rows
+        self.items = []
+        self.formatter = str
+        self.top = 0
+        self.visible_rows = 1
+        self.selected = None
+
+        self.bind("<Configure>", self._on_configure)
+        self.bind("<<ListboxSelect>>", self._on_select)
+        self.bind("<MouseWheel>", self._on_mousewheel)
+        self.bind("<Button-4>", lambda e: self._scroll_by(-3))
+        self.bind("<Button-5>", lambda e: self._scroll_by(3))
+        self.bind("<Up>", lambda e: self._move_selection(-1))
+        self.bind("<Down>", lambda e: self._move_selection(1))
+        self.bind("<Prior>", lambda e: self._move_selection(-self.visible_rows))
+        self.bind("<Next>", lambda e: self._move_selection(self.visible_rows))
+        self.bind("<Home>", lambda e: self._move_selection(-len(self.items)))
+        self.bind("<End>", lambda e: self._move_selection(len(self.items)))
+        # Tk's autoscan would scroll the materialized buffer itself.
+        self.bind("<B1-Leave>", lambda e: "break")
+
+    def set_items(self, items, formatter=None, keep_position=False):
+        self.items = items
+        if formatter is not None:
+            self.formatter = formatter
+        if keep_position:
+            self.refresh()
+            return
+        self.top = 0
+        self.selected = None
+        self._render()
+
+    def extend(self, items):
+        self.items.extend(items)
+        self._render()
+
+    def refresh(self):
+        self.top = max(0, min(self.top, len(self.items) - self.visible_rows))
+        if self.selected is not None and self.selected >= len(self.items):
+            self.selected = None
+        self._render()
+
+    def curselection(self):
+        if self.selected is None or self.selected >= len(self.items):
+            return ()
+        return (self.selected,)
+
+    def select(self, index):
+        if not 0 <= index < len(self.items):
+            return
+        self.selected = index
+        if not self.top <= index < self.top + self.visible_rows:
+            self.see(index)
+        else:
+            self._apply_selection()
+
+    def nearest(self, y):
+        return min(self.top + super().nearest(y), len(self.items) - 1)
+
+    def see(self, index):
+        if index < self.top:
+            self._scroll_to(index)
+        elif index >= self.top + self.visible_rows:
+            self._scroll_to(index - self.visible_rows + 1)
+
+    def yview(self, *args):
+        if not args:
+            return self._fractions()
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.visible_rows
+            self._scroll_by(amount)
+
+    def _fractions(self):
+        total = len(self.items)
+        if not total:
+            return 0.0, 1.0
+        return self.top / total, min(1.0, (self.top + self.visible_rows) / total)
+
+    def _line_height(self):
+        font = tkfont.Font(font=self.cget("font"))
+        return font.metrics("linespace") + 1 + 2 * int(self.cget("selectborderwidth"))
+
+    def _on_configure(self, event):
+        inner = event.height - 2 * (int(self.cget("borderwidth")) + int(self.cget("highlightthickness")))
+        rows = max(1, inner // self._line_height())
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.refresh()
+
+    def _on_select(self, event):
+        local = super().curselection()
+        if local:
+            self.selected = self.top + local[0]
+
+    def _on_mousewheel(self, event):
+        if abs(event.delta) >= 120:
+            return self._scroll_by(-(event.delta // 120) * 3)
+        return self._scroll_by(-event.delta)
+
+    def _scroll_by(self, amount):
+        self._scroll_to(self.top + amount)
+        return "break"
+
+    def _scroll_to(self, top):
+        top = max(0, min(top, len(self.items) - self.visible_rows))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _move_selection(self, delta):
+        if not self.items:
+            return "break"
+        start = self.selected if self.selected is not None else self.top - (delta > 0)
+        self.select(max(0, min(start + delta, len(self.items) - 1)))
+        return "break"
+
+    def _render(self):
+        with metrics.span("list_render"):
+            super().delete(0, tk.END)
+            end = min(len(self.items), self.top + self.visible_rows + self.buffer_rows)
+            if end > self.top:
+                formatter = self.formatter
+                super().insert(tk.END, *(formatter(item) for item in self.items[self.top:end]))
+            super().yview_moveto(0)
+            self._apply_selection()
+            if self.yscrollcommand:
+                self.yscrollcommand(*self._fractions())
+        if self.on_reach_end and self.items and end >= len(self.items):
+            self.on_reach_end()
+
+    def _apply_selection(self):
+        super().selection_clear(0, tk.END)
+        if self.selected is not None and self.top <= self.selected < self.top + self.visible_rows + self.buffer_rows:
+            local = self.selected - self.top
+            super().selection_set(local)
+            super().activate(local)
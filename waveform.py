@@ -0,0 +1,203 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from content_store import durable_replace
+from pcm import decode_blocks
+
+
+MAGIC = b"PEAK"
+VERSION = 1
+# magic, version, level count, sample rate, samples per bucket at level 0,
+# total samples, source mtime, source size
+HEADER = struct.Struct("<4sHHIIQdQ")
+# byte offset and bucket count of each level
+LEVEL = struct.Struct("<QQ")
+BASE_BUCKET = 512
+# Levels stop halving once they are this small.
+MIN_BUCKETS = 16
+
+
+class PeakBuilder:
+    # Min/max of every BASE_BUCKET samples (all channels together) as int8,
+    # fed a decoded block at a time. Only the leftover partial bucket is
+    # carried between blocks.
+
+    def __init__(self, rate, channels):
+        import numpy as np
+
+        self.np = np
+        self.rate = rate
+        self.samples = 0
+        self.rest_lo = np.zeros(0, dtype=np.float32)
+        self.rest_hi = np.zeros(0, dtype=np.float32)
+        self.mins = []
+        self.maxs = []
+
+    def add(self, block):
+        np = self.np
+        if len(block) == 0:
+            return
+        self.samples += len(block)
+        lo = np.concatenate([self.rest_lo, block.min(axis=1)])
+        hi = np.concatenate([self.rest_hi, block.max(axis=1)])
+        whole = len(lo) // BASE_BUCKET * BASE_BUCKET
+        self.rest_lo, self.rest_hi = lo[whole:], hi[whole:]
+        if whole:
+            self.mins.append(lo[:whole].reshape(-1, BASE_BUCKET).min(axis=1))
+            self.maxs.append(hi[:whole].reshape(-1, BASE_BUCKET).max(axis=1))
+
+    def levels(self):
+        # [(mins, maxs)] from finest to coarsest, as int8 arrays; each level
+        # pairs up the buckets of the one before.
+        np = self.np
+        mins = list(self.mins)
+        maxs = list(self.maxs)
+        if len(self.rest_lo):
+            mins.append(self.rest_lo.min(keepdims=True))
+            maxs.append(self.rest_hi.max(keepdims=True))
+        if not mins:
+            return []
+        lo = np.round(np.clip(np.concatenate(mins), -1, 1) * 127).astype(np.int8)
+        hi = np.round(np.clip(np.concatenate(maxs), -1, 1) * 127).astype(np.int8)
+        levels = [(lo, hi)]
+        while len(lo) > MIN_BUCKETS:
+            if len(lo) % 2:
+                lo, hi = np.append(lo, lo[-1]), np.append(hi, hi[-1])
+            lo = np.minimum(lo[0::2], lo[1::2])
+            hi = np.maximum(hi[0::2], hi[1::2])
+            levels.append((lo, hi))
+        return levels
+
+    def write(self, path, source_stat):
+        np = self.np
+        levels = self.levels()
+        offset = HEADER.size + LEVEL.size * len(levels)
+        table = []
+        for lo, hi in levels:
+            table.append(LEVEL.pack(offset, len(lo)))
+            offset += 2 * len(lo)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(levels), self.rate, BASE_BUCKET, self.samples,
+                                source_stat.st_mtime, source_stat.st_size))
+            f.write(b"".join(table))
+            for lo, hi in levels:
+                # min, max interleaved per bucket
+                f.write(np.stack([lo, hi], axis=1).tobytes())
+        durable_replace(tmp, path)
+
+
+class PeakFile:
+    # A .peaks file, memory-mapped. render() reads only the buckets of the
+    # level that best matches the requested width, so drawing costs
+    # O(width) whatever the track length.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, level_count, self.rate, self.base, self.samples,
+         self.source_mtime, self.source_size) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError(f"Not a peak file: {path}")
+        self.values = memoryview(self.data).cast("b")
+        self.levels = [LEVEL.unpack_from(self.data, HEADER.size + i * LEVEL.size)
+                       for i in range(level_count)]
+
+    @property
+    def duration(self):
+        return self.samples / self.rate if self.rate else 0.0
+
+    def matches(self, stat):
+        return self.source_mtime == stat.st_mtime and self.source_size == stat.st_size
+
+    def render(self, width, start=0.0, end=None):
+        # (min, max) in -1..1 for each of `width` columns covering
+        # start..end seconds.
+        if width <= 0 or not self.levels:
+            return []
+        end = self.duration if end is None else end
+        level = 0
+        for i, (_, count) in enumerate(self.levels):
+            span = (end - start) * self.rate / (self.base << i)
+            if span >= width or i == 0:
+                level = i
+        offset, count = self.levels[level]
+        per_bucket = (self.base << level) / self.rate
+        first = start / per_bucket
+        step = (end - start) / per_bucket / width
+        values = self.values
+        columns = []
+        for x in range(width):
+            a = int(first + x * step)
+            if a >= count:
+                columns.append((0.0, 0.0))
+                continue
+            b = min(count, max(a + 1, int(first + (x + 1) * step)))
+            lo = min(values[offset + 2 * i] for i in range(a, b))
+            hi = max(values[offset + 2 * i + 1] for i in range(a, b))
+            columns.append((lo / 127, hi / 127))
+        return columns
+
+    def close(self):
+        self.values.release()
+        self.data.close()
+
+
+def peaks_path(audio_path, music_dir, store_root):
+    # Next to the audio for files in the content store (named by hash, so
+    # the peaks are too); files imported in place get theirs under
+    # music_dir/peaks rather than in the user's own folders.
+    audio_path = str(audio_path)
+    if os.path.realpath(audio_path).startswith(os.path.realpath(store_root) + os.sep):
+        return audio_path + ".peaks"
+    digest = hashlib.sha1(os.path.realpath(audio_path).encode()).hexdigest()
+    return os.path.join(music_dir, "peaks", digest[:2], digest + ".peaks")
+
+
+def open_peaks(audio_path, dest):
+    # The peak file for audio_path if it exists and is up to date.
+    try:
+        stat = os.stat(audio_path)
+        peaks = PeakFile(dest)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not peaks.matches(stat):
+        peaks.close()
+        return None
+    return peaks
+
+
+def generate_peaks(audio_path, dest):
+    stat = os.stat(audio_path)
+    builder = None
+    for rate, channels, block in decode_blocks(audio_path):
+        if builder is None:
+            builder = PeakBuilder(rate, channels)
+        builder.add(block)
+    if builder is None:
+        return False
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    builder.write(dest, stat)
+    return True
+
+
+def _generate(job):
+    try:
+        return generate_peaks(*job)
+    except Exception:
+        return False
+
+
+def generate_many(jobs, workers=None):
+    # jobs: (audio path, peaks path) pairs. Yields (job, ok) in order.
+    jobs = list(jobs)
+    if not jobs:
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield from zip(jobs, executor.map(_generate, jobs))
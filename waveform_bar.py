@@ -0,0 +1,116 @@
+import tkinter as tk
+
+
+class WaveformBar(tk.Canvas):
+    # The track's waveform as a seek bar: one vertical line per pixel
+    # column, drawn from the precomputed peak file (never the audio), so a
+    # redraw costs O(width). Position updates only recolour the columns the
+    # play head has passed since the last one. Without peaks it is a flat
+    # line that still seeks.
+
+    def __init__(self, master=None, on_seek=None, on_scrub=None,
+                 played="#1DB954", unplayed="#535353", **kwargs):
+        kwargs.setdefault("height", 32)
+        kwargs.setdefault("highlightthickness", 0)
+        kwargs.setdefault("cursor", "hand2")
+        super().__init__(master, **kwargs)
+        self.on_seek = on_seek
+        self.on_scrub = on_scrub
+        self.played = played
+        self.unplayed = unplayed
+        self.duration = 0
+        self.peaks = None
+        self.position = 0.0
+        self.played_x = 0
+        self.columns = []
+        self.dragging = False
+
+        self.bind("<Configure>", lambda e: self.redraw())
+        self.bind("<ButtonPress-1>", self._on_press)
+        self.bind("<B1-Motion>", self._on_drag)
+        self.bind("<ButtonRelease-1>", self._on_release)
+
+    def set_track(self, duration, peaks=None):
+        self.duration = duration or (peaks.duration if peaks is not None else 0)
+        self.position = 0.0
+        self.set_peaks(peaks)
+
+    def set_peaks(self, peaks):
+        if self.peaks is not None:
+            self.peaks.close()
+        self.peaks = peaks
+        if not self.duration and peaks is not None:
+            self.duration = peaks.duration
+        self.redraw()
+
+    def get(self):
+        return self.position
+
+    def set(self, pos):
+        if self.dragging:
+            return
+        self._move_to(pos)
+
+    def redraw(self):
+        self.delete("all")
+        width, height = self.winfo_width(), self.winfo_height()
+        if width <= 1:
+            return
+        if self.peaks is not None and self.duration:
+            # Past the end of the peaks (the tagged duration can run a bit
+            # long) is drawn flat.
+            columns = self.peaks.render(width, 0, self.duration)
+        else:
+            columns = [(0.0, 0.0)] * width
+        middle = height / 2
+        scale = height / 2 - 1
+        self.columns = []
+        for x, (lo, hi) in enumerate(columns):
+            top = middle - max(hi, 0.03) * scale
+            bottom = middle - min(lo, -0.03) * scale
+            self.columns.append(self.create_line(x, top, x, bottom + 1, fill=self.unplayed))
+        self.played_x = 0
+        self._recolor(self._x_for(self.position))
+
+    def _x_for(self, pos):
+        if not self.duration or not self.columns:
+            return 0
+        return max(0, min(len(self.columns), round(pos / self.duration * len(self.columns))))
+
+    def _move_to(self, pos):
+        self.position = max(0.0, min(pos, self.duration)) if self.duration else 0.0
+        self._recolor(self._x_for(self.position))
+
+    def _recolor(self, x):
+        if x > self.played_x:
+            for item in self.columns[self.played_x:x]:
+                self.itemconfigure(item, fill=self.played)
+        elif x < self.played_x:
+            for item in self.columns[x:self.played_x]:
+                self.itemconfigure(item, fill=self.unplayed)
+        self.played_x = x
+
+    def _pos_at(self, x):
+        width = max(1, self.winfo_width())
+        return max(0.0, min(1.0, x / width)) * self.duration
+
+    def _on_press(self, event):
+        if not self.duration:
+            return
+        self.dragging = True
+        self._on_drag(event)
+
+    def _on_drag(self, event):
+        if not self.dragging:
+            return
+        self._move_to(self._pos_at(event.x))
+        if self.on_scrub:
+            self.on_scrub(self.position)
+
+    def _on_release(self, event):
+        if not self.dragging:
+            return
+        self._move_to(self._pos_at(event.x))
+        self.dragging = False
+        if self.on_seek:
+            self.on_seek(self.position)